@@ -0,0 +1,95 @@
+import collections
+
+import numpy as np
+
+AtmosphereState = collections.namedtuple('AtmosphereState', ['density', 'dynamic_viscosity', 'temperature',
+                                                             'speed_of_sound', 'pressure'])
+
+
+class Atmosphere:
+    """ Definitely a class
+    International Standard Atmosphere tabulated once on an evenly spaced altitude grid, so a lookup is an index,
+    a weight and one linear blend of neighbouring rows for every column at once. Altitudes are geopotential meters
+    and may be scalars or arrays. temperature_offset gives a non-standard day: temperatures are shifted by that many
+    Kelvin at the standard pressure of each altitude, which changes density, viscosity and speed of sound.
+
+    Documentation:
+    U.S. Standard Atmosphere, 1976. NOAA, NASA and USAF. Sutherland's law for the dynamic viscosity of air.
+    """
+
+    columns = {'density': 0, 'dynamic_viscosity': 1, 'temperature': 2, 'speed_of_sound': 3, 'pressure': 4}
+
+    def __init__(self, temperature_offset=0, lowest_altitude=-1000, highest_altitude=20000, altitude_step=10):
+        self.temperature_offset = temperature_offset
+        self.lowest_altitude = lowest_altitude
+        self.highest_altitude = highest_altitude
+        self.altitude_step = altitude_step
+        self.altitudes = np.arange(lowest_altitude, highest_altitude + altitude_step, altitude_step, dtype=float)
+        self.table = self.tabulate(self.altitudes)
+        self.rows = self.table.tolist()
+        # A standard day's, so the density ratio of a hot or cold day carries its penalty even at sea level
+        self.sea_level_density = 101325 / (287.05287 * 288.15)
+
+    def tabulate(self, altitudes):
+        """ Rows of [density, dynamic viscosity, temperature, speed of sound, pressure] in SI units. """
+        gas_constant = 287.05287  # J / (kg K)
+        standard_temperature = np.where(altitudes < 11000, 288.15 - 0.0065 * altitudes, 216.65)
+        pressure = np.where(altitudes < 11000,
+                            101325 * (standard_temperature / 288.15) ** (9.80665 / (0.0065 * gas_constant)),
+                            22632.06 * np.exp(-9.80665 * (altitudes - 11000) / (gas_constant * 216.65)))
+        temperature = standard_temperature + self.temperature_offset
+        density = pressure / (gas_constant * temperature)
+        dynamic_viscosity = 1.458e-6 * temperature ** 1.5 / (temperature + 110.4)  # Sutherland's law
+        speed_of_sound = (1.4 * gas_constant * temperature) ** 0.5
+        return np.column_stack([density, dynamic_viscosity, temperature, speed_of_sound, pressure])
+
+    def interpolate(self, altitude, column=None):
+        """ One column of the table at altitude, or every column along a trailing axis when column is None. """
+        if isinstance(altitude, (int, float)):  # plain numbers skip NumPy, whose overhead dwarfs the blend itself
+            if not self.lowest_altitude <= altitude <= self.highest_altitude:
+                raise self.altitude_error()
+            position = (altitude - self.lowest_altitude) / self.altitude_step
+            index = min(int(position), len(self.rows) - 2)
+            weight = position - index
+            [lower, upper] = self.rows[index:index + 2]
+            if column is None:
+                return [low + weight * (high - low) for low, high in zip(lower, upper)]
+            return lower[column] + weight * (upper[column] - lower[column])
+        altitude = np.asarray(altitude, dtype=float)
+        if altitude.size and (altitude.min() < self.lowest_altitude or altitude.max() > self.highest_altitude):
+            raise self.altitude_error()
+        position = (altitude - self.lowest_altitude) / self.altitude_step
+        index = np.minimum(position.astype(int), len(self.rows) - 2)
+        weight = position - index
+        if column is None:
+            weight = weight[..., np.newaxis]
+            lower = self.table[index]
+            return lower + weight * (self.table[index + 1] - lower)
+        lower = self.table[index, column]
+        return lower + weight * (self.table[index + 1, column] - lower)
+
+    def altitude_error(self):
+        return ValueError("altitude must be between {} and {} meters".format(self.lowest_altitude,
+                                                                             self.highest_altitude))
+
+    def lookup(self, altitude):
+        """ Density, dynamic viscosity, temperature, speed of sound and pressure from one pass over the table. """
+        values = self.interpolate(altitude)
+        if isinstance(values, list):
+            return AtmosphereState(*values)
+        return AtmosphereState(*[values[..., column] for column in range(len(self.columns))])
+
+    def calculate_density(self, altitude):
+        """ kilograms per cubic meter """
+        return self.interpolate(altitude, self.columns['density'])
+
+    def calculate_density_ratio(self, altitude):
+        """ Density over the standard day's at sea level. """
+        return self.calculate_density(altitude) / self.sea_level_density
+
+    def calculate_dynamic_viscosity(self, altitude):
+        """ Pascal seconds """
+        return self.interpolate(altitude, self.columns['dynamic_viscosity'])
+
+
+STANDARD_ATMOSPHERE = Atmosphere()
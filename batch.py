@@ -0,0 +1,180 @@
+""" Sizes design cases read line by line from JSONL and writes one JSON result line per case.
+
+    python batch.py cases.jsonl -o results.jsonl --workers 8 --trend fleet=fleet.json
+
+Each input line is an object such as
+    {"name": "droan", "parameters": {...},
+     "mission": {"takeoff_mass_guess": 12.5, "payload": 1, "cruise_altitude": 100,
+                 "phases": [["taxi", 3, 15, 30, 0, 3, 0], {"name": "takeoff", "final_speed": 13.4, ...}]},
+     "motor": {"input_voltage": 11.1, "whole_chain_efficiency": 0.8, "max_continuous_power": 110},
+     "battery": {"nominal_cell_voltage": 11.1, "c_max": 25, "cell_capacity": 2.2, "specific_energy_density": 140},
+     "trend": "roskam_home_built",
+     "matching": {"stall": {...}, "cruise": {...}}, "method": "coupled", "acceptable_error": 0.005}
+with phases as Phase arguments in order or by name. Instead of "trend", the name of a trend that is built in or
+given with --trend, a case may list its own "similar_planes" as [takeoff_mass, empty_mass] pairs. The output lines
+are the dictionaries of trade_study.size_design_case plus the input line number, in input order. A case that
+cannot be read or sized gives {"line": ..., "name": ..., "error": "..."} and the run carries on.
+
+Only a bounded window of chunks is in flight at any time, so memory does not grow with the number of cases. """
+import argparse
+import collections
+import concurrent.futures
+import itertools
+import json
+import math
+import os
+import sys
+
+from droan_data import ROSKAM_HOME_BUILT
+from preliminary_sizing import Battery, HistoricalTrend, Mission, Motor, Phase
+from trade_study import DesignCase, size_design_case
+
+SIMILAR_PLANE_SETS = {'roskam_home_built': ROSKAM_HOME_BUILT}
+
+worker_trends = {}  # Named historical trends, fitted once in every worker process
+
+
+def create_historical_trend(similar_planes):
+    """ similar_planes is a list of [takeoff_mass, empty_mass] pairs in kilograms. """
+    historical_trend = HistoricalTrend()
+    [takeoff_masses, empty_masses] = zip(*similar_planes)
+    historical_trend.add_plane_data(takeoff_masses, empty_masses)
+    return historical_trend
+
+
+def load_trends(paths=None):
+    """ The built in similar plane sets plus one trend for every name=path, path holding a JSON list of
+    [takeoff_mass, empty_mass] pairs. """
+    similar_plane_sets = dict(SIMILAR_PLANE_SETS)
+    for name_and_path in paths or []:
+        [name, path] = name_and_path.split('=', 1)
+        with open(path) as planes:
+            similar_plane_sets[name] = json.load(planes)
+    return {name: create_historical_trend(planes) for name, planes in similar_plane_sets.items()}
+
+
+def create_phase(phase):
+    return Phase(**phase) if isinstance(phase, dict) else Phase(*phase)
+
+
+def create_design_case(record, trends):
+    mission_record = dict(record['mission'])
+    phases = mission_record.pop('phases')
+    mission = Mission(**mission_record)
+    mission.add_all_phases([create_phase(phase) for phase in phases])
+    if 'similar_planes' in record:
+        historical_trend = create_historical_trend(record['similar_planes'])
+    elif record.get('trend') in trends:
+        historical_trend = trends[record['trend']]
+    else:
+        raise ValueError("unknown trend {!r}, give one of {} or similar_planes".format(
+            record.get('trend'), sorted(trends)))
+    return DesignCase(mission, Motor(**record['motor']), Battery(**record['battery']), historical_trend,
+                      record.get('matching'), record.get('method', 'coupled'), record.get('acceptable_error', 0.005),
+                      record.get('name'), record.get('parameters'))
+
+
+def size_line(line_number, line, trends):
+    """ The result of one input line, or its error record. """
+    name = None
+    try:
+        record = json.loads(line)
+        name = record.get('name') if isinstance(record, dict) else None
+        result = size_design_case(create_design_case(record, trends))
+    except Exception as error:
+        return {'line': line_number, 'name': name, 'error': '{}: {}'.format(type(error).__name__, error)}
+    return dict(result, line=line_number)
+
+
+def initialize_worker(trends):
+    global worker_trends
+    for historical_trend in trends.values():
+        historical_trend.calculate_trend()
+    worker_trends = trends
+
+
+def replace_non_finite(value):
+    """ value with NaN and infinite floats made None, since JSON has no numbers for them. """
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {key: replace_non_finite(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [replace_non_finite(item) for item in value]
+    return value
+
+
+def size_lines(numbered_lines):
+    """ [output line, whether it is an error record] for every line, serialized in the worker. Non finite numbers
+    are written as null, so every line is strict JSON. """
+    results = [size_line(line_number, line, worker_trends) for line_number, line in numbered_lines]
+    return [[json.dumps(replace_non_finite(result), allow_nan=False), 'error' in result] for result in results]
+
+
+def read_chunks(lines, chunk_size):
+    """ Chunks of (line_number, line) for the non blank lines, counting lines from 1. """
+    numbered_lines = ((line_number, line) for line_number, line in enumerate(lines, 1) if line.strip())
+    while True:
+        chunk = list(itertools.islice(numbered_lines, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def run_batch(lines, output, trends=None, workers=1, chunk_size=64, window=None):
+    """ Writes a result line to output for every case in lines, in order. With more than one worker at most window
+    chunks (four per worker by default) are submitted and not yet written. Returns [cases, errors]. """
+    trends = trends if trends is not None else load_trends()
+    counts = [0, 0]
+
+    def write(results):
+        for [result, error] in results:
+            output.write(result + '\n')
+            counts[0] += 1
+            counts[1] += error
+
+    if workers == 1:
+        initialize_worker(trends)
+        for chunk in read_chunks(lines, chunk_size):
+            write(size_lines(chunk))
+        return counts
+    window = window if window is not None else 4 * workers
+    pending = collections.deque()
+    with concurrent.futures.ProcessPoolExecutor(workers, initializer=initialize_worker,
+                                                initargs=(trends,)) as executor:
+        for chunk in read_chunks(lines, chunk_size):
+            if len(pending) >= window:
+                write(pending.popleft().result())
+            pending.append(executor.submit(size_lines, chunk))
+        while pending:
+            write(pending.popleft().result())
+    return counts
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='Size design cases from JSONL, one result line per case.')
+    parser.add_argument('input', nargs='?', default='-', help='JSONL cases, - for standard input')
+    parser.add_argument('-o', '--output', default='-', help='JSONL results, - for standard output')
+    parser.add_argument('--workers', type=int, default=1, help='processes, 0 for every core')
+    parser.add_argument('--chunk-size', type=int, default=64, help='cases sent to a worker at a time')
+    parser.add_argument('--trend', action='append', metavar='NAME=PATH',
+                        help='a named trend from a JSON list of [takeoff_mass, empty_mass] pairs')
+    options = parser.parse_args(arguments)
+
+    trends = load_trends(options.trend)
+    workers = options.workers or os.cpu_count() or 1
+    source = sys.stdin if options.input == '-' else open(options.input)
+    destination = sys.stdout if options.output == '-' else open(options.output, 'w')
+    try:
+        [cases, errors] = run_batch(source, destination, trends, workers, options.chunk_size)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if destination is not sys.stdout:
+            destination.close()
+    print('{} cases, {} errors'.format(cases, errors), file=sys.stderr)
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
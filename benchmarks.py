@@ -0,0 +1,245 @@
+""" Timings of every sizing stage at the sizes Droan uses and at scaled up sizes, written as JSON.
+
+    python benchmarks.py                      # run everything and compare with benchmark_baseline.json
+    python benchmarks.py --quick              # realistic sizes only
+    python benchmarks.py --filter matching    # benchmarks whose name contains 'matching'
+    python benchmarks.py --save-baseline      # store this run as the new baseline
+
+The exit status is 1 when any benchmark is slower than its baseline by more than the tolerance. """
+import argparse
+import collections
+import json
+import os
+import platform
+import sys
+import timeit
+
+import numpy as np
+
+import pattern
+from droan_data import DROAN_PHASES, ROSKAM_HOME_BUILT
+from preliminary_sizing import (Battery, BatchMassIteration, BatteryPackMass, HistoricalTrend, Matching,
+                                MassIteration, Mission, MissionTable, Motor, Phase, PhasePower, SimilarPlane)
+
+Benchmark = collections.namedtuple('Benchmark', ['name', 'size', 'scaled', 'setup'])
+
+BENCHMARK_FORMAT = 1
+DEFAULT_OUTPUT = 'benchmark_results.json'
+DEFAULT_BASELINE = 'benchmark_baseline.json'
+DEFAULT_TOLERANCE = 0.25  # fractional slowdown of the best time that counts as a regression
+
+
+def create_droan_mission(number_of_phases=8):
+    """ The Droan endurance mission, or that mission's phases repeated with slightly different times until there
+    are number_of_phases distinct phases. """
+    phases = [Phase(*phase) for phase in DROAN_PHASES]
+    mission = Mission(12.5, 1, 100)
+    if number_of_phases == 8:
+        mission.add_all_phases(phases + phases[:1])
+    else:
+        mission.add_all_phases([phases[index % 7]._replace(time=phases[index % 7].time + index // 7)
+                                for index in range(number_of_phases)])
+    return mission
+
+
+def create_historical_trend(number_of_planes=22):
+    """ Roskam's home built planes, or a synthetic fleet of number_of_planes scattered around their trend. """
+    trend = HistoricalTrend()
+    if number_of_planes == len(ROSKAM_HOME_BUILT):
+        trend.add_similar_planes([SimilarPlane(*plane) for plane in ROSKAM_HOME_BUILT])
+    else:
+        random = np.random.default_rng(0)
+        takeoff_masses = 10 ** random.uniform(1, 3.5, number_of_planes)
+        trend.add_plane_data(takeoff_masses, 0.7 * takeoff_masses ** 0.97 * random.lognormal(0, 0.1, number_of_planes))
+    return trend
+
+
+def create_droan_parts():
+    return Motor(11.1, 0.8, 110), Battery(11.1, 25, 2.2, 140)
+
+
+def setup_phase_power(number_of_phases):
+    mission = create_droan_mission(number_of_phases)
+    return lambda: PhasePower(mission)
+
+
+def setup_mission_table_energy(number_of_phases):
+    table = MissionTable.from_mission(create_droan_mission(number_of_phases))
+    return lambda: table.calculate_energy(12.5)
+
+
+def setup_battery_pack_mass(number_of_phases):
+    mission = create_droan_mission(number_of_phases)
+    PhasePower(mission)
+    [motor, battery] = create_droan_parts()
+    return lambda: BatteryPackMass(motor, mission, battery)
+
+
+def setup_trend_fit(number_of_planes):
+    """ The cached fit would only time a dictionary lookup, so every call refits. """
+    trend = create_historical_trend(number_of_planes)
+
+    def fit():
+        trend.cached_trends = {}
+        return trend.calculate_empty_mass_required(12.5)
+    return fit
+
+
+def setup_empty_mass_required(number_of_masses):
+    trend = create_historical_trend()
+    takeoff_masses = np.linspace(1, 1000, number_of_masses)
+    return lambda: trend.calculate_empty_mass_required(takeoff_masses)
+
+
+def setup_mass_iteration(method):
+    def iterate():
+        mission = create_droan_mission()
+        PhasePower(mission)
+        [motor, battery] = create_droan_parts()
+        return MassIteration(motor, mission, battery, trend, method=method)
+    trend = create_historical_trend()
+    return iterate
+
+
+def setup_batch_mass_iteration(number_of_payloads):
+    mission = create_droan_mission()
+    PhasePower(mission)
+    [motor, battery] = create_droan_parts()
+    trend = create_historical_trend()
+    payloads = np.linspace(0.5, 3, number_of_payloads)
+    return lambda: BatchMassIteration(motor, mission, battery, trend, payload=payloads)
+
+
+def setup_matching(routine, number_of_points):
+    """ One size_to_* routine, over a wing loading grid of number_of_points where the routine has one. """
+    matching = Matching(9.35, max_wing_loading=2000)
+    wing_loading = matching.create_wing_loading_grid(number_of_points)
+    routines = {
+        'stall': lambda: matching.size_to_stall(1000, 1.5, 13),
+        'landing': lambda: matching.size_to_landing(1000, 100, 1.5),
+        'takeoff': lambda: matching.calculate_takeoff_power_loading(wing_loading, 100, 1000, 1.5),
+        'climb': lambda: matching.calculate_climb_power_loading(wing_loading, 9.35, 1000, 22.4, 8, 2.54,
+                                                                gear_down=True),
+        'cruise': lambda: matching.calculate_cruise_power_loading(wing_loading, 22.5, 100, 0.5, 9.35, 10),
+        'design_point': lambda: matching.solve_design_point(
+            stall=dict(altitude=1000, max_clean_cl=3.0, stall_speed=13),
+            takeoff=dict(takeoff_field_length=100, altitude=1000, max_takeoff_cl=2.0),
+            climb=dict(mass=9.35, altitude=1000, speed=22.4, aspect_ratio=8, rate_of_climb=2.54, gear_down=True),
+            cruise=dict(speed=22.5, altitude=100, cruise_lift_coefficient=0.5, mass=9.35, aspect_ratio=10))}
+    return routines[routine]
+
+
+def setup_pattern_shape(number_of_airfields):
+    field_lengths = np.linspace(150, 1500, number_of_airfields).tolist()
+    return lambda: [pattern.Shape(field_length, 3, 30, 2.54, 75, 13.4, 0) for field_length in field_lengths]
+
+
+def setup_pattern_shapes(number_of_airfields):
+    field_lengths = np.linspace(150, 1500, number_of_airfields)
+    return lambda: pattern.PatternShapes(field_lengths, 3, 30, 2.54, 75, 13.4, 0)
+
+
+def create_benchmarks():
+    benchmarks = []
+    for size, scaled in [(8, False), (10 ** 4, True)]:
+        benchmarks.append(Benchmark('phase_power', size, scaled, lambda size=size: setup_phase_power(size)))
+        benchmarks.append(Benchmark('mission_table_energy', size, scaled,
+                                    lambda size=size: setup_mission_table_energy(size)))
+        benchmarks.append(Benchmark('battery_pack_mass', size, scaled,
+                                    lambda size=size: setup_battery_pack_mass(size)))
+    for size, scaled in [(22, False), (10 ** 5, True)]:
+        benchmarks.append(Benchmark('trend_fit', size, scaled, lambda size=size: setup_trend_fit(size)))
+    for size, scaled in [(1, False), (10 ** 6, True)]:
+        benchmarks.append(Benchmark('empty_mass_required', size, scaled,
+                                    lambda size=size: setup_empty_mass_required(size)))
+    for method in ['fixed_point', 'coupled']:
+        benchmarks.append(Benchmark('mass_iteration_' + method, 1, False,
+                                    lambda method=method: setup_mass_iteration(method)))
+    for size, scaled in [(100, False), (10 ** 4, True)]:
+        benchmarks.append(Benchmark('batch_mass_iteration', size, scaled,
+                                    lambda size=size: setup_batch_mass_iteration(size)))
+    for routine in ['stall', 'landing', 'design_point']:
+        benchmarks.append(Benchmark('matching_' + routine, 1, False,
+                                    lambda routine=routine: setup_matching(routine, None)))
+    for routine in ['takeoff', 'climb', 'cruise']:
+        for size, scaled in [(2000, False), (10 ** 6, True)]:
+            benchmarks.append(Benchmark('matching_' + routine, size, scaled,
+                                        lambda routine=routine, size=size: setup_matching(routine, size)))
+    for size, scaled in [(1, False), (10 ** 4, True)]:
+        benchmarks.append(Benchmark('pattern_shape', size, scaled, lambda size=size: setup_pattern_shape(size)))
+        benchmarks.append(Benchmark('pattern_shapes', size, scaled, lambda size=size: setup_pattern_shapes(size)))
+    return benchmarks
+
+
+def time_benchmark(function, repeats=5, minimum_time=0.2):
+    """ Best and median seconds per call over repeats rounds, each long enough to reach minimum_time. """
+    timer = timeit.Timer(function)
+    number = 1
+    while timer.timeit(number) < minimum_time / repeats and number < 10 ** 6:
+        number *= 10
+    times = [time / number for time in timer.repeat(repeats, number)]
+    return {'best': min(times), 'median': float(np.median(times)), 'calls': number * repeats}
+
+
+def run_benchmarks(benchmarks, repeats=5, minimum_time=0.2, report=None):
+    results = collections.OrderedDict()
+    for benchmark in benchmarks:
+        key = '{}[{}]'.format(benchmark.name, benchmark.size)
+        results[key] = dict(time_benchmark(benchmark.setup(), repeats, minimum_time), name=benchmark.name,
+                            size=benchmark.size, scaled=benchmark.scaled)
+        if report is not None:
+            report(key, results[key])
+    return results
+
+
+def compare_with_baseline(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """ Ratio of this run's best time to the baseline's for every benchmark in both, and the keys that regressed. """
+    ratios = collections.OrderedDict()
+    for key, result in results.items():
+        if key in baseline:
+            ratios[key] = result['best'] / baseline[key]['best']
+    return ratios, [key for key, ratio in ratios.items() if ratio > 1 + tolerance]
+
+
+def describe_environment():
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(),
+            'processor': platform.processor(), 'system': platform.system()}
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='Time the Droan sizing stages.')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help='where the JSON results are written')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='JSON results to compare against')
+    parser.add_argument('--save-baseline', action='store_true', help='write the results to the baseline as well')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='fractional slowdown that counts as a regression')
+    parser.add_argument('--quick', action='store_true', help='skip the scaled up sizes')
+    parser.add_argument('--filter', default='', help='only run benchmarks whose name contains this')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--minimum-time', type=float, default=0.2, help='seconds spent on each benchmark')
+    options = parser.parse_args(arguments)
+
+    benchmarks = [benchmark for benchmark in create_benchmarks()
+                  if options.filter in benchmark.name and not (options.quick and benchmark.scaled)]
+    results = run_benchmarks(benchmarks, options.repeats, options.minimum_time, report=lambda key, result: print(
+        '{:<40} {:>12.3e} s'.format(key, result['best'])))
+    document = {'format': BENCHMARK_FORMAT, 'environment': describe_environment(), 'results': results}
+
+    regressions = []
+    if os.path.exists(options.baseline) and not options.save_baseline:
+        with open(options.baseline) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+        [ratios, regressions] = compare_with_baseline(results, baseline, options.tolerance)
+        document.update(baseline=options.baseline, ratios=ratios, regressions=regressions)
+        for key in regressions:
+            print('Regression: {} is {:.2f} times its baseline'.format(key, ratios[key]))
+    with open(options.output, 'w') as output:
+        json.dump(document, output, indent=2)
+    if options.save_baseline:
+        with open(options.baseline, 'w') as baseline_file:
+            json.dump(document, baseline_file, indent=2)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
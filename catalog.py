@@ -0,0 +1,191 @@
+import collections
+import copy
+import csv
+
+import numpy as np
+
+from preliminary_sizing import Battery, Motor, PhasePower
+
+CatalogDesign = collections.namedtuple('CatalogDesign', ['mass', 'battery_pack_mass', 'cell', 'motor',
+                                                         'number_in_series', 'number_in_parallel'])
+
+
+class Catalog:
+    """ Definitely a class
+    A table of catalog items as one array per field, in the units of the matching constructor, and a name per item.
+    Every indexed field keeps a sorted copy, so select finds a range of it with a binary search instead of a scan. """
+
+    fields = []
+    indexed = []
+    defaults = {}
+
+    def __init__(self, names, **fields):
+        self.names = list(names)
+        for field in self.fields:
+            values = fields[field] if field in fields else np.full(len(self.names), self.defaults[field])
+            setattr(self, field, np.asarray(values, dtype=float))
+        self.sorted_orders = {field: np.argsort(getattr(self, field), kind='stable') for field in self.indexed}
+        self.sorted_values = {field: getattr(self, field)[order] for field, order in self.sorted_orders.items()}
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def from_records(cls, records):
+        """ records are dictionaries of the fields, with an optional name. """
+        records = list(records)
+        names = [record.get('name', str(index)) for index, record in enumerate(records)]
+        fields = {field: [float(record.get(field, cls.defaults.get(field))) for record in records]
+                  for field in cls.fields if all(field in record for record in records) or field in cls.defaults}
+        return cls(names, **fields)
+
+    @classmethod
+    def from_csv(cls, path):
+        """ A CSV file with a header row naming the fields, plus an optional name column. """
+        with open(path, newline='') as table:
+            return cls.from_records(csv.DictReader(table))
+
+    def select(self, **ranges):
+        """ Indices of the items whose fields lie in the given (lowest, highest) ranges, either end None for open.
+        select(c_max=(20, None), nominal_cell_voltage=(3.6, 3.7)) say. Indexed fields are searched, others scanned. """
+        selected = np.ones(len(self), dtype=bool)
+        for field, [lowest, highest] in ranges.items():
+            lowest = -np.inf if lowest is None else lowest
+            highest = np.inf if highest is None else highest
+            if field in self.sorted_orders:
+                start = np.searchsorted(self.sorted_values[field], lowest, side='left')
+                stop = np.searchsorted(self.sorted_values[field], highest, side='right')
+                in_range = np.zeros(len(self), dtype=bool)
+                in_range[self.sorted_orders[field][start:stop]] = True
+            else:
+                values = getattr(self, field)
+                in_range = (values >= lowest) & (values <= highest)
+            selected &= in_range
+        return np.flatnonzero(selected)
+
+
+class CellCatalog(Catalog):
+    """ Definitely a class
+    Battery cells as Battery takes them: volts, 1/hours, ampere hours and watt hours per kilogram. """
+
+    fields = ['nominal_cell_voltage', 'c_max', 'cell_capacity', 'specific_energy_density']
+    indexed = ['nominal_cell_voltage', 'c_max', 'specific_energy_density']
+
+    def __init__(self, names, **fields):
+        super().__init__(names, **fields)
+        # Stored the way Battery stores them, so the pack sizing below rounds exactly as BatteryPackMass does
+        self.c_max_per_second = self.c_max / 3600
+        self.cell_capacity_ampere_seconds = self.cell_capacity * 3600
+        self.battery_cell_mass = self.cell_capacity_ampere_seconds * self.nominal_cell_voltage \
+            / (self.specific_energy_density * 3600)
+
+    def create_battery(self, index):
+        return Battery(self.nominal_cell_voltage[index], self.c_max[index], self.cell_capacity[index],
+                       self.specific_energy_density[index])
+
+
+class MotorCatalog(Catalog):
+    """ Definitely a class
+    Motors as Motor takes them, volts, a fraction and watts, plus the motor's mass in kilograms, zero if not given,
+    which is added to the pack mass when designs are ranked. """
+
+    fields = ['input_voltage', 'whole_chain_efficiency', 'max_continuous_power', 'mass']
+    indexed = ['input_voltage', 'whole_chain_efficiency', 'max_continuous_power']
+    defaults = {'mass': 0}
+
+    def create_motor(self, index):
+        return Motor(self.input_voltage[index], self.whole_chain_efficiency[index], self.max_continuous_power[index])
+
+
+class PackSearch:
+    """ Definitely a class
+    The lightest cell and motor pairs for a mission, a pair's mass being its motor's mass plus the pack that
+    BatteryPackMass would size from them. Motors whose max_continuous_power is below the mission's peak power are
+    left out unless require_continuous_power is False. cells and motors restrict the search to catalog indices, from
+    select say.
+
+    Cells are visited in order of a lower bound on the mass of any pair they are in, taken with the most efficient
+    and lowest voltage motor, and every pair of a chunk of cells is sized at once. The search stops at the first cell
+    whose bound is above the number_of_designs-th lightest mass found, so most of a large catalog is never sized.
+    designs holds CatalogDesign tuples lightest first, evaluated_pairs the number of pairs sized. """
+
+    def __init__(self, mission, cell_catalog, motor_catalog, number_of_designs=10, cells=None, motors=None,
+                 require_continuous_power=True, chunk_size=64):
+        if mission.maximum_power is None:
+            mission = copy.deepcopy(mission)
+            PhasePower(mission)
+        self.cell_catalog = cell_catalog
+        self.motor_catalog = motor_catalog
+        self.number_of_designs = number_of_designs
+        self.maximum_power = mission.maximum_power
+        self.energy = sum([specific_phase.maximum_power * specific_phase.time * count
+                           for specific_phase, count in mission.phase_counts.items()])
+        self.low_voltage_ratio = mission.lowest_voltage_maximum_power_ratio
+        cells = np.arange(len(cell_catalog)) if cells is None else np.asarray(cells, dtype=int)
+        motors = np.arange(len(motor_catalog)) if motors is None else np.asarray(motors, dtype=int)
+        if require_continuous_power:
+            motors = motors[motor_catalog.max_continuous_power[motors] >= self.maximum_power]
+        self.motors = motors
+        self.evaluated_pairs = 0
+        self.designs = []
+        if len(cells) and len(motors):
+            self.designs = self.search(cells, chunk_size)
+
+    def calculate_lower_bounds(self, cells):
+        """ No selected motor has a lower input voltage, a higher efficiency or a lighter mass than these. """
+        catalog = self.cell_catalog
+        motors = self.motor_catalog
+        lowest_voltage = motors.input_voltage[self.motors].min()
+        best_efficiency = motors.whole_chain_efficiency[self.motors].max()
+        cell_voltage = catalog.nominal_cell_voltage[cells]
+        cell_capacity = catalog.cell_capacity_ampere_seconds[cells]
+        energy_cells = np.ceil(lowest_voltage / cell_voltage) \
+            * np.ceil(self.energy / (cell_voltage * cell_capacity * best_efficiency))
+        # Power sizing needs series * parallel cells of at least this many, whatever the series count
+        power_cells = self.maximum_power / (catalog.c_max_per_second[cells] * cell_capacity * best_efficiency
+                                            * cell_voltage * self.low_voltage_ratio)
+        bounds = np.maximum(energy_cells, power_cells) * catalog.battery_cell_mass[cells] \
+            + motors.mass[self.motors].min()
+        return bounds * (1 - 1e-12)  # Room for the rounding of the exact sizing
+
+    def size_packs(self, cells):
+        """ [number_in_series, number_in_parallel, battery_pack_mass], cells by selected motors, with the rules and
+        the order of operations of BatteryPackMass. """
+        catalog = self.cell_catalog
+        motors = self.motor_catalog
+        cell_voltage = catalog.nominal_cell_voltage[cells, np.newaxis]
+        cell_capacity = catalog.cell_capacity_ampere_seconds[cells, np.newaxis]
+        efficiency = motors.whole_chain_efficiency[self.motors]
+        number_in_series = np.ceil(motors.input_voltage[self.motors] / cell_voltage)
+        battery_pack_voltage = number_in_series * cell_voltage * self.low_voltage_ratio
+        parallel_power = np.ceil(self.maximum_power / (catalog.c_max_per_second[cells, np.newaxis] * cell_capacity
+                                                       * efficiency * battery_pack_voltage))
+        parallel_endurance = np.ceil(self.energy / (cell_voltage * cell_capacity * efficiency))
+        number_in_parallel = np.maximum(parallel_power, parallel_endurance)
+        battery_pack_mass = number_in_series * number_in_parallel * catalog.battery_cell_mass[cells, np.newaxis]
+        return [number_in_series, number_in_parallel, battery_pack_mass]
+
+    def search(self, cells, chunk_size):
+        bounds = self.calculate_lower_bounds(cells)
+        order = np.argsort(bounds, kind='stable')
+        [cells, bounds] = [cells[order], bounds[order]]
+        best = None  # [mass, cell, motor, series, parallel, pack mass] of the lightest pairs so far, as columns
+        threshold = np.inf
+        for start in range(0, len(cells), chunk_size):
+            chunk = cells[start:start + chunk_size]
+            chunk = chunk[bounds[start:start + chunk_size] <= threshold]
+            if not len(chunk):
+                break
+            [number_in_series, number_in_parallel, battery_pack_mass] = self.size_packs(chunk)
+            mass = battery_pack_mass + self.motor_catalog.mass[self.motors]
+            self.evaluated_pairs += mass.size
+            [cell_index, motor_index] = np.indices(mass.shape).reshape(2, -1)
+            found = np.stack([mass.ravel(), chunk[cell_index], self.motors[motor_index], number_in_series.ravel(),
+                              number_in_parallel.ravel(), battery_pack_mass.ravel()])
+            best = found if best is None else np.concatenate([best, found], axis=1)
+            best = best[:, np.lexsort((best[2], best[1], best[0]))[:self.number_of_designs]]
+            if best.shape[1] == self.number_of_designs:
+                threshold = best[0, -1]
+        return [CatalogDesign(float(mass), float(pack_mass), self.cell_catalog.names[int(cell)],
+                              self.motor_catalog.names[int(motor)], int(series), int(parallel))
+                for mass, cell, motor, series, parallel, pack_mass in best.T]
@@ -0,0 +1,226 @@
+""" Matching charts drawn straight to PNG or SVG files, without pyplot, for as many design cases as a study has.
+
+    charts = create_study_charts(study, 'charts', extension='svg')
+    render_charts(charts, workers=8)
+
+Each process draws on one figure of its own through the Agg canvas, so nothing is shown, no global figure is touched
+and the figure, its lines and its patches are reused from one chart to the next. Curves are sampled once per pixel of
+the figure's width instead of on Matching's 1 Pa grid. """
+import collections
+import concurrent.futures
+import math
+import os
+import re
+
+import numpy as np
+
+from preliminary_sizing import Matching
+from trade_study import add_takeoff_mass
+
+Chart = collections.namedtuple('Chart', ['path', 'takeoff_mass', 'constraints', 'title'])
+Chart.__new__.__defaults__ = ('Matching Chart',)
+
+KIND_COLORS = {'stall': 'red', 'landing': 'purple', 'takeoff': 'blue', 'climb': 'green', 'cruise': 'orange'}
+PATTERNS = ['-', '--', '-.', ':']
+
+worker_renderer = None  # The ChartRenderer of a worker process, made once by initialize_worker
+
+
+class ChartRenderer:
+    """ Definitely a class
+    Draws matching charts on one Figure it keeps. A chart's constraints are the keyword arguments of
+    Matching.solve_design_point, dictionaries or lists of them, and it is drawn as the curve of every constraint in
+    the colors of Matching's plot methods, the feasible region below them and the design point. The limits of the
+    axes are those Matching takes, width and height are in inches.
+
+    The axes, ticks and labels are the same on every chart, so PNG files are drawn by restoring their pixels, saved
+    after the first chart, and drawing only the artists that change on top. The artists that change are animated,
+    which keeps them out of that background, and other formats are saved with them switched back for one draw. The
+    legend is opaque and the pixels of its entries are kept too for as long as the charts list the same
+    constraints.
+    png_compression is the zlib level of the PNG files, 0 to 9. """
+
+    def __init__(self, max_wing_loading=10000, max_power_loading=0.3, width=8, height=6, dpi=100,
+                 png_compression=6):
+        # Imported here, like preliminary_sizing.load_pyplot, since the sizing math never needs matplotlib
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+        from matplotlib.patches import Polygon
+        self.max_wing_loading = max_wing_loading
+        self.max_power_loading = max_power_loading
+        self.number_of_points = int(round(width * dpi))  # A curve needs no more than a point per pixel across
+        self.figure = Figure(figsize=(width, height), dpi=dpi)
+        FigureCanvasAgg(self.figure)
+        self.axes = self.figure.add_subplot()
+        self.axes.set_xlabel('Wing Loading (Pascals)')
+        self.axes.set_ylabel('Power Loading (Newtons / Watt)')
+        self.axes.set_xlim(0, max_wing_loading)
+        self.axes.set_ylim(0, max_power_loading)
+        self.region = self.axes.add_patch(Polygon(np.zeros((1, 2)), closed=True, color='grey', alpha=0.2,
+                                                  label='Feasible region'))
+        [self.design_point] = self.axes.plot([], [], linestyle='', marker='*', markersize=12, color='black',
+                                             label='Design point')
+        self.lines = []  # Line2D objects reused by every chart, the ones a chart does not need are hidden
+        self.legend = None
+        self.background = None  # The pixels of everything that is the same on every chart
+        self.legend_entries = None
+        self.legend_pixels = None  # The opaque legend as drawn, while the entries stay the same
+        self.png_compression = png_compression
+        for artist in self.list_changing_artists():
+            artist.set_animated(True)
+
+    def create_curves(self, matching, constraints, wing_loading):
+        """ [name, kind, wing loading, power loading] for every constraint, a vertical line for stall and landing. """
+        limits = {'stall': matching.size_to_stall, 'landing': matching.size_to_landing}
+        calculators = {'takeoff': matching.calculate_takeoff_power_loading,
+                       'climb': matching.calculate_climb_power_loading,
+                       'cruise': matching.calculate_cruise_power_loading}
+        curves = []
+        for kind in KIND_COLORS:
+            for name, spec in matching.name_constraints(kind, constraints.get(kind)):
+                if kind in limits:
+                    limit = float(limits[kind](**spec))
+                    curves.append([name, kind, np.array([limit, limit]), np.array([0, self.max_power_loading])])
+                else:
+                    power_loading = np.asarray(calculators[kind](wing_loading, **spec)).reshape(-1)
+                    curves.append([name, kind, wing_loading, power_loading])
+        return curves
+
+    def create_region(self, curves, design_point, wing_loading):
+        """ The corners of the area under every power loading curve and left of the wing loading limit. """
+        power_loadings = [power_loading for name, kind, x, power_loading in curves if kind not in ['stall', 'landing']]
+        envelope = np.min(power_loadings, axis=0) if power_loadings else np.full(len(wing_loading), math.inf)
+        envelope = np.minimum(envelope, self.max_power_loading)
+        limit = min(design_point.maximum_wing_loading, self.max_wing_loading)
+        inside = wing_loading <= limit
+        return np.concatenate([[[0, 0]], np.column_stack([wing_loading[inside], envelope[inside]]),
+                               [[limit, np.interp(limit, wing_loading, envelope)], [limit, 0]]])
+
+    def draw(self, chart):
+        """ Draws chart on the figure and returns its DesignPoint. """
+        matching = Matching(chart.takeoff_mass, self.max_wing_loading, self.max_power_loading)
+        wing_loading = matching.create_wing_loading_grid(self.number_of_points)
+        curves = self.create_curves(matching, chart.constraints, wing_loading)
+        design_point = matching.solve_design_point(**chart.constraints)
+        while len(self.lines) < len(curves):
+            self.lines += self.axes.plot([], [], animated=True)
+        kind_counts = collections.Counter()
+        for line, [name, kind, x, power_loading] in zip(self.lines, curves):
+            line.set_data(x, power_loading)
+            line.set_color(KIND_COLORS[kind])
+            line.set_linestyle(PATTERNS[kind_counts[kind] % len(PATTERNS)])
+            line.set_label(name)
+            line.set_visible(True)
+            kind_counts[kind] += 1
+        for line in self.lines[len(curves):]:
+            line.set_visible(False)
+            line.set_label('_unused')  # Labels starting with an underscore stay out of the legend
+        self.region.set_xy(self.create_region(curves, design_point, wing_loading))
+        self.design_point.set_data([design_point.wing_loading], [design_point.power_loading])
+        legend_entries = [(name, kind, line.get_linestyle()) for line, [name, kind, x, y] in zip(self.lines, curves)]
+        if legend_entries != self.legend_entries:  # Cases of one study mostly share their constraints
+            if self.legend is not None:
+                self.legend.remove()
+            self.legend = self.axes.legend(loc=1, framealpha=1)
+            self.legend.set_animated(True)
+            self.legend_entries = legend_entries
+            self.legend_pixels = None
+        self.axes.set_title(chart.title)
+        return design_point
+
+    def list_changing_artists(self):
+        return [self.region] + self.lines + [self.design_point] + [self.axes.title] \
+            + ([self.legend] if self.legend is not None else [])
+
+    def render(self, chart):
+        """ Draws chart and writes it to chart.path, its extension picking the file format. """
+        design_point = self.draw(chart)
+        if os.path.splitext(chart.path)[1].lower() == '.png':
+            self.write_png(chart.path)
+            return design_point
+        changing_artists = self.list_changing_artists()
+        for artist in changing_artists:
+            artist.set_animated(False)
+        try:
+            self.figure.savefig(chart.path)
+        finally:
+            for artist in changing_artists:
+                artist.set_animated(True)
+        return design_point
+
+    def write_png(self, path):
+        from PIL import Image  # Pillow comes with matplotlib
+        canvas = self.figure.canvas
+        if self.background is None:
+            canvas.draw()
+            self.background = canvas.copy_from_bbox(self.figure.bbox)
+        canvas.restore_region(self.background)
+        for artist in self.list_changing_artists():
+            if artist.get_visible() and artist is not self.legend:
+                self.figure.draw_artist(artist)
+        if self.legend_pixels is None:
+            self.figure.draw_artist(self.legend)
+            self.legend_pixels = canvas.copy_from_bbox(self.calculate_legend_contents())
+        else:
+            # The frame's antialiased edge and rounded corners blend with the curves below, so it is drawn again.
+            # Inside it the opaque frame hides them, and the entries' pixels are the same on every chart.
+            self.figure.draw_artist(self.legend.legendPatch)
+            canvas.restore_region(self.legend_pixels)
+        Image.fromarray(np.asarray(canvas.buffer_rgba())).save(path, compress_level=self.png_compression)
+
+
+    def calculate_legend_contents(self):
+        """ Whole pixels around the legend entries, which lie inside its frame's padding. """
+        from matplotlib.transforms import Bbox
+        renderer = self.figure.canvas.get_renderer()
+        extent = Bbox.union([child.get_window_extent(renderer) for child in self.legend.get_children()
+                             if child is not self.legend.legendPatch and child.get_visible()])
+        return Bbox.from_extents(math.floor(extent.x0) - 1, math.floor(extent.y0) - 1, math.ceil(extent.x1) + 1,
+                                 math.ceil(extent.y1) + 1)
+
+
+def initialize_worker(renderer_options):
+    global worker_renderer
+    worker_renderer = ChartRenderer(**renderer_options)
+
+
+def render_chunk(charts):
+    return [worker_renderer.render(chart) for chart in charts]
+
+
+def render_charts(charts, workers=1, chunk_size=None, **renderer_options):
+    """ Writes every chart and returns their DesignPoints in order. workers above one draws over a process pool,
+    each process with a ChartRenderer made from renderer_options, and chunk_size defaults to about four chunks per
+    worker. """
+    charts = list(charts)
+    if workers == 1:
+        renderer = ChartRenderer(**renderer_options)
+        return [renderer.render(chart) for chart in charts]
+    chunk_size = chunk_size if chunk_size is not None else max(1, math.ceil(len(charts) / (4 * workers)))
+    chunks = [charts[start:start + chunk_size] for start in range(0, len(charts), chunk_size)]
+    with concurrent.futures.ProcessPoolExecutor(workers, initializer=initialize_worker,
+                                                initargs=(renderer_options,)) as executor:
+        return [design_point for design_points in executor.map(render_chunk, chunks)
+                for design_point in design_points]
+
+
+def create_study_charts(study, directory, extension='png'):
+    """ A Chart for every case of a TradeStudy that has run and has matching constraints, at its converged takeoff
+    mass, named by the case's index and name. The masses of a study run into a ResultStore are read from it. """
+    if study.results is None:
+        raise ValueError("the study has not been run")
+    if study.store is not None:
+        first_row = study.first_stored_row
+        takeoff_masses = study.store['takeoff_mass'][first_row:first_row + len(study.cases)].tolist()
+    else:
+        takeoff_masses = [result['takeoff_mass'] for result in study.results]
+    os.makedirs(directory, exist_ok=True)
+    charts = []
+    for index, [case, takeoff_mass] in enumerate(zip(study.cases, takeoff_masses)):
+        if not case.matching:
+            continue
+        name = re.sub(r'[^\w.-]+', '_', str(case.name)) if case.name is not None else 'case'
+        charts.append(Chart(os.path.join(directory, '{:04d}_{}.{}'.format(index, name, extension)),
+                            takeoff_mass, add_takeoff_mass(case.matching, takeoff_mass),
+                            case.name if case.name is not None else 'Matching Chart'))
+    return charts
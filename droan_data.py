@@ -0,0 +1,12 @@
+""" Reference data shared by the batch runner, the benchmarks and the tests. """
+
+# [takeoff_mass, empty_mass] in kilograms of Roskam's home built planes, plus the NASA GL-10
+ROSKAM_HOME_BUILT = [(441, 295), (397, 261), (363, 196), (340, 200), (354, 229), (642, 397), (386, 262), (454, 215),
+                     (771, 431), (476, 254), (601, 340), (680, 400), (320, 199), (260, 141), (280, 170), (320, 191),
+                     (680, 430), (650, 410), (850, 520), (400, 270), (820, 550), (26, 21)]
+
+# Phase arguments of the Droan endurance mission, which flies them in order and taxis again at the end
+DROAN_PHASES = [("taxi", 3, 15, 30, 0, 3, 0), ("takeoff", 13.4, 15, 10, 0, 13.4, 0),
+                ("climb", 22.4, 10, 48, 2.5, 9, 120), ("endurance", 22.4, 20, 1800, 0, 0, 120),
+                ("descent", 13.4, 15, 36, -2.5, -9, 30), ("pattern", 13.4, 10, 60, 0, 0, 30),
+                ("land", 0, 5, 30, -1, -13.4, 0)]
@@ -1,24 +1,90 @@
+from atmosphere import STANDARD_ATMOSPHERE, Atmosphere
+from droan_data import DROAN_PHASES, ROSKAM_HOME_BUILT
+from catalog import CellCatalog, MotorCatalog, PackSearch
+from chart_rendering import Chart, ChartRenderer, create_study_charts, render_charts
+from mission_simulation import MissionSimulation
+from monte_carlo import MonteCarlo, normal, triangular, uniform
+from optimizer import DesignOptimizer, Variable, evaluate_design
 from preliminary_sizing import *
+from result_cache import ResultCache
+from result_store import ResultStore, create_study_columns
+from sensitivity import Sensitivity
+from sizing_graph import create_sizing_graph
+from trade_study import DesignCase, TradeStudy, size_design_case
+import batch
+import benchmarks
+import io
+import json
+import instrumentation
+import pattern
+import numpy as np
+import os
+import subprocess
+import sys
+import tempfile
 import unittest
+import unittest.mock
+
+IMPORT_TIME_BUDGET = 0.5  # seconds for a cold import of preliminary_sizing, numpy included, pyplot alone is ~0.7
+
+
+def create_droan_phases():
+    return [Phase(*phase) for phase in DROAN_PHASES]
+
+
+def create_droan_mission(takeoff_mass_guess=12.5, payload=1):
+    phases = create_droan_phases()
+    mission = Mission(takeoff_mass_guess, payload, 100)
+    mission.add_all_phases(phases + phases[:1])
+    return mission
+
+
+def create_roskam_home_built():
+    roskam_home_built = HistoricalTrend()
+    roskam_home_built.add_similar_planes([SimilarPlane(*plane) for plane in ROSKAM_HOME_BUILT])
+    return roskam_home_built
 
 
 class FormalTesting(unittest.TestCase):
 
     def test_mission(self):
-        taxi = Phase("taxi", 3, 15, 30, 0, 3)
-        takeoff = Phase("takeoff", 13.4, 15, 10, 0, 13.4)
-        land = Phase("land", 0, 5, 30, -1, -13.4)
-        land_duplicate = Phase("land", 0, 5, 30, -1, -13.4)
+        taxi = Phase("taxi", 3, 15, 30, 0, 3, 0)
+        takeoff = Phase("takeoff", 13.4, 15, 10, 0, 13.4, 0)
+        land = Phase("land", 0, 5, 30, -1, -13.4, 0)
+        land_duplicate = Phase("land", 0, 5, 30, -1, -13.4, 0)
 
         mission1 = Mission(12.5, 1, 100)
         mission1.add_all_phases([taxi, takeoff, land, land_duplicate])
         self.assertEqual(len(mission1.unique_phases), 3)
         self.assertEqual(len(mission1.all_phases), 4)
+        self.assertEqual(mission1.phase_counts[land_duplicate], 2)
 
         mission2 = Mission(13.5, 1, 100)
         mission2.add_all_phases([taxi, taxi, taxi])
         self.assertEqual(len(mission2.unique_phases), 1)
         self.assertEqual(len(mission2.all_phases), 3)
+        mission2.add_all_phases([taxi, takeoff])
+        self.assertEqual(mission2.unique_phases, [taxi, takeoff])
+        self.assertEqual(mission2.phase_counts, {taxi: 4, takeoff: 1})
+        self.assertEqual(len({taxi, takeoff, land, land_duplicate}), 3)
+        slower = taxi._replace(final_speed=2)
+        self.assertIsNone(slower.maximum_power)
+        self.assertIn('Max Power: None', str(slower))
+        slower.add_maximum_power(50)
+        self.assertEqual((slower.maximum_power, taxi.maximum_power), (50, None))
+
+    def test_repeated_phase_energy(self):
+        motor = Motor(11.1, 0.8, 110)
+        battery = Battery(11.1, 25, 2.2, 140)
+        [taxi, takeoff, climb, endurance, descent, pattern, land] = create_droan_phases()
+        touch_and_go = Mission(12.5, 1, 100)
+        touch_and_go.add_all_phases([taxi] + [takeoff, climb, pattern, descent, land] * 2000 + [taxi])
+        PhasePower(touch_and_go)
+        self.assertEqual(len(touch_and_go.unique_phases), 6)
+        pack = BatteryPackMass(motor, touch_and_go, battery)
+        mission_energy = sum(phase.maximum_power * phase.time for phase in touch_and_go.all_phases)
+        self.assertEqual(pack.number_in_parallel_endurance,
+                         math.ceil(mission_energy / (battery.nominal_cell_voltage * battery.cell_capacity * 0.8)))
 
     def test_historical_trends(self):
         bowers_fly_baby_1b = SimilarPlane(441, 295)
@@ -53,6 +119,753 @@ class FormalTesting(unittest.TestCase):
         print(droan_empty_mass_guess)
         self.assertEqual(round(roskam_home_built.empty_mass_required), 10)
 
+    def test_matching_constraints(self):
+        matching = Matching(9.35, max_wing_loading=2000)
+        aspect_ratios = np.array([5, 6, 7, 8])
+        constraints = matching.calculate_constraints(
+            stall=dict(altitude=1000, max_clean_cl=np.array([1.5, 2.0]), stall_speed=13),
+            takeoff=dict(takeoff_field_length=100, altitude=1000, max_takeoff_cl=1.5),
+            climb=dict(mass=9.35, altitude=1000, speed=22.4, aspect_ratio=aspect_ratios, rate_of_climb=2.54,
+                       gear_down=True),
+            cruise=dict(speed=22.5, altitude=100, cruise_lift_coefficient=0.5, mass=9.35, aspect_ratio=10))
+        self.assertEqual(constraints['wing_loading'].shape, (2000,))
+        self.assertEqual(constraints['stall'].shape, (2,))
+        self.assertEqual(constraints['takeoff'].shape, (2000,))
+        self.assertEqual(constraints['climb'].shape, (4, 2000))
+        self.assertAlmostEqual(constraints['stall'][1], matching.size_to_stall(1000, 2.0, 13))
+        takeoff = matching.size_to_takeoff(100, 1000, 1.5)[0]
+        self.assertAlmostEqual(constraints['takeoff'][99], takeoff[0] * 100 ** takeoff[1])
+        for aspect_ratio, climb in zip(aspect_ratios, constraints['climb']):
+            single = matching.size_to_climb(9.35, 1000, 22.4, aspect_ratio, True, 0.85, 1.5, 2.54, 0.85)[1]
+            np.testing.assert_allclose(climb, single)
+
+    def test_matching_design_point(self):
+        matching = Matching(9.35, max_wing_loading=2000)
+        takeoff = dict(takeoff_field_length=100, altitude=1000, max_takeoff_cl=2.0)
+        climb = dict(mass=9.35, altitude=1000, speed=22.4, aspect_ratio=8, rate_of_climb=2.54, gear_down=True)
+        cruise = dict(speed=22.5, altitude=100, cruise_lift_coefficient=0.5, mass=9.35, aspect_ratio=10)
+        design_point = matching.solve_design_point(stall=dict(altitude=1000, max_clean_cl=3.0, stall_speed=13),
+                                                   takeoff=takeoff, climb=climb, cruise=cruise)
+        wing_loading = np.linspace(1, design_point.maximum_wing_loading, 100001)
+        envelope = np.min([matching.calculate_takeoff_power_loading(wing_loading, **takeoff),
+                           matching.calculate_climb_power_loading(wing_loading, **climb),
+                           matching.calculate_cruise_power_loading(wing_loading, **cruise)], axis=0)
+        self.assertAlmostEqual(design_point.maximum_wing_loading, matching.size_to_stall(1000, 3.0, 13))
+        self.assertAlmostEqual(design_point.wing_loading, wing_loading[np.argmax(envelope)], delta=0.1)
+        self.assertAlmostEqual(design_point.power_loading, envelope.max(), places=5)
+        self.assertEqual(design_point.boundary[0][2], 'cruise')
+        self.assertEqual((matching.wing_loading, matching.power_loading),
+                         (design_point.wing_loading, design_point.power_loading))
+
+        stall = dict(altitude=1000, max_clean_cl=1.2, stall_speed=13)
+        landing = dict(altitude=1000, landing_field_length=100, max_landing_cl=2.0)
+        for limit, constraints in [(matching.size_to_stall(**stall), dict(stall=stall)),
+                                   (matching.size_to_landing(**landing), dict(landing=landing))]:
+            design_point = matching.solve_design_point(**constraints)
+            self.assertAlmostEqual(design_point.wing_loading, limit)
+            self.assertEqual(design_point.power_loading, matching.max_power_loading)
+            self.assertEqual(design_point.active_constraints, ['max_power_loading', list(constraints)[0]])
+            self.assertEqual(design_point.boundary, [(0.0, design_point.wing_loading, 'max_power_loading')])
+
+        design_point = matching.solve_design_point(cruise=cruise)  # Capped where the cruise line reaches the cap
+        crossing = matching.max_power_loading / matching.size_to_cruise_slope(**cruise)[0][0]
+        self.assertAlmostEqual(design_point.wing_loading, crossing)
+        self.assertEqual(design_point.power_loading, matching.max_power_loading)
+        self.assertEqual(design_point.boundary, [(0.0, design_point.wing_loading, 'cruise'),
+                                                 (design_point.wing_loading, 2000.0, 'max_power_loading')])
+        boundary = matching.solve_design_point(takeoff=takeoff).boundary
+        self.assertEqual([name for left, right, name in boundary], ['max_power_loading', 'takeoff'])
+        [cap_corner] = matching.calculate_takeoff_power_loading(np.array([boundary[0][1]]), **takeoff).ravel()
+        self.assertAlmostEqual(cap_corner, matching.max_power_loading)
+
+    def test_headless_import(self):
+        measure = "import sys, time; start = time.perf_counter(); import preliminary_sizing; " \
+                  "print(time.perf_counter() - start, 'matplotlib' in sys.modules)"
+        output = subprocess.run([sys.executable, '-c', measure], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True).stdout.split()
+        self.assertEqual(output[1], 'False')
+        self.assertLess(float(output[0]), IMPORT_TIME_BUDGET)
+
+    def test_batch_mass_iteration(self):
+        motor = Motor(11.1, 0.8, 110)
+        roskam_home_built = create_roskam_home_built()
+        cell_capacities = np.array([2.2, 3.0, 5.0, 1.5])
+        payloads = np.array([1, 1.5, 0.5, 2])
+        guesses = np.array([12.5, 14, 12.5, 20])
+        batch = BatchMassIteration(motor, create_droan_mission(), Battery(11.1, 25, cell_capacities, 140),
+                                   roskam_home_built, payload=payloads, takeoff_mass_guess=guesses)
+        self.assertTrue(batch.converged.all())
+        for index in range(len(cell_capacities)):
+            mission = create_droan_mission(guesses[index], payloads[index])
+            PhasePower(mission)
+            battery = Battery(11.1, 25, cell_capacities[index], 140)
+            iteration = MassIteration(motor, mission, battery, roskam_home_built)
+            self.assertAlmostEqual(batch.iterated_takeoff_mass[index], iteration.iterated_takeoff_mass)
+            self.assertEqual(batch.number_of_cells[index],
+                             BatteryPackMass(motor, mission, battery).number_of_cells)
+
+        grid = BatchMassIteration(Motor(np.array([[7.4], [11.1]]), 0.8, 110), create_droan_mission(),
+                                  Battery(3.7, 25, cell_capacities, 140), roskam_home_built, couple_phase_power=True)
+        self.assertEqual(grid.iterated_takeoff_mass.shape, (2, 4))
+        self.assertTrue(np.all(grid.number_in_series == np.array([[2], [3]])))
+
+    def test_coupled_mass_iteration(self):
+        motor = Motor(11.1, 0.8, 110)
+        battery = Battery(11.1, 25, 2.2, 140)
+        roskam_home_built = create_roskam_home_built()
+        takeoff_masses = []
+        for guess in [5, 12.5, 100]:
+            mission = create_droan_mission(guess)
+            iteration = MassIteration(motor, mission, battery, roskam_home_built, method='coupled')
+            self.assertTrue(iteration.converged)
+            self.assertLessEqual(abs(iteration.residual_history[-1]), iteration.acceptable_error)
+            self.assertEqual(len(iteration.residual_history), iteration.iterations + 1)
+            self.assertLess(iteration.iterations, 10)
+            self.assertAlmostEqual(mission.maximum_power, max(phase.maximum_power for phase in mission.unique_phases))
+            pack = BatteryPackMass(motor, mission, battery)
+            self.assertAlmostEqual(iteration.iterated_empty_mass,
+                                   iteration.iterated_takeoff_mass - mission.payload - pack.battery_pack_mass)
+            takeoff_masses.append(iteration.iterated_takeoff_mass)
+        self.assertLess(max(takeoff_masses) - min(takeoff_masses), 0.02 * min(takeoff_masses))
+
+        mission = create_droan_mission(5)
+        PhasePower(mission)
+        fixed_point = MassIteration(motor, mission, battery, roskam_home_built)
+        self.assertFalse(fixed_point.converged)
+        self.assertEqual(fixed_point.iterations, 0)
+
+    def test_historical_trend_fits(self):
+        roskam_home_built = create_roskam_home_built()
+        [slope, y_intercept] = roskam_home_built.calculate_trend()
+        self.assertIs(roskam_home_built.calculate_trend(), roskam_home_built.calculate_trend())
+        log_takeoff_mass = np.log10([plane.takeoff_mass for plane in roskam_home_built.similar_planes])
+        log_empty_mass = np.log10([plane.empty_mass for plane in roskam_home_built.similar_planes])
+        np.testing.assert_allclose([slope, y_intercept], np.polyfit(log_takeoff_mass, log_empty_mass, 1))
+
+        weights = np.linspace(1, 2, len(log_takeoff_mass))
+        np.testing.assert_allclose(roskam_home_built.calculate_trend(weights=weights),
+                                   np.polyfit(log_takeoff_mass, log_empty_mass, 1, w=weights ** 0.5))
+        heavy = log_takeoff_mass >= np.log10(300)
+        np.testing.assert_allclose(roskam_home_built.calculate_trend(takeoff_mass_range=(300, 1000)),
+                                   np.polyfit(log_takeoff_mass[heavy], log_empty_mass[heavy], 1))
+        np.testing.assert_allclose(roskam_home_built.calculate_trend(mask=heavy),
+                                   roskam_home_built.calculate_trend(takeoff_mass_range=(300, 1000)))
+        self.assertEqual(roskam_home_built.calculate_trend(), [slope, y_intercept])
+
+        takeoff_masses = np.geomspace(10, 5000, 100000)
+        roskam_home_built.add_plane_data(takeoff_masses, 0.5 * takeoff_masses ** 0.95)
+        self.assertIsNone(roskam_home_built.trend_slope)
+        self.assertAlmostEqual(roskam_home_built.calculate_trend()[0], 0.95, places=2)
+        np.testing.assert_allclose(roskam_home_built.calculate_empty_mass_required(np.array([100, 1000])),
+                                   10 ** (np.log10([100, 1000]) * roskam_home_built.trend_slope
+                                          + roskam_home_built.trend_y_intercept))
+
+    def test_mission_table(self):
+        mission = create_droan_mission()
+        table = MissionTable.from_mission(mission)
+        masses = np.array([8.0, 12.5])
+        power = table.calculate_power(masses)
+        self.assertEqual(power.shape, (2, 7))
+        for row, mass in zip(power, masses):
+            mission.takeoff_mass_guess = mass
+            PhasePower(mission)
+            np.testing.assert_allclose(row, [phase.maximum_power for phase in mission.unique_phases])
+        np.testing.assert_allclose(table.calculate_maximum_power(masses), power.max(axis=-1))
+        np.testing.assert_allclose(table.calculate_energy(12.5), sum(
+            phase.maximum_power * phase.time for phase in mission.all_phases))
+
+        short_mission = Mission(12.5, 1, 100)
+        short_mission.add_all_phases(create_droan_phases()[:2])
+        both = MissionTable.concatenate([table, MissionTable.from_mission(short_mission)])
+        self.assertEqual(both.number_of_missions, 2)
+        energy = both.calculate_energy(np.array([[12.5, 8.0]]), mass_per_mission=True)
+        self.assertEqual(energy.shape, (1, 2))
+        self.assertAlmostEqual(energy[0, 0], table.calculate_energy(12.5))
+        self.assertAlmostEqual(energy[0, 1], MissionTable.from_mission(short_mission).calculate_energy(8.0))
+
+        empty = MissionTable.from_mission(Mission(12.5, 1, 100))
+        self.assertEqual(empty.calculate_energy(12.5), 0)
+        for tables in [[empty, table, empty], [empty, empty]]:
+            joined = MissionTable.concatenate(tables)
+            self.assertEqual(joined.number_of_missions, len(tables))
+            masses = np.array([[12.5, 8.0, 10.0][:len(tables)]])
+            np.testing.assert_allclose(joined.calculate_energy(masses, mass_per_mission=True),
+                                       [[part.calculate_energy(mass) for part, mass in zip(tables, masses[0])]])
+            np.testing.assert_allclose(joined.calculate_maximum_power(masses, mass_per_mission=True),
+                                       [[part.calculate_maximum_power(mass) for part, mass in zip(tables, masses[0])]])
+
+    def test_trade_study(self):
+        roskam_home_built = create_roskam_home_built()
+        matching = dict(stall=dict(altitude=1000, max_clean_cl=3.0, stall_speed=13),
+                        climb=dict(altitude=1000, speed=22.4, aspect_ratio=8, rate_of_climb=2.54, gear_down=True),
+                        cruise=dict(speed=22.5, altitude=100, cruise_lift_coefficient=0.5, aspect_ratio=10))
+
+        def create_case(cell_capacity, payload):
+            return DesignCase(create_droan_mission(payload=payload), Motor(11.1, 0.8, 110),
+                              Battery(11.1, 25, cell_capacity, 140), matching=matching)
+
+        study = TradeStudy.from_grid(create_case, roskam_home_built, cell_capacity=[1.5, 2.2, 3.0],
+                                     payload=[0.5, 1, 2])
+        progress = []
+        parallel = study.run(workers=2, chunk_size=2, progress=lambda done, total: progress.append((done, total)))
+        serial = TradeStudy(study.cases, roskam_home_built).run(workers=1)
+        self.assertEqual(parallel, serial)
+        self.assertEqual(progress[-1], (9, 9))
+        self.assertEqual(len(progress), 5)
+        self.assertEqual([result['parameters'] for result in parallel][:2],
+                         [{'cell_capacity': 1.5, 'payload': 0.5}, {'cell_capacity': 1.5, 'payload': 1}])
+        single = size_design_case(study.cases[4], roskam_home_built)
+        self.assertEqual(single, parallel[4])
+        self.assertTrue(single['converged'])
+        self.assertIsNone(study.cases[4].mission.unique_phases[0].maximum_power)
+
+    def test_result_cache(self):
+        roskam_home_built = create_roskam_home_built()
+
+        def create_case(cell_capacity, payload):
+            return DesignCase(create_droan_mission(payload=payload), Motor(11.1, 0.8, 110),
+                              Battery(11.1, 25, cell_capacity, 140))
+
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ResultCache(directory, salt='test')
+            study = TradeStudy.from_grid(create_case, roskam_home_built, cell_capacity=[1.5, 2.2], payload=[0.5, 1])
+            first = study.run(workers=1, cache=cache)
+            self.assertEqual((cache.hits, cache.misses), (0, 4))
+            self.assertEqual(TradeStudy(study.cases, roskam_home_built).run(workers=1, cache=cache), first)
+            self.assertEqual((cache.hits, cache.misses), (4, 4))
+
+            changed = TradeStudy.from_grid(create_case, roskam_home_built, cell_capacity=[1.5, 3.0], payload=[0.5, 1])
+            self.assertEqual(changed.run(workers=1, cache=cache)[:2], first[:2])
+            self.assertEqual((cache.hits, cache.misses), (6, 6))
+            self.assertNotEqual(cache.key(Battery(11.1, 25, 2.2, 140)), cache.key(Battery(11.1, 25, 2.2, 141)))
+            self.assertNotEqual(cache.key(1.0), ResultCache(directory, salt='other code').key(1.0))
+            self.assertEqual(cache.key(Battery(11.1, 25, 2, 140)), cache.key(Battery(11.1, 25, 2.0, 140)))
+            self.assertNotEqual(cache.key(True), cache.key(1))
+
+            entry_size = os.path.getsize(cache.path(study.calculate_cache_key(cache, study.cases[0])))
+            small = ResultCache(directory, maximum_bytes=3 * entry_size, salt='test')
+            small.set(small.key('one more'), first[0])
+            self.assertLessEqual(small.calculate_size(), small.maximum_bytes)
+            self.assertEqual(small.get(small.key('one more')), first[0])
+            with unittest.mock.patch('os.utime', side_effect=FileNotFoundError):  # Evicted after the read
+                self.assertEqual(small.get(small.key('one more')), first[0])
+            self.assertEqual(small.misses, 0)
+
+        with tempfile.TemporaryDirectory() as directory:  # Two processes that each write less than the budget
+            writers = [ResultCache(directory, maximum_bytes=20 * entry_size, salt='test') for writer in range(2)]
+            for index in range(15):
+                for number, writer in enumerate(writers):
+                    writer.set(writer.key(number, index), first[0])
+            self.assertLessEqual(writers[0].calculate_size(), 1.2 * writers[0].maximum_bytes)
+
+    def test_atmosphere(self):
+        sea_level = STANDARD_ATMOSPHERE.lookup(0)
+        self.assertAlmostEqual(sea_level.density, 1.225, places=4)
+        self.assertAlmostEqual(sea_level.temperature, 288.15)
+        self.assertAlmostEqual(sea_level.speed_of_sound, 340.29, places=2)
+        self.assertAlmostEqual(sea_level.dynamic_viscosity, 1.789e-5, places=8)
+        self.assertAlmostEqual(STANDARD_ATMOSPHERE.calculate_density(11000), 0.3639, places=4)
+        altitudes = np.array([[0, 123.4], [1000, 15500]])
+        state = STANDARD_ATMOSPHERE.lookup(altitudes)
+        self.assertEqual(state.density.shape, (2, 2))
+        self.assertAlmostEqual(state.density[0, 1], STANDARD_ATMOSPHERE.calculate_density(123.4))
+        self.assertAlmostEqual(state.dynamic_viscosity[1, 1], STANDARD_ATMOSPHERE.lookup(15500.0).dynamic_viscosity)
+        hot_day = Atmosphere(temperature_offset=20).lookup(1000)
+        self.assertAlmostEqual(hot_day.pressure, STANDARD_ATMOSPHERE.lookup(1000).pressure)
+        self.assertAlmostEqual(hot_day.density / STANDARD_ATMOSPHERE.calculate_density(1000), 281.65 / 301.65)
+        self.assertAlmostEqual(STANDARD_ATMOSPHERE.calculate_density_ratio(0), 1)
+        self.assertAlmostEqual(Atmosphere(temperature_offset=30).calculate_density_ratio(0), 288.15 / 318.15)
+        with self.assertRaises(ValueError):
+            STANDARD_ATMOSPHERE.lookup(np.array([0, 25000]))
+        self.assertLess(Matching(9.35, atmosphere=Atmosphere(temperature_offset=20)).size_to_stall(1000, 1.5, 13),
+                        Matching(9.35).size_to_stall(1000, 1.5, 13))
+
+    def test_drag_polar_cache(self):
+        matching = Matching(9.35, drag_polar_cache_size=2)
+        drag_polar = matching.estimate_drag_polar(9.35, 1000, 13, 6, True, 0.85, 2.0)
+        self.assertAlmostEqual(drag_polar[0], matching.calculate_zero_lift_drag_coefficient(9.35, 1000, 13, 2.0, True))
+        self.assertEqual(matching.estimate_drag_polar(9.35, 1000, 13, 6, True, 0.85, 2.0), drag_polar)
+        self.assertEqual(len(matching.drag_polar_cache), 1)
+        matching.estimate_drag_polar(9.35, 1000, 14, 6, True, 0.85, 2.0)
+        matching.estimate_drag_polar(9.35, 1000, 15, 6, True, 0.85, 2.0)
+        self.assertEqual(len(matching.drag_polar_cache), 2)
+        self.assertNotIn((9.35, 1000, 13, 6, True, 0.85, 2.0), matching.drag_polar_cache)
+        speeds = np.array([13, 14, 15])
+        np.testing.assert_allclose(matching.estimate_drag_polar(9.35, 1000, speeds, 6, True, 0.85, 2.0)[0],
+                                   [matching.estimate_drag_polar(9.35, 1000, speed, 6, True, 0.85, 2.0)[0]
+                                    for speed in speeds])
+        # Skin friction between Roskam's lines and past the ends of the chart no longer raises
+        self.assertLess(matching.convert_skin_friction_to_parasite_area(0.0025, 100),
+                        matching.convert_skin_friction_to_parasite_area(0.003, 100))
+        self.assertEqual(matching.convert_skin_friction_to_parasite_area(0.0015, 100),
+                         matching.convert_skin_friction_to_parasite_area(0.002, 100))
+
+    def test_mission_simulation(self):
+        motor = Motor(22.2, 0.7, 1000)
+        battery = Battery(3.7, 20, 5, 720000)
+        [taxi, takeoff, climb, endurance, descent, pattern, land] = create_droan_phases()
+        steady = Mission(12.5, 1, 100)
+        steady.add_all_phases([endurance, pattern, endurance])
+        summary = MissionSimulation(steady, motor, battery, 6, 4, time_step=0.7).summarize(chunk_size=100)
+        self.assertAlmostEqual(float(summary.energy_drawn),
+                               MissionTable.from_mission(steady).calculate_energy(12.5) / 0.7, delta=1e-6)
+
+        mission = create_droan_mission()
+        simulation = MissionSimulation(mission, motor, battery, 6, np.arange(1, 8), time_step=0.5)
+        summary = simulation.summarize(chunk_size=333)
+        self.assertTrue(np.all(summary.energy_drawn < MissionTable.from_mission(mission).calculate_energy(12.5) / 0.7))
+        np.testing.assert_array_equal(summary.feasible, [False] + [True] * 6)
+        self.assertTrue(np.all(np.diff(summary.final_state_of_charge) > 0))
+        states = list(simulation.simulate())
+        self.assertEqual(len(states), sum(math.ceil(phase.time / 0.5) for phase in mission.all_phases))
+        self.assertAlmostEqual(states[-1].time, sum(phase.time for phase in mission.all_phases))
+        self.assertEqual(states[-1].state_of_charge.shape, (7,))
+        np.testing.assert_allclose(states[-1].state_of_charge, summary.final_state_of_charge)
+        np.testing.assert_allclose(np.max([state.current_ratio for state in states], axis=0),
+                                   summary.peak_current_ratio)
+
+        empty = MissionSimulation(Mission(12.5, 1, 100), motor, battery, 6, [1, 2]).summarize()
+        np.testing.assert_array_equal(empty.energy_drawn, [0, 0])
+        np.testing.assert_array_equal(empty.final_state_of_charge, [1, 1])
+        np.testing.assert_array_equal(empty.feasible, [True, True])
+
+    def test_benchmarks(self):
+        quick = [benchmark for benchmark in benchmarks.create_benchmarks() if not benchmark.scaled]
+        self.assertEqual({benchmark.name for benchmark in benchmarks.create_benchmarks() if benchmark.scaled},
+                         {'phase_power', 'mission_table_energy', 'battery_pack_mass', 'trend_fit',
+                          'empty_mass_required', 'batch_mass_iteration', 'matching_takeoff', 'matching_climb',
+                          'matching_cruise', 'pattern_shape', 'pattern_shapes'})
+        results = benchmarks.run_benchmarks([benchmark for benchmark in quick if 'matching' in benchmark.name],
+                                            repeats=2, minimum_time=0.001)
+        self.assertIn('matching_cruise[2000]', results)
+        baseline = {key: dict(result, best=result['best'] / 2) for key, result in results.items()}
+        baseline['matching_stall[1]']['best'] = results['matching_stall[1]']['best'] * 2
+        [ratios, regressions] = benchmarks.compare_with_baseline(results, baseline, tolerance=0.25)
+        self.assertAlmostEqual(ratios['matching_cruise[2000]'], 2)
+        self.assertNotIn('matching_stall[1]', regressions)
+        self.assertEqual(len(regressions), len(results) - 1)
+
+    def test_instrumentation(self):
+        self.assertFalse(instrumentation.enabled)
+        PhasePower(create_droan_mission())
+        self.assertEqual(instrumentation.create_report()['timings'], {})
+        matching = dict(cruise=dict(speed=22.5, altitude=100, cruise_lift_coefficient=0.5, aspect_ratio=10))
+        cases = [DesignCase(create_droan_mission(payload=payload), Motor(11.1, 0.8, 110), Battery(11.1, 25, 2.2, 140),
+                            matching=matching) for payload in [0.5, 1, 2]]
+        instrumentation.enable()
+        try:
+            reports = []
+            for workers in [1, 2]:
+                instrumentation.reset()
+                results = TradeStudy(cases, create_roskam_home_built()).run(workers=workers, chunk_size=1)
+                reports.append(instrumentation.create_report())
+        finally:
+            instrumentation.disable()
+            instrumentation.reset()
+        for report in reports:
+            self.assertEqual(report['values']['MassIteration.iterations']['count'], 3)
+            self.assertEqual(report['values']['MassIteration.iterations']['total'],
+                             sum(result['iterations'] for result in results))
+            self.assertEqual(report['timings']['MassIteration']['calls'], 3)
+            self.assertEqual(report['timings']['Matching.solve_design_point']['calls'], 3)
+            self.assertLessEqual(report['timings']['Matching.calculate_drag_polar']['calls'],
+                                 report['timings']['Matching.estimate_drag_polar']['calls'])
+        self.assertEqual(reports[0]['timings']['PhasePower']['calls'], reports[1]['timings']['PhasePower']['calls'])
+
+    def test_pattern_shapes(self):
+        output = subprocess.run([sys.executable, '-c', 'import pattern'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(output.stdout, '')
+        airfields = [(163, 3, 30, 2.54, 75, 13.4, 0), (163, 3, 30, 2.54, 150, 13.4, 0),
+                     (1500, 3, 300, 2.54, 75, 13.4, 5), (1500, 3, 300, 2.54, 150, 13.4, 5),
+                     (163, 3, 30, 2.54, 75, 13.4, 13.4)]
+        shapes = pattern.PatternShapes(*np.array(airfields).T)
+        np.testing.assert_array_equal(shapes.feasible, [True] * 4 + [False])
+        np.testing.assert_array_equal(shapes.turn_limited[:4], [False, True, False, True])
+        np.testing.assert_array_equal(shapes.extended_final[:4], [False, False, True, True])
+        for index, airfield in enumerate(airfields[:4]):
+            shape = pattern.Shape(*airfield)
+            for point in 'abcdfghij':
+                np.testing.assert_allclose(getattr(shapes, point)[index], getattr(shape, point), atol=1e-9)
+            for length in ['initial_climb_length', 'descent_length', 'final_length', 'downwind_length',
+                           'pattern_diameter', 'before_runway_length', 'after_runway_length']:
+                self.assertAlmostEqual(getattr(shapes, length)[index], getattr(shape, length))
+        self.assertTrue(np.isnan(shapes.final_length[4]))
+        with self.assertRaises(ValueError):
+            pattern.Shape(*airfields[4])
+        np.testing.assert_array_equal(shapes.check_fit(310, 300, 210), [True, False, False, False, False])
+
+    def test_pattern_envelope(self):
+        [headwinds, glide_slopes, approach_speeds] = [np.linspace(-5, 20, 26), np.linspace(2, 6, 9),
+                                                      np.linspace(10, 25, 16)]
+        envelope = pattern.PatternEnvelope(163, 30, 2.54, 75, headwinds, glide_slopes, approach_speeds)
+        self.assertEqual(envelope.feasible.shape, (26, 9, 16))
+        self.assertFalse(envelope.feasible[-1, 0, 0])
+        [headwind, glide_slope, approach_speed] = np.meshgrid(np.linspace(-5, 20, 126), np.linspace(2, 6, 41),
+                                                              np.linspace(10, 25, 76), indexing='ij')
+        fine = pattern.PatternShapes(163, glide_slope, 30, 2.54, 75, approach_speed, headwind)
+        for metric in envelope.metrics:
+            self.assertGreaterEqual(envelope.worst_case[metric], np.nanmax(getattr(fine, metric)))
+            self.assertLess(envelope.worst_case[metric], 1.01 * np.nanmax(getattr(fine, metric)))
+            condition = envelope.critical_condition[metric]
+            shape = pattern.Shape(163, condition['glide_slope'], 30, 2.54, 75, condition['approach_speed'],
+                                  condition['headwind'])
+            self.assertAlmostEqual(getattr(shape, metric), envelope.worst_case[metric])
+
+        airfields = pattern.PatternEnvelope(np.array([163, 1500]), 30, 2.54, 75, headwinds, glide_slopes,
+                                            approach_speeds)
+        self.assertEqual(airfields.feasible.shape, (2, 26, 9, 16))
+        self.assertAlmostEqual(airfields.worst_case['pattern_diameter'][0], envelope.worst_case['pattern_diameter'])
+        gale = pattern.PatternEnvelope(163, 30, 2.54, 75, [30], glide_slopes, approach_speeds)
+        self.assertTrue(np.isnan(gale.worst_case['before_runway_length']))
+
+    def test_batch(self):
+        record = {'mission': {'takeoff_mass_guess': 12.5, 'payload': 1, 'cruise_altitude': 100,
+                              'phases': [list(phase) for phase in create_droan_phases()] + [
+                                  {'name': 'taxi', 'final_speed': 3, 'lift_over_drag': 15, 'time': 30,
+                                   'vertical_speed': 0, 'speed_change': 3, 'final_altitude': 0}]},
+                  'motor': {'input_voltage': 11.1, 'whole_chain_efficiency': 0.8, 'max_continuous_power': 110},
+                  'battery': {'nominal_cell_voltage': 11.1, 'c_max': 25, 'cell_capacity': 2.2,
+                              'specific_energy_density': 140},
+                  'trend': 'roskam_home_built',
+                  'matching': {'cruise': {'speed': 22.5, 'altitude': 100, 'cruise_lift_coefficient': 0.5,
+                                          'aspect_ratio': 10}}}
+        lines = [json.dumps(dict(record, name='case {}'.format(payload), parameters={'payload': payload},
+                                 mission=dict(record['mission'], payload=payload))) for payload in [0.5, 1, 2]]
+        lines[1:1] = ['{not json', '', json.dumps(dict(record, trend='unknown'))]
+        lines.append(json.dumps(dict({key: value for key, value in record.items() if key != 'trend'},
+                                     similar_planes=ROSKAM_HOME_BUILT)))
+        outputs = []
+        for workers in [1, 2]:
+            output = io.StringIO()
+            self.assertEqual(batch.run_batch(iter(lines), output, workers=workers, chunk_size=2, window=1), [6, 2])
+            outputs.append(output.getvalue())
+        self.assertEqual(outputs[0], outputs[1])
+        results = [json.loads(line) for line in outputs[0].splitlines()]
+        self.assertEqual([result['line'] for result in results], [1, 2, 4, 5, 6, 7])
+        self.assertTrue(results[1]['error'].startswith('JSONDecodeError'))
+        self.assertIn('unknown', results[2]['error'])
+        expected = size_design_case(DesignCase(create_droan_mission(payload=2), Motor(11.1, 0.8, 110),
+                                               Battery(11.1, 25, 2.2, 140), create_roskam_home_built(),
+                                               matching=record['matching']))
+        self.assertEqual(results[4]['takeoff_mass'], expected['takeoff_mass'])
+        self.assertEqual(results[4]['parameters'], {'payload': 2})
+        self.assertEqual(results[5]['takeoff_mass'], results[3]['takeoff_mass'])
+
+        diverged = json.dumps(dict({key: value for key, value in record.items() if key != 'matching'},
+                                   parameters={'payload': float('inf')},
+                                   mission=dict(record['mission'], takeoff_mass_guess=float('nan'))))
+        output = io.StringIO()
+        batch.run_batch([diverged], output)
+
+        def reject(constant):
+            raise ValueError(constant)
+        [result] = [json.loads(line, parse_constant=reject) for line in output.getvalue().splitlines()]
+        self.assertEqual((result['parameters']['payload'], result['takeoff_mass'], result['converged']),
+                         (None, None, False))
+
+    def test_sizing_graph(self):
+        matching = dict(cruise=dict(speed=22.5, altitude=100, cruise_lift_coefficient=0.5, aspect_ratio=10))
+        motor = Motor(11.1, 0.8, 110)
+        graph = create_sizing_graph(create_droan_mission(), motor, Battery(11.1, 25, 2.2, 140),
+                                    create_roskam_home_built(), matching)
+        case = DesignCase(create_droan_mission(), motor, Battery(11.1, 25, 3.0, 140), create_roskam_home_built(),
+                          matching)
+        self.assertEqual(graph.find_stale_stages(), list(graph.stages))
+        graph.evaluate('result')
+        self.assertEqual(graph.find_stale_stages(), [])
+        graph.set_input('battery', case.battery)
+        self.assertEqual(graph.find_stale_stages(), ['mass_iteration', 'battery_pack', 'design_point', 'result'])
+        expected = size_design_case(case)
+        self.assertEqual(graph.evaluate('result'), {key: value for key, value in expected.items()
+                                                    if key not in ['name', 'parameters']})
+        self.assertEqual(graph.evaluations, {'fitted_trend': 1, 'phase_power': 1, 'mass_iteration': 2,
+                                             'battery_pack': 2, 'design_point': 2, 'result': 2})
+        graph.update(matching=dict(matching, stall=dict(altitude=1000, max_clean_cl=3.0, stall_speed=13)))
+        graph.evaluate('result')
+        self.assertEqual(graph.evaluations['mass_iteration'], 2)
+        self.assertEqual(graph.evaluations['design_point'], 3)
+        graph.update(mission=create_droan_mission(), motor=Motor(11.1, 0.8, 110))  # Same values, new objects
+        self.assertEqual(graph.find_stale_stages(), [])
+        with self.assertRaises(ValueError):
+            graph.add_stage('report', print, ['unknown'])
+
+    def test_monte_carlo(self):
+        mission = create_droan_mission()
+        PhasePower(mission)
+        motor = Motor(11.1, 0.8, 110)
+        battery = Battery(11.1, 25, 2.2, 140)
+        roskam_home_built = create_roskam_home_built()
+        scale = np.array([0.8, 1, 1.2])
+        residual = np.array([-0.05, 0, 0.05])
+        batch = BatchMassIteration(motor, mission, battery, roskam_home_built, lift_over_drag_scale=scale,
+                                   empty_mass_residual=residual)
+        for index in range(3):
+            scaled = Mission(12.5, 1, 100)
+            scaled.add_all_phases([phase._replace(lift_over_drag=phase.lift_over_drag * scale[index])
+                                   for phase in mission.all_phases])
+            shifted = HistoricalTrend()
+            shifted.add_plane_data(*10 ** roskam_home_built.regression_terms[:, 1:3].T)
+            shifted.regression_terms[:, 2] += residual[index]
+            shifted.regression_terms[:, 4] += residual[index] * shifted.regression_terms[:, 1]
+            self.assertAlmostEqual(batch.iterated_takeoff_mass[index],
+                                   BatchMassIteration(motor, scaled, battery, shifted).iterated_takeoff_mass)
+
+        fixed = MonteCarlo(motor, mission, battery, roskam_home_built).run(10, seed=0)
+        self.assertEqual(fixed['failure_probability'], 0)
+        self.assertAlmostEqual(fixed['percentiles']['takeoff_mass'][50],
+                               BatchMassIteration(motor, mission, battery, roskam_home_built).iterated_takeoff_mass)
+        uncertain = dict(specific_energy_density=normal(140, 15), whole_chain_efficiency=uniform(0.7, 0.85),
+                         lift_over_drag_scale=triangular(0.8, 1, 1.1), empty_mass_residual='trend',
+                         maximum_takeoff_mass=8)
+        monte_carlo = MonteCarlo(motor, mission, battery, roskam_home_built, **uncertain)
+        summary = monte_carlo.run(20000, seed=1)
+        self.assertTrue(0 < summary['failure_probability'] < 1)
+        self.assertLessEqual(summary['percentiles']['takeoff_mass'][95], 8)
+        percentiles = summary['percentiles']['battery_pack_mass']
+        self.assertLess(percentiles[5], percentiles[50])
+        chunked = MonteCarlo(motor, mission, battery, roskam_home_built, **uncertain)
+        self.assertEqual(chunked.run(20000, seed=1, memory_budget=2 ** 18), summary)
+
+    def test_sensitivity(self):
+        mission = create_droan_mission()
+        motor = Motor(11.1, 0.8, 110)
+        roskam_home_built = create_roskam_home_built()
+        [slope, y_intercept] = roskam_home_built.calculate_trend()
+        step = 1e-5
+
+        def solve(relax_cell_counts, payload=1, specific_energy_density=140, efficiency=0.8, endurance_time=1800,
+                  trend_slope=slope):
+            perturbed = Mission(12.5, payload, 100)
+            perturbed.add_all_phases([phase._replace(time=endurance_time) if phase.name == 'endurance' else phase
+                                      for phase in mission.all_phases])
+            trend = create_roskam_home_built()
+            trend.cached_trends[None] = [trend_slope, y_intercept]
+            return Sensitivity(Motor(11.1, efficiency, 110), perturbed, Battery(11.1, 25, 2.2, specific_energy_density),
+                               trend, relax_cell_counts, acceptable_error=1e-9)
+
+        for relax_cell_counts in [False, True]:
+            sensitivity = solve(relax_cell_counts)
+            self.assertFalse(sensitivity.on_cell_count_step)
+            derivatives = sensitivity.derivatives
+            for name, value in [('payload', 1), ('specific_energy_density', 140), ('whole_chain_efficiency', 0.8),
+                                ('time:endurance', 1800), ('trend_slope', slope)]:
+                keyword = {'whole_chain_efficiency': 'efficiency', 'time:endurance': 'endurance_time'}.get(name, name)
+                perturbed = solve(relax_cell_counts, **{keyword: value + step * value})
+                for output in Sensitivity.outputs:
+                    self.assertAlmostEqual(derivatives[output][name],
+                                           (getattr(perturbed, output) - getattr(sensitivity, output))
+                                           / (step * value), delta=1e-3 * (1 + abs(derivatives[output][name])))
+        self.assertEqual(Sensitivity(motor, mission, Battery(11.1, 25, 2.2, 140), roskam_home_built).derivatives[
+            'takeoff_mass']['whole_chain_efficiency'], 0)
+        self.assertLess(sensitivity.calculate_elasticities()['whole_chain_efficiency'], 0)
+
+    def test_pack_search(self):
+        mission = create_droan_mission()
+        PhasePower(mission)
+        random = np.random.default_rng(0)
+        cell_fields = zip(random.choice([3.2, 3.7, 11.1], 400), random.uniform(5, 50, 400),
+                          random.uniform(0.5, 5, 400), random.uniform(80, 260, 400))
+        cells = CellCatalog.from_records(
+            [{'name': 'cell{}'.format(index), 'nominal_cell_voltage': voltage, 'c_max': c_max,
+              'cell_capacity': capacity, 'specific_energy_density': specific_energy_density}
+             for index, [voltage, c_max, capacity, specific_energy_density] in enumerate(cell_fields)])
+        motors = MotorCatalog(['motor{}'.format(index) for index in range(60)],
+                              input_voltage=random.choice([7.4, 11.1, 22.2], 60),
+                              whole_chain_efficiency=random.uniform(0.6, 0.9, 60),
+                              max_continuous_power=random.uniform(50, 800, 60), mass=random.uniform(0.05, 0.4, 60))
+        selected = cells.select(nominal_cell_voltage=(3.6, 3.8), c_max=(20, None))
+        np.testing.assert_array_equal(selected, np.flatnonzero((cells.nominal_cell_voltage == 3.7)
+                                                               & (cells.c_max >= 20)))
+
+        search = PackSearch(mission, cells, motors, number_of_designs=5, cells=selected, chunk_size=8)
+        brute_force = sorted((BatteryPackMass(motors.create_motor(motor), mission, cells.create_battery(cell))
+                              .battery_pack_mass + motors.mass[motor], cells.names[cell], motors.names[motor])
+                             for cell in selected for motor in range(60)
+                             if motors.max_continuous_power[motor] >= mission.maximum_power)
+        self.assertEqual([(design.mass, design.cell, design.motor) for design in search.designs], brute_force[:5])
+        self.assertLess(search.evaluated_pairs, len(brute_force) / 2)
+
+    def test_design_optimizer(self):
+        roskam_home_built = create_roskam_home_built()
+        matching = dict(stall=dict(altitude=1000, max_clean_cl=3.0, stall_speed=13),
+                        climb=dict(altitude=1000, speed=22.4, rate_of_climb=2.54, gear_down=True),
+                        cruise=dict(speed=22.5, altitude=100, cruise_lift_coefficient=0.5))
+
+        def create_case(aspect_ratio, wing_loading, number_in_series, number_in_parallel, endurance_time):
+            mission = Mission(12.5, 1, 100)
+            mission.add_all_phases([phase._replace(time=endurance_time) if phase.name == 'endurance' else phase
+                                    for phase in create_droan_mission().all_phases])
+            case_matching = dict(matching, climb=dict(matching['climb'], aspect_ratio=aspect_ratio),
+                                 cruise=dict(matching['cruise'], aspect_ratio=aspect_ratio))
+            return DesignCase(mission, Motor(11.1, 0.8, 1000), Battery(11.1, 25, 2.2, 140), matching=case_matching)
+
+        variables = [Variable('aspect_ratio', 4, 12), Variable('wing_loading', 50, 600),
+                     Variable('number_in_series', 1, 2, integer=True), Variable('number_in_parallel', 1, 12, True),
+                     Variable('endurance_time', 300, 5000)]
+        optimizer = DesignOptimizer(create_case, variables, objective='endurance_time', maximize=True,
+                                    constraints={'takeoff_mass': (None, 9)}, historical_trend=roskam_home_built)
+        best = optimizer.run()
+        self.assertTrue(best['feasible'])
+        self.assertEqual(best['result']['number_in_parallel'], 4)
+        self.assertLessEqual(best['result']['takeoff_mass'], 9)
+
+        def is_feasible(endurance_time, number_in_parallel=4):
+            result = evaluate_design(create_case(8, 200, 1, number_in_parallel, endurance_time),
+                                     dict(number_in_series=1, number_in_parallel=number_in_parallel, wing_loading=200),
+                                     roskam_home_built)
+            return result['parallel_margin'] >= 0 and result['takeoff_mass'] <= 9 and result['power_margin'] >= 0
+        self.assertFalse(is_feasible(300, 5))
+        [shortest, longest] = [300, 5000]
+        for bisection in range(40):
+            [shortest, longest] = [(shortest + longest) / 2, longest] if is_feasible((shortest + longest) / 2) \
+                else [shortest, (shortest + longest) / 2]
+        self.assertAlmostEqual(best['objective'], shortest, delta=1e-3 * shortest)
+
+        [evaluations, records] = [len(optimizer.evaluations), len(optimizer.history)]
+        self.assertEqual(optimizer.run()['variables'], best['variables'])
+        self.assertEqual(len(optimizer.evaluations), evaluations)
+        self.assertTrue(all(record['memoized'] for record in optimizer.history[records:]))
+        for maximum_evaluations in [1, 7, 40]:  # Polls of ten points and more are cut to the cap
+            capped = DesignOptimizer(create_case, variables, objective='endurance_time', maximize=True,
+                                     constraints={'takeoff_mass': (None, 9)}, historical_trend=roskam_home_built)
+            capped.run(maximum_evaluations=maximum_evaluations)
+            self.assertEqual(len(capped.evaluations), maximum_evaluations)
+
+        small = [Variable('number_in_parallel', 1, 6, True), Variable('endurance_time', 300, 3000)]
+        fixed = dict(aspect_ratio=8, wing_loading=200, number_in_series=1)
+        [serial, parallel] = [DesignOptimizer(lambda **values: create_case(**dict(fixed, **values)), small,
+                                              'endurance_time', True, {'takeoff_mass': (None, 9)}, roskam_home_built)
+                              for workers in [1, 2]]
+        self.assertEqual(parallel.run(tolerance=1e-3, workers=2), serial.run(tolerance=1e-3))
+        self.assertEqual(parallel.history, serial.history)
+
+    def test_chart_rendering(self):
+        roskam_home_built = create_roskam_home_built()
+        matching = dict(stall=dict(altitude=1000, max_clean_cl=3.0, stall_speed=13),
+                        takeoff=dict(takeoff_field_length=100, altitude=1000, max_takeoff_cl=2.0),
+                        climb=dict(altitude=1000, speed=22.4, aspect_ratio=8, rate_of_climb=2.54, gear_down=True),
+                        cruise=[dict(speed=22.5, altitude=100, cruise_lift_coefficient=0.5, aspect_ratio=aspect_ratio)
+                                for aspect_ratio in [6, 10]])
+
+        def create_case(payload):
+            return DesignCase(create_droan_mission(payload=payload), Motor(11.1, 0.8, 110),
+                              Battery(11.1, 25, 2.2, 140), matching=matching, name='payload {}/kg'.format(payload))
+
+        study = TradeStudy.from_grid(create_case, roskam_home_built, payload=[0.5, 1, 1.5, 2])
+        study.run(workers=1)
+        with tempfile.TemporaryDirectory() as directory:
+            charts = create_study_charts(study, directory)
+            self.assertEqual(os.path.basename(charts[1].path), '0001_payload_1_kg.png')
+            design_points = render_charts(charts, workers=2, max_wing_loading=2000)
+            for chart, design_point in zip(charts, design_points):
+                with open(chart.path, 'rb') as image:
+                    self.assertEqual(image.read(8), b'\x89PNG\r\n\x1a\n')
+                expected = Matching(chart.takeoff_mass, 2000).solve_design_point(**chart.constraints)
+                self.assertEqual(design_point.wing_loading, expected.wing_loading)
+
+            from PIL import Image
+            blitting = ChartRenderer(max_wing_loading=2000)  # Keeps its background and legend after the first
+            for chart in charts:
+                blitting.render(chart)
+                redrawn = chart._replace(path=os.path.join(directory, 'redrawn.png'))
+                ChartRenderer(max_wing_loading=2000).render(redrawn)
+                np.testing.assert_array_equal(np.asarray(Image.open(chart.path)), np.asarray(Image.open(redrawn.path)))
+
+            renderer = ChartRenderer(max_wing_loading=2000, width=4, height=3, dpi=50)
+            renderer.render(charts[0])
+            [lines, figure] = [list(renderer.lines), renderer.figure]
+            svg = charts[1]._replace(path=os.path.join(directory, 'chart.svg'))
+            renderer.render(svg)
+            renderer.render(Chart(os.path.join(directory, 'climb.png'), 9, dict(
+                stall=matching['stall'], climb=dict(matching['climb'], mass=9))))
+            self.assertEqual(renderer.lines, lines)
+            self.assertIs(renderer.figure, figure)
+            self.assertEqual(len(lines[1].get_xdata()), 200)  # One point per pixel across
+            self.assertEqual([line.get_visible() for line in lines], [True, True, False, False, False])
+            with open(svg.path) as image:
+                self.assertIn('<svg', image.read())
+
+    def test_result_store(self):
+        roskam_home_built = create_roskam_home_built()
+        matching = dict(stall=dict(altitude=1000, max_clean_cl=3.0, stall_speed=13),
+                        cruise=dict(speed=22.5, altitude=100, cruise_lift_coefficient=0.5, aspect_ratio=10))
+
+        def create_case(cell_capacity, payload):
+            return DesignCase(create_droan_mission(payload=payload), Motor(11.1, 0.8, 110),
+                              Battery(11.1, 25, cell_capacity, 140), matching=matching if payload > 1 else None)
+
+        with tempfile.TemporaryDirectory() as directory:
+            study = TradeStudy.from_grid(create_case, roskam_home_built, cell_capacity=[1.5, 2.2, 3.0],
+                                         payload=[0.5, 1, 2])
+            expected = study.run(workers=1)
+            columns = create_study_columns(['cell_capacity', 'payload'])
+            with ResultStore(directory, columns, mode='w', buffer_rows=4) as store:
+                self.assertIs(study.run(workers=2, chunk_size=2, store=store), store)
+            self.assertEqual(study.results, [None] * 9)
+
+            store = ResultStore(directory)
+            self.assertEqual(len(store), 9)
+            self.assertIsInstance(store['takeoff_mass'], np.memmap)
+            for index, result in enumerate(expected):
+                self.assertEqual(store['takeoff_mass'][index], result['takeoff_mass'])
+                self.assertEqual(store['number_of_cells'][index], result['number_of_cells'])
+                self.assertEqual(store['payload'][index], result['parameters']['payload'])
+                self.assertEqual(np.isnan(store['wing_loading'][index]), 'wing_loading' not in result)
+            heavy = [index for index, result in enumerate(expected) if result['takeoff_mass'] >= 9]
+            self.assertTrue(0 < len(heavy) < 9)
+            np.testing.assert_array_equal(store.select(takeoff_mass=(9, None), chunk_rows=2), heavy)
+            by_payload = store.aggregate('takeoff_mass', by='payload', chunk_rows=4)
+            self.assertEqual(sorted(by_payload), [0.5, 1, 2])
+            self.assertAlmostEqual(by_payload[2]['mean'], np.mean([result['takeoff_mass'] for result in expected
+                                                                   if result['parameters']['payload'] == 2]))
+            self.assertEqual(store.aggregate('wing_loading')['count'], 3)
+
+            with open(store.path('payload'), 'ab') as column:  # A row torn part way through an append
+                column.write(np.float64(5).tobytes())
+            self.assertEqual(len(ResultStore(directory)), 9)
+            with ResultStore(directory, columns, mode='a', buffer_rows=4) as store:
+                store.append_rows(expected[:1])
+                study.run(workers=1, store=store)
+            self.assertEqual(ResultStore(directory)['takeoff_mass'][9], expected[0]['takeoff_mass'])
+            charts = create_study_charts(study, os.path.join(directory, 'charts'))  # Masses from rows 10 on
+            self.assertEqual([chart.takeoff_mass for chart in charts],
+                             [result['takeoff_mass'] for result in expected if result['parameters']['payload'] > 1])
+
+            mission = create_droan_mission()
+            PhasePower(mission)
+            arguments = [Motor(11.1, 0.8, 110), mission, Battery(11.1, 25, 2.2, 140), roskam_home_built]
+            uncertain = dict(specific_energy_density=normal(140, 15), maximum_takeoff_mass=9.5)
+            summary = MonteCarlo(*arguments, **uncertain).run(5000, seed=2)
+            monte_carlo = MonteCarlo(*arguments, **uncertain)
+            with ResultStore(os.path.join(directory, 'monte_carlo'), monte_carlo.create_columns(), mode='w') as store:
+                stored_summary = monte_carlo.run(5000, seed=2, memory_budget=2 ** 16, store=store)
+            self.assertTrue(0 < summary['failure_probability'] < 1)
+            self.assertEqual(stored_summary['failure_probability'], summary['failure_probability'])
+            for output, values in summary['percentiles'].items():
+                for percentile, value in values.items():
+                    self.assertAlmostEqual(stored_summary['percentiles'][output][percentile], value)
+            self.assertIsInstance(monte_carlo.failed, np.memmap)
+
+            store = ResultStore(os.path.join(directory, 'monte_carlo'))
+            succeeded = ~np.asarray(store['failed'])
+            percentiles = [0, 5, 37.5, 50, 95, 100]
+            for output in ['takeoff_mass', 'number_of_cells']:  # Found through the bins, and with many ties
+                np.testing.assert_allclose(store.calculate_percentiles(output, percentiles, chunk_rows=100,
+                                                                       where={'failed': (False, False)}),
+                                           np.percentile(store[output][succeeded], percentiles), rtol=1e-12)
+
+            lighter = dict(uncertain, specific_energy_density=normal(250, 15))  # A second run into the same store
+            alone = MonteCarlo(*arguments, **lighter).run(1000, seed=3)
+            appended = MonteCarlo(*arguments, **lighter)
+            with ResultStore(os.path.join(directory, 'monte_carlo'), mode='a') as store:
+                appended_summary = appended.run(1000, seed=3, store=store)
+            self.assertEqual((appended.first_stored_row, len(appended.failed)), (5000, 1000))
+            self.assertEqual(appended_summary['number_of_samples'], 1000)
+            self.assertEqual(appended_summary['failure_probability'], alone['failure_probability'])
+            self.assertAlmostEqual(appended_summary['percentiles']['takeoff_mass'][95],
+                                   alone['percentiles']['takeoff_mass'][95])
+
 
 if __name__ == '__main__':
     unittest.main()
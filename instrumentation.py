@@ -0,0 +1,105 @@
+""" Opt in call counts, wall times and recorded values for the sizing pipeline.
+
+Functions decorated with instrument(name) cost one flag check per call until enable() is called, after which every
+call adds to that name's count and inclusive wall time (a stage that calls other instrumented functions includes
+their time). record(name, value) keeps the count, total, minimum and maximum of values such as iteration counts.
+Everything lives in this module's globals, so each process has its own numbers: workers hand theirs back with
+collect() and the parent adds them with merge(). """
+import functools
+import json
+import time
+
+enabled = False
+timings = {}  # name -> [calls, seconds]
+values = {}  # name -> [count, total, minimum, maximum]
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def reset():
+    timings.clear()
+    values.clear()
+
+
+def instrument(name):
+    """ Decorator counting the calls and wall time of a function or method under name. """
+    def decorate(function):
+        @functools.wraps(function)
+        def instrumented(*arguments, **keywords):
+            if not enabled:
+                return function(*arguments, **keywords)
+            start = time.perf_counter()
+            try:
+                return function(*arguments, **keywords)
+            finally:
+                add_timing(name, 1, time.perf_counter() - start)
+        return instrumented
+    return decorate
+
+
+def add_timing(name, calls, seconds):
+    timing = timings.get(name)
+    if timing is None:
+        timings[name] = [calls, seconds]
+    else:
+        timing[0] += calls
+        timing[1] += seconds
+
+
+def record(name, value):
+    if enabled:
+        add_values(name, 1, value, value, value)
+
+
+def add_values(name, count, total, minimum, maximum):
+    value = values.get(name)
+    if value is None:
+        values[name] = [count, total, minimum, maximum]
+    else:
+        value[0] += count
+        value[1] += total
+        value[2] = min(value[2], minimum)
+        value[3] = max(value[3], maximum)
+
+
+def snapshot():
+    """ Plain data copy of the numbers so far, small and picklable. """
+    return {'timings': {name: list(timing) for name, timing in timings.items()},
+            'values': {name: list(value) for name, value in values.items()}}
+
+
+def collect():
+    """ snapshot() followed by reset(), so a worker hands back each number once. """
+    numbers = snapshot()
+    reset()
+    return numbers
+
+
+def merge(numbers):
+    for name, timing in numbers['timings'].items():
+        add_timing(name, *timing)
+    for name, value in numbers['values'].items():
+        add_values(name, *value)
+
+
+def create_report():
+    """ The numbers as a JSON ready dictionary, stages sorted by total time. """
+    return {'enabled': enabled,
+            'timings': {name: {'calls': calls, 'seconds': seconds, 'mean_seconds': seconds / calls}
+                        for name, [calls, seconds] in sorted(timings.items(), key=lambda item: -item[1][1])},
+            'values': {name: {'count': count, 'total': total, 'mean': total / count, 'minimum': minimum,
+                              'maximum': maximum}
+                       for name, [count, total, minimum, maximum] in sorted(values.items())}}
+
+
+def write_report(path):
+    with open(path, 'w') as report:
+        json.dump(create_report(), report, indent=2)
@@ -0,0 +1,132 @@
+import collections
+import math
+
+import numpy as np
+
+SimulationState = collections.namedtuple('SimulationState', [
+    'time', 'phase_index', 'power', 'state_of_charge', 'voltage_ratio', 'current', 'current_ratio'])
+
+SimulationSummary = collections.namedtuple('SimulationSummary', [
+    'energy_drawn', 'peak_power', 'final_state_of_charge', 'minimum_voltage_ratio', 'peak_current_ratio',
+    'low_voltage_time', 'feasible'])
+
+
+class MissionSimulation:
+    """ Definitely a class
+    Steps through mission.all_phases in flight order instead of assuming every phase draws its peak power
+    throughout. Speed changes linearly across a phase, so the aerodynamic power follows the instantaneous speed and
+    the kinetic power is m * v * dv/dt. Each pack discharges with a linear open circuit voltage, from
+    full_voltage_ratio times nominal when full to empty_voltage_ratio when empty, which sags under load through the
+    cell_resistance of its cells. Every step checks the loaded voltage against the mission's
+    lowest_voltage_maximum_power_ratio and the current against c_max.
+
+    The motor, battery, cell counts and takeoff_mass may all be arrays and broadcast to a shape of packs that are
+    simulated together. States come out one time step at a time from simulate(), or as arrays of chunk_size time
+    steps by packs from simulate(chunk_size), and only one chunk is ever held in memory. """
+
+    def __init__(self, mission, motor, battery, number_in_series, number_in_parallel, takeoff_mass=None,
+                 time_step=0.1, full_voltage_ratio=4.2 / 3.7, empty_voltage_ratio=3.0 / 3.7, cell_resistance=0.02):
+        """ time_step in seconds, takeoff_mass in kilograms and defaulting to the mission's takeoff mass guess,
+        cell_resistance in Ohms. """
+        takeoff_mass = mission.takeoff_mass_guess if takeoff_mass is None else takeoff_mass
+        arrays = np.broadcast_arrays(*[np.asarray(value, dtype=float) for value in [
+            takeoff_mass, motor.whole_chain_efficiency, battery.nominal_cell_voltage, battery.c_max,
+            battery.cell_capacity, number_in_series, number_in_parallel]])
+        self.shape = arrays[0].shape
+        [self.takeoff_mass, self.efficiency, cell_voltage, c_max, cell_capacity, number_in_series,
+         number_in_parallel] = [array.ravel() for array in arrays]
+        self.phases = list(mission.all_phases)
+        self.time_step = time_step
+        self.lowest_voltage_ratio = mission.lowest_voltage_maximum_power_ratio
+        self.full_voltage_ratio = full_voltage_ratio
+        self.empty_voltage_ratio = empty_voltage_ratio
+        self.nominal_pack_voltage = number_in_series * cell_voltage
+        self.pack_energy = number_in_series * number_in_parallel * cell_voltage * cell_capacity
+        self.current_limit = c_max * cell_capacity * number_in_parallel
+        self.pack_resistance = cell_resistance * number_in_series / number_in_parallel
+
+    def create_time_steps(self, chunk_size):
+        """ Yields [time, phase_index, step_length, specific_power] arrays of chunk_size steps (the last one may be
+        shorter), filling each chunk across phase boundaries. specific_power is in watts per kilogram. """
+        pieces = []
+        buffered = 0
+        elapsed = 0.0
+        for phase_index, phase in enumerate(self.phases):
+            number_of_steps = max(1, math.ceil(phase.time / self.time_step - 1e-9))
+            for first_step in range(0, number_of_steps, chunk_size):
+                step = np.arange(first_step, min(first_step + chunk_size, number_of_steps), dtype=float)
+                step_start = step * self.time_step
+                step_length = np.minimum(self.time_step, phase.time - step_start)
+                middle = (step_start + step_length / 2) / phase.time
+                speed = phase.final_speed - phase.speed_change * (1 - middle)
+                acceleration = phase.speed_change / phase.time
+                specific_power = np.maximum(speed * acceleration + 9.80665 * phase.vertical_speed
+                                            + 9.80665 * speed / phase.lift_over_drag, 0)
+                pieces.append([elapsed + step_start + step_length, np.full(step.shape, phase_index), step_length,
+                               specific_power])
+                buffered += len(step)
+                while buffered >= chunk_size:
+                    chunk = [np.concatenate(column) for column in zip(*pieces)]
+                    yield [column[:chunk_size] for column in chunk]
+                    pieces = [[column[chunk_size:] for column in chunk]]
+                    buffered -= chunk_size
+            elapsed += phase.time
+        if buffered:
+            yield [np.concatenate(column) for column in zip(*pieces)]
+
+    def simulate(self, chunk_size=None):
+        """ Without chunk_size every time step is yielded as a SimulationState of arrays shaped like the packs. With
+        it, SimulationStates hold chunk_size steps along a leading axis (packs flattened along the second). """
+        drawn = np.zeros(self.pack_energy.shape)
+        for [time, phase_index, step_length, specific_power] in self.create_time_steps(chunk_size or 1024):
+            power = specific_power[:, np.newaxis] * self.takeoff_mass
+            drawn_energy = drawn + np.cumsum(power * (step_length[:, np.newaxis] / self.efficiency), axis=0)
+            drawn = drawn_energy[-1]
+            state_of_charge = 1 - drawn_energy / self.pack_energy
+            open_circuit_voltage = self.nominal_pack_voltage * (self.empty_voltage_ratio + np.maximum(
+                state_of_charge, 0) * (self.full_voltage_ratio - self.empty_voltage_ratio))
+            current = self.calculate_current(power / self.efficiency, open_circuit_voltage)
+            voltage_ratio = (open_circuit_voltage - current * self.pack_resistance) / self.nominal_pack_voltage
+            states = SimulationState(time, phase_index, power, state_of_charge, voltage_ratio, current,
+                                     current / self.current_limit)
+            if chunk_size:
+                yield states
+            else:
+                for step in range(len(time)):
+                    yield SimulationState(time[step], int(phase_index[step]),
+                                          *[value[step].reshape(self.shape) for value in states[2:]])
+
+    def calculate_current(self, battery_power, open_circuit_voltage):
+        """ Smaller root of battery_power = (open_circuit_voltage - current * resistance) * current. Asking for more
+        than a pack can deliver clips the discriminant, which leaves the voltage at half or less. """
+        discriminant = np.maximum(open_circuit_voltage ** 2 - 4 * self.pack_resistance * battery_power, 0)
+        return 2 * battery_power / (open_circuit_voltage + discriminant ** 0.5)
+
+    def summarize(self, chunk_size=4096):
+        """ Runs the whole mission in chunks and keeps only running totals. feasible is True where a pack finishes
+        with charge left, never draws more than its current limit and never sags below the lowest voltage ratio. A
+        mission without phases leaves every pack full and resting at full_voltage_ratio. """
+        peak_power = np.zeros(self.pack_energy.shape)
+        minimum_voltage_ratio = np.full(self.pack_energy.shape, np.inf)
+        peak_current_ratio = np.zeros(self.pack_energy.shape)
+        low_voltage_time = np.zeros(self.pack_energy.shape)
+        states = None
+        previous_time = 0.0
+        for states in self.simulate(chunk_size):
+            peak_power = np.maximum(peak_power, states.power.max(axis=0))
+            minimum_voltage_ratio = np.minimum(minimum_voltage_ratio, states.voltage_ratio.min(axis=0))
+            peak_current_ratio = np.maximum(peak_current_ratio, states.current_ratio.max(axis=0))
+            step_length = np.diff(states.time, prepend=previous_time)
+            previous_time = states.time[-1]
+            low_voltage_time += ((states.voltage_ratio < self.lowest_voltage_ratio)
+                                 * step_length[:, np.newaxis]).sum(axis=0)
+        if states is None:
+            final_state_of_charge = np.ones(self.pack_energy.shape)
+            minimum_voltage_ratio = np.full(self.pack_energy.shape, self.full_voltage_ratio)
+        else:
+            final_state_of_charge = states.state_of_charge[-1]
+        feasible = (final_state_of_charge >= 0) & (peak_current_ratio <= 1) \
+            & (minimum_voltage_ratio >= self.lowest_voltage_ratio)
+        return SimulationSummary(*[value.reshape(self.shape) for value in [
+            (1 - final_state_of_charge) * self.pack_energy, peak_power, final_state_of_charge, minimum_voltage_ratio,
+            peak_current_ratio, low_voltage_time, feasible]])
@@ -0,0 +1,162 @@
+import collections
+import copy
+
+import numpy as np
+
+from preliminary_sizing import BatchMassIteration
+
+
+def normal(mean, standard_deviation):
+    return lambda random, size: random.normal(mean, standard_deviation, size)
+
+
+def uniform(low, high):
+    return lambda random, size: random.uniform(low, high, size)
+
+
+def triangular(low, mode, high):
+    return lambda random, size: random.triangular(low, mode, high, size)
+
+
+def lognormal(median, sigma):
+    """ median in the units of the input, sigma of its natural log. """
+    return lambda random, size: median * random.lognormal(0, sigma, size)
+
+
+def calculate_trend_scatter(historical_trend):
+    """ Weighted standard deviation of log10(empty mass) about the fitted trend, the spread of a new design's
+    empty mass around the line. """
+    [trend_slope, trend_y_intercept] = historical_trend.calculate_trend()
+    [log_takeoff_mass, log_empty_mass] = historical_trend.regression_terms[:, 1:3].T
+    residual = log_empty_mass - (trend_slope * log_takeoff_mass + trend_y_intercept)
+    weights = historical_trend.plane_weights
+    return float(np.sqrt(weights @ residual ** 2 / (weights.sum() - 2)))
+
+
+class MonteCarlo:
+    """ Definitely a class
+    Propagates uncertain inputs through BatchMassIteration, a chunk of samples at a time. Each uncertain input is a
+    number, to hold it fixed, or a sampler called as sampler(random, size) such as normal(140, 10) from this module:
+    specific_energy_density of the cells (watt hours per kilogram), whole_chain_efficiency of the motor,
+    lift_over_drag_scale multiplying every phase's lift_over_drag and empty_mass_residual added to the trend's log10
+    empty mass. empty_mass_residual='trend' samples the scatter of the historical trend's own planes.
+
+    A sample fails when its mass iteration does not converge or its takeoff mass exceeds maximum_takeoff_mass, and
+    the percentiles are taken over the samples that do not fail. """
+
+    outputs = {'takeoff_mass': 'iterated_takeoff_mass', 'empty_mass': 'iterated_empty_mass',
+               'battery_pack_mass': 'battery_pack_mass', 'number_of_cells': 'number_of_cells'}
+
+    def __init__(self, motor, mission, battery, historical_trend, specific_energy_density=None,
+                 whole_chain_efficiency=None, lift_over_drag_scale=1, empty_mass_residual=0,
+                 maximum_takeoff_mass=np.inf, acceptable_error=0.005, couple_phase_power=False,
+                 maximum_iterations=200):
+        self.motor = motor
+        self.mission = mission
+        self.battery = battery
+        self.historical_trend = historical_trend
+        if empty_mass_residual == 'trend':
+            empty_mass_residual = normal(0, calculate_trend_scatter(historical_trend))
+        self.inputs = {'specific_energy_density': battery.specific_energy_density / 3600
+                       if specific_energy_density is None else specific_energy_density,
+                       'whole_chain_efficiency': motor.whole_chain_efficiency
+                       if whole_chain_efficiency is None else whole_chain_efficiency,
+                       'lift_over_drag_scale': lift_over_drag_scale,
+                       'empty_mass_residual': empty_mass_residual}
+        self.maximum_takeoff_mass = maximum_takeoff_mass
+        self.acceptable_error = acceptable_error
+        self.couple_phase_power = couple_phase_power
+        self.maximum_iterations = maximum_iterations
+        self.samples = None
+        self.results = None
+        self.failed = None
+        self.store = None
+        self.first_stored_row = 0  # The store's row of the first sample
+
+    def run(self, number_of_samples, seed=None, memory_budget=2 ** 28, percentiles=(5, 50, 95), store=None):
+        """ Returns {'failure_probability': ..., 'percentiles': {output: {percentile: value}}}. memory_budget in
+        bytes bounds the working arrays of a chunk; the samples and results of the whole run are kept as well,
+        unless a result_store.ResultStore of the columns of create_columns is given. Every chunk is then appended
+        to the store, samples, results and failed are memory maps of the rows of this run, the store's rows from
+        first_stored_row on, and the summary is taken from those rows a chunk at a time, so memory stays bounded by
+        the chunk whatever number_of_samples is. """
+        streams = np.random.SeedSequence(seed).spawn(len(self.inputs))  # One per input, so chunking changes nothing
+        randoms = {name: np.random.default_rng(stream) for name, stream in zip(self.inputs, streams)}
+        chunk_size = self.calculate_chunk_size(memory_budget)
+        self.store = store
+        self.first_stored_row = len(store) + store.buffered_rows if store is not None else 0
+        rows = chunk_size if store is not None else number_of_samples
+        self.samples = {name: np.empty(rows) for name in self.inputs}
+        self.results = {output: np.empty(rows) for output in self.outputs}
+        self.failed = np.empty(rows, dtype=bool)
+        for start in range(0, number_of_samples, chunk_size):
+            size = min(chunk_size, number_of_samples - start)
+            chunk = slice(0, size) if store is not None else slice(start, start + size)
+            for name, value in self.inputs.items():
+                self.samples[name][chunk] = value(randoms[name], size) if callable(value) else value
+            iteration = self.iterate_mass(**{name: samples[chunk] for name, samples in self.samples.items()})
+            for output, attribute in self.outputs.items():
+                self.results[output][chunk] = getattr(iteration, attribute)
+            self.failed[chunk] = ~iteration.converged \
+                | ~(iteration.iterated_takeoff_mass <= self.maximum_takeoff_mass)
+            if store is not None:
+                store.append(dict({name: values[chunk] for name, values in self.samples.items()},
+                                  failed=self.failed[chunk],
+                                  **{output: values[chunk] for output, values in self.results.items()}))
+        if store is not None:
+            store.flush()
+            first = self.first_stored_row
+            self.samples = {name: store[name][first:] for name in self.inputs}
+            self.results = {output: store[output][first:] for output in self.outputs}
+            self.failed = store['failed'][first:]
+        return self.summarize(percentiles)
+
+    def create_columns(self):
+        """ The columns of a result_store.ResultStore for run: the inputs, the outputs and whether a sample failed. """
+        columns = collections.OrderedDict((name, 'f8') for name in self.inputs)
+        columns.update((output, 'i8' if output == 'number_of_cells' else 'f8') for output in self.outputs)
+        columns['failed'] = '?'
+        return columns
+
+    def calculate_chunk_size(self, memory_budget):
+        """ About forty arrays of the batch size, and one of the batch size by phases when the lift to drag ratio
+        varies, are alive at once inside BatchMassIteration. """
+        bytes_per_sample = 8 * (40 + len(self.mission.unique_phases))
+        return max(1, int(memory_budget // bytes_per_sample))
+
+    def iterate_mass(self, specific_energy_density, whole_chain_efficiency, lift_over_drag_scale,
+                     empty_mass_residual):
+        motor = copy.copy(self.motor)
+        motor.whole_chain_efficiency = whole_chain_efficiency
+        battery = copy.copy(self.battery)
+        battery.specific_energy_density = specific_energy_density * 3600  # As Battery stores it, in joules
+        battery.battery_cell_mass = battery.cell_capacity * battery.nominal_cell_voltage \
+            / battery.specific_energy_density
+        return BatchMassIteration(motor, self.mission, battery, self.historical_trend,
+                                  acceptable_error=self.acceptable_error, couple_phase_power=self.couple_phase_power,
+                                  maximum_iterations=self.maximum_iterations,
+                                  lift_over_drag_scale=lift_over_drag_scale, empty_mass_residual=empty_mass_residual)
+
+    def summarize(self, percentiles=(5, 50, 95)):
+        if self.store is not None:
+            return self.summarize_store(percentiles)
+        succeeded = ~self.failed
+        summary = {'number_of_samples': len(self.failed), 'failure_probability': float(self.failed.mean()),
+                   'percentiles': {}}
+        for output in self.outputs:
+            values = np.percentile(self.results[output][succeeded], percentiles) if succeeded.any() \
+                else np.full(len(percentiles), np.nan)
+            summary['percentiles'][output] = dict(zip(percentiles, values.tolist()))
+        return summary
+
+    def summarize_store(self, percentiles=(5, 50, 95)):
+        """ summarize for a run kept in a store, from its rows only and without reading them into memory. """
+        rows = [self.first_stored_row, None]
+        failed = self.store.aggregate('failed', rows=rows)
+        summary = {'number_of_samples': failed['count'],
+                   'failure_probability': failed['mean'] if failed['count'] else np.nan, 'percentiles': {}}
+        for output in self.outputs:
+            values = self.store.calculate_percentiles(output, percentiles, where={'failed': (False, False)},
+                                                      rows=rows)
+            summary['percentiles'][output] = dict(zip(percentiles, values))
+        return summary
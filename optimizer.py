@@ -0,0 +1,303 @@
+import collections
+import concurrent.futures
+import copy
+import itertools
+import math
+
+import instrumentation
+import trade_study
+from preliminary_sizing import BatteryPackMass, Matching, PhasePower
+from trade_study import add_takeoff_mass, size_design_case
+
+Variable = collections.namedtuple('Variable', ['name', 'lower', 'upper', 'integer', 'start'])
+Variable.__new__.__defaults__ = (False, None)
+
+PACK_VARIABLES = ['number_in_series', 'number_in_parallel']
+
+
+def size_fixed_pack(case, number_in_series, number_in_parallel, historical_trend, maximum_iterations=50):
+    """ The takeoff mass of a case flying a pack of the given cell counts, m = payload + pack + empty mass required
+    solved by Newton's method, and the margins of the counts over what BatteryPackMass asks for at that mass. """
+    [trend_slope, trend_y_intercept] = historical_trend.calculate_trend()
+    battery_pack_mass = number_in_series * number_in_parallel * case.battery.battery_cell_mass
+    mission = copy.deepcopy(case.mission)
+    takeoff_mass = mission.takeoff_mass_guess
+    converged = False
+    for iterations in range(1, maximum_iterations + 1):
+        empty_mass_required = 10 ** (math.log10(takeoff_mass) * trend_slope + trend_y_intercept)
+        residual = takeoff_mass - mission.payload - battery_pack_mass - empty_mass_required
+        step = residual / (1 - trend_slope * empty_mass_required / takeoff_mass)
+        takeoff_mass = max(takeoff_mass - step, takeoff_mass / 2)  # Stay on the positive side of the log
+        if abs(step) <= case.acceptable_error * 1e-3 * takeoff_mass:
+            converged = True
+            break
+    mission.takeoff_mass_guess = takeoff_mass
+    PhasePower(mission)
+    required = BatteryPackMass(case.motor, mission, case.battery)
+    result = {'takeoff_mass': float(takeoff_mass),
+              'empty_mass': float(takeoff_mass - mission.payload - battery_pack_mass),
+              'battery_pack_mass': float(battery_pack_mass),
+              'number_in_series': int(number_in_series),
+              'number_in_parallel': int(number_in_parallel),
+              'number_of_cells': int(number_in_series * number_in_parallel),
+              'maximum_power': float(mission.maximum_power),
+              'converged': converged,
+              'iterations': iterations,
+              'series_margin': int(number_in_series - required.number_in_series),
+              'parallel_margin': int(number_in_parallel - required.number_in_parallel)}
+    return [result, mission]
+
+
+def calculate_required_power_loading(matching, specs, wing_loading):
+    """ The lowest takeoff, climb or cruise power loading in Newtons per Watt at a wing loading in Pascals. """
+    calculators = {'takeoff': matching.calculate_takeoff_power_loading,
+                   'climb': matching.calculate_climb_power_loading,
+                   'cruise': matching.calculate_cruise_power_loading}
+    power_loadings = [float(calculators[kind](wing_loading, **spec).min())
+                      for kind in calculators for name, spec in matching.name_constraints(kind, specs.get(kind))]
+    return min(power_loadings, default=math.inf)
+
+
+def evaluate_design(case, variables, historical_trend=None):
+    """ trade_study.size_design_case with the optimizer's extras. number_in_series and number_in_parallel among the
+    variables fix the pack instead of sizing it, and give series_margin and parallel_margin. With matching the
+    design is flown at the wing_loading variable if there is one, or at the design point, and wing_loading_margin
+    (Pascals under the stall and landing limit) and power_margin (watts of max_continuous_power over the power the
+    matching chart asks for there) are added. """
+    historical_trend = case.historical_trend if case.historical_trend is not None else historical_trend
+    if all(name in variables for name in PACK_VARIABLES):
+        [result, mission] = size_fixed_pack(case, variables['number_in_series'], variables['number_in_parallel'],
+                                            historical_trend)
+        result = dict({'name': case.name, 'parameters': case.parameters}, **result)
+    else:
+        result = size_design_case(case, historical_trend)
+    if case.matching:
+        takeoff_mass = result['takeoff_mass']
+        specs = add_takeoff_mass(case.matching, takeoff_mass)
+        matching = Matching(takeoff_mass)
+        design_point = matching.solve_design_point(**specs)
+        wing_loading = variables.get('wing_loading', design_point.wing_loading)
+        power_loading = calculate_required_power_loading(matching, specs, wing_loading) \
+            if 'wing_loading' in variables else design_point.power_loading
+        result.update({'wing_loading': float(wing_loading), 'power_loading': float(power_loading),
+                       'active_constraints': design_point.active_constraints,
+                       'wing_loading_margin': float(design_point.maximum_wing_loading - wing_loading),
+                       'power_margin': float(case.motor.max_continuous_power
+                                             - takeoff_mass * 9.80665 / power_loading)})
+    return result
+
+
+def evaluate_designs(designs, historical_trend=None):
+    """ [result or None, error or None] for every (case, variables), so one failing design does not stop the rest. """
+    historical_trend = historical_trend if historical_trend is not None else trade_study.worker_historical_trend
+    evaluations = []
+    for case, variables in designs:
+        try:
+            evaluations.append([evaluate_design(case, variables, historical_trend), None])
+        except (ArithmeticError, ValueError) as error:
+            evaluations.append([None, '{}: {}'.format(type(error).__name__, error)])
+    return evaluations
+
+
+class DesignOptimizer:
+    """ Definitely a class
+    Minimizes an objective of the sizing pipeline over continuous and integer design variables, subject to bounds on
+    results. create_case is called with one value per variable as keyword arguments and returns a DesignCase, like
+    TradeStudy.from_grid's. objective is a result key such as 'takeoff_mass', a variable name such as an endurance
+    phase time, or a function of (variables, result), and maximize=True maximizes it instead. constraints maps result
+    keys or variable names to (lowest, highest) pairs, either end None for open. The margins evaluate_design adds for
+    fixed packs and matching are constrained to be at least zero without being listed, and a design whose mass
+    iteration did not converge or that raised is infeasible.
+
+    The search is a compass search, since cell counts make the pipeline a staircase that gradients do not see. Every
+    iteration evaluates the current design moved up and down one step along each variable, those points in parallel
+    when workers is above one, and moves to the best of them or halves the steps. Integer variables step by whole
+    numbers down to one, continuous ones until the step is below tolerance of their range. Before giving up, moves
+    along every pair of variables are tried at each step size, and the search starts over from the first steps if
+    one of them is better. A feasible design beats an infeasible one, two infeasible ones compare by total
+    constraint violation.
+
+    Every evaluation is memoized by its variables, so revisited points cost nothing, and with a ResultCache results
+    are also kept on disk between runs. history lists every point asked for as a dictionary of its variables,
+    objective, violation, feasibility, result or error, and whether it was memoized. """
+
+    margins = ['series_margin', 'parallel_margin', 'wing_loading_margin', 'power_margin']
+
+    def __init__(self, create_case, variables, objective='takeoff_mass', maximize=False, constraints=None,
+                 historical_trend=None, cache=None):
+        self.create_case = create_case
+        self.variables = [Variable(*variable) if not isinstance(variable, Variable) else variable
+                          for variable in variables]
+        self.objective = objective
+        self.maximize = maximize
+        self.constraints = dict(constraints or {})
+        self.historical_trend = historical_trend
+        self.cache = cache
+        self.evaluations = {}  # variable values -> [result, error]
+        self.history = []
+        self.best = None
+        self.maximum_evaluations = math.inf  # Set by run
+
+    def create_start(self):
+        start = []
+        for variable in self.variables:
+            value = variable.start if variable.start is not None else (variable.lower + variable.upper) / 2
+            start.append(self.round_value(variable, value))
+        return tuple(start)
+
+    def round_value(self, variable, value):
+        value = min(max(value, variable.lower), variable.upper)
+        return int(round(value)) if variable.integer else float(value)
+
+    def create_steps(self):
+        return [max(1, int((variable.upper - variable.lower) // 4)) if variable.integer
+                else (variable.upper - variable.lower) / 4 for variable in self.variables]
+
+    def calculate_objective(self, values, result):
+        variables = dict(zip([variable.name for variable in self.variables], values))
+        if callable(self.objective):
+            value = self.objective(variables, result)
+        else:
+            value = variables[self.objective] if self.objective in variables else result[self.objective]
+        return -value if self.maximize else value
+
+    def calculate_violation(self, values, result):
+        variables = dict(zip([variable.name for variable in self.variables], values))
+        if result is None or not result['converged']:
+            return math.inf
+        bounds = dict({margin: (0, None) for margin in self.margins if margin in result}, **self.constraints)
+        violation = 0
+        for name, [lowest, highest] in bounds.items():
+            value = variables[name] if name in variables else result[name]
+            if lowest is not None:
+                violation += max(lowest - value, 0)
+            if highest is not None:
+                violation += max(value - highest, 0)
+        return violation
+
+    def create_record(self, values, iteration, memoized):
+        [result, error] = self.evaluations[values]
+        violation = self.calculate_violation(values, result)
+        objective = self.calculate_objective(values, result) if result is not None else math.inf
+        return {'iteration': iteration, 'variables': dict(zip([variable.name for variable in self.variables], values)),
+                'objective': -objective if self.maximize else objective, 'violation': violation,
+                'feasible': violation == 0, 'result': result, 'error': error, 'memoized': memoized,
+                'rank': (violation > 0, violation, objective)}
+
+    def evaluate(self, points, iteration, executor=None):
+        """ History records for points, sizing only those not evaluated before. """
+        pending = [values for values in dict.fromkeys(points) if values not in self.evaluations]
+        designs = []
+        for values in pending:
+            variables = dict(zip([variable.name for variable in self.variables], values))
+            designs.append((self.create_case(**variables), variables))
+        keys = [self.calculate_cache_key(*design) for design in designs] if self.cache is not None else None
+        missing = []
+        for index, values in enumerate(pending):
+            result = self.cache.get(keys[index]) if self.cache is not None else None
+            if result is None:
+                missing.append(index)
+            else:
+                self.evaluations[values] = [result, None]
+        if executor is None:
+            evaluations = evaluate_designs([designs[index] for index in missing], self.historical_trend)
+        else:
+            chunks = [[designs[index]] for index in missing]
+            evaluations = [evaluation for chunk in executor.map(evaluate_designs, chunks) for evaluation in chunk]
+        for index, evaluation in zip(missing, evaluations):
+            self.evaluations[pending[index]] = evaluation
+            if self.cache is not None and evaluation[0] is not None:
+                self.cache.set(keys[index], evaluation[0])
+        records = [self.create_record(values, iteration, values not in pending) for values in points]
+        self.history += records
+        return records
+
+    def calculate_cache_key(self, case, variables):
+        """ The case's contents plus the variables evaluate_design reads directly. """
+        extras = {name: variables[name] for name in PACK_VARIABLES + ['wing_loading'] if name in variables}
+        return self.cache.key('DesignOptimizer', case.mission, case.motor, case.battery,
+                              case.historical_trend if case.historical_trend is not None else self.historical_trend,
+                              case.matching, case.method, case.acceptable_error, extras)
+
+    def create_poll(self, values, steps):
+        poll = []
+        for index, [variable, step] in enumerate(zip(self.variables, steps)):
+            for direction in [1, -1]:
+                moved = list(values)
+                moved[index] = self.round_value(variable, values[index] + direction * step)
+                if moved[index] != values[index]:
+                    poll.append(tuple(moved))
+        return poll
+
+    def create_pair_poll(self, values, steps):
+        poll = []
+        for first, second in itertools.combinations(range(len(self.variables)), 2):
+            for directions in itertools.product([1, -1], repeat=2):
+                moved = list(values)
+                for index, direction in zip([first, second], directions):
+                    moved[index] = self.round_value(self.variables[index], values[index] + direction * steps[index])
+                if moved[first] != values[first] and moved[second] != values[second]:
+                    poll.append(tuple(moved))
+        return poll
+
+    def limit_poll(self, poll):
+        """ poll without the new points past maximum_evaluations, the memoized ones costing nothing. """
+        remaining = self.maximum_evaluations - len(self.evaluations)
+        limited = []
+        for values in dict.fromkeys(poll):
+            if values in self.evaluations or remaining > 0:
+                remaining -= values not in self.evaluations
+                limited.append(values)
+        return limited
+
+    def poll_pairs(self, current, iteration, smallest_steps, executor=None):
+        """ The best pair move from the first steps down to the smallest, stopping at the first scale that improves
+        on current, since a longer phase may need one more cell and a much shorter one one cell less. """
+        steps = self.create_steps()
+        while True:
+            poll = self.limit_poll(self.create_pair_poll(tuple(current['variables'].values()), steps))
+            records = self.evaluate(poll, iteration, executor) if poll else []
+            best = min(records, key=lambda record: record['rank'], default=current)
+            if best['rank'] < current['rank'] or all(
+                    step <= smallest for step, smallest in zip(steps, smallest_steps)):
+                return best
+            steps = [max(1, step // 2) if variable.integer else step / 2
+                     for variable, step in zip(self.variables, steps)]
+
+    def run(self, maximum_evaluations=2000, tolerance=1e-4, workers=1):
+        """ Returns the history record of the best design found, after sizing no more than maximum_evaluations
+        designs, the memoized ones included. workers above one evaluates each iteration's
+        points over a process pool that shares the historical trend like TradeStudy's. """
+        if workers == 1:
+            trade_study.share_historical_trend(self.historical_trend)
+            return self.search(maximum_evaluations, tolerance)
+        with concurrent.futures.ProcessPoolExecutor(
+                workers, initializer=trade_study.initialize_worker,
+                initargs=(self.historical_trend, instrumentation.enabled)) as executor:
+            return self.search(maximum_evaluations, tolerance, executor)
+
+    def search(self, maximum_evaluations, tolerance, executor=None):
+        self.maximum_evaluations = maximum_evaluations
+        steps = self.create_steps()
+        smallest_steps = [1 if variable.integer else tolerance * (variable.upper - variable.lower)
+                          for variable in self.variables]
+        [current] = self.evaluate([self.create_start()], 0, executor)
+        iteration = 0
+        while len(self.evaluations) < maximum_evaluations:
+            iteration += 1
+            poll = self.limit_poll(self.create_poll(tuple(current['variables'].values()), steps))
+            records = self.evaluate(poll, iteration, executor) if poll else []
+            best = min(records, key=lambda record: record['rank'], default=current)
+            if best['rank'] < current['rank']:
+                current = best
+                continue
+            if all(step <= smallest for step, smallest in zip(steps, smallest_steps)):
+                best = self.poll_pairs(current, iteration, smallest_steps, executor)
+                if best['rank'] >= current['rank']:
+                    break
+                [current, steps] = [best, self.create_steps()]
+                continue
+            steps = [max(1, step // 2) if variable.integer else step / 2
+                     for variable, step in zip(self.variables, steps)]
+        self.best = current
+        return current
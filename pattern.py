@@ -1,5 +1,7 @@
 import math
 
+import numpy as np
+
 
 class Shape:
     """ This class receives airfield pattern specific variables and determines possible configurations the pattern can
@@ -137,10 +139,153 @@ class Shape:
         return self.d[0] - self.j[0] / 2
 
 
-East_Bay = Shape(163, 3, 30, 2.54, 75, 13.4, 0)
-print("Final leg is {0:1.0f} meters".format(East_Bay.final_length))
-print("Straight climb distance is {0:1.0f} meters".format(East_Bay.initial_climb_length))
-print("Pattern width is {0:1.0f} meters".format(East_Bay.pattern_diameter))
-print("Downwind distance is {0:1.0f} meters".format(East_Bay.downwind_length))
-print("Available distance needed before runway is {0:1.0f} meters.".format(East_Bay.before_runway_length))
-print("Available distance needed after runway is {0:1.0f} meters.".format(East_Bay.after_runway_length))
+class PatternShapes:
+    """ Definitely a class
+    Shape for whole arrays of airfields at once, e.g. every runway of an airport database. The inputs are those of
+    Shape and broadcast against each other, and every attribute is an array of their shape, with the points a to j
+    carrying a trailing [x, y, z] axis. Instead of raising, airfields whose headwind equals or exceeds the approach
+    speed, or whose climb rate exceeds the approach speed, are False in feasible and NaN in every length.
+
+    The two levels of branching in Shape.j_calculator become masks: turn_limited is True where the minimum turn
+    radius rather than the 15 second final sets the base turn, and extended_final where the final has to be stretched
+    so the descent does not begin before point G. """
+
+    def __init__(self, field_length, glide_slope, pattern_altitude, climb_rate, turn_radius, approach_speed, headwind):
+        [field_length, glide_slope, pattern_altitude, climb_rate, turn_radius, approach_speed, headwind] = \
+            np.broadcast_arrays(*[np.asarray(value, dtype=float) for value in [
+                field_length, glide_slope, pattern_altitude, climb_rate, turn_radius, approach_speed, headwind]])
+        self.feasible = (headwind < approach_speed) & (climb_rate <= approach_speed)
+        tangent = np.tan(np.radians(glide_slope))
+        zero = np.zeros(field_length.shape)
+        nan = np.where(self.feasible, 1, np.nan)  # Carries the infeasible airfields through as NaN
+
+        # Points a through j are detailed in pattern.pdf
+        self.a = np.stack([zero, zero, 0.25 * field_length * tangent], axis=-1)
+        self.b = np.stack([0.25 * field_length, zero, zero], axis=-1)
+        self.c = np.stack([0.5 * field_length, zero, zero], axis=-1)
+        climb_time = 0.7 * pattern_altitude / climb_rate
+        with np.errstate(invalid='ignore'):
+            horizontal_ground_speed = (approach_speed ** 2 - climb_rate ** 2) ** 0.5 - headwind
+        self.d = np.stack([(climb_time * horizontal_ground_speed + 0.5 * field_length) * nan, zero,
+                           0.7 * pattern_altitude], axis=-1)
+
+        x_15 = 15 * approach_speed * np.cos(np.radians(glide_slope)) - headwind  # 15 second final length
+        descent_length = pattern_altitude / tangent
+        self.turn_limited = x_15 / 2 < turn_radius
+        base_leg = np.where(self.turn_limited, 2 * turn_radius, x_15)  # Shortest final the base turn allows
+        base_turn_radius = np.where(self.turn_limited, turn_radius, x_15 / 2)
+        h2i = descent_length - 0.25 * field_length - x_15 - math.pi * base_turn_radius
+        self.extended_final = base_leg < h2i
+        final_length = np.where(self.extended_final, h2i, base_leg) * nan
+        self.j = np.stack([-final_length, zero, self.a[..., 2] + tangent * final_length], axis=-1)
+
+        radius = final_length / 2  # The pattern's turn radius is half the final leg due to 45 degree geometry
+        self.i = np.stack([-final_length, final_length, math.pi * radius * tangent + self.j[..., 2]], axis=-1)
+        h2i_x = descent_length - 0.25 * field_length - final_length - radius
+        self.h = np.stack([self.i[..., 0] + h2i_x, self.i[..., 1], pattern_altitude], axis=-1)
+        self.g = np.stack([zero, self.h[..., 1], pattern_altitude], axis=-1)
+        self.f = np.stack([self.d[..., 0], self.g[..., 1], self.g[..., 2]], axis=-1)
+
+        self.initial_climb_length = self.d[..., 0] - self.c[..., 0]
+        self.descent_length = (self.h[..., 0] - self.i[..., 0]) + (math.pi * self.i[..., 1] / 2) + final_length \
+            + self.b[..., 0]
+        self.final_length = final_length
+        self.downwind_length = self.f[..., 0] - self.i[..., 0]
+        self.pattern_diameter = self.i[..., 1]
+        self.before_runway_length = 1.5 * final_length
+        self.after_runway_length = self.d[..., 0] + final_length / 2
+
+    def check_fit(self, before_runway_length, after_runway_length, pattern_diameter):
+        """ True where the pattern is feasible and fits within the available distances in meters. """
+        with np.errstate(invalid='ignore'):
+            return self.feasible & (self.before_runway_length <= before_runway_length) \
+                & (self.after_runway_length <= after_runway_length) & (self.pattern_diameter <= pattern_diameter)
+
+
+class PatternEnvelope:
+    """ Definitely a class
+    Worst case before_runway_length, after_runway_length and pattern_diameter of each airfield over a grid of
+    headwinds, glide slopes and approach speeds. The airfield inputs broadcast to any shape and the three condition
+    grids are 1-D, so feasible has the airfield shape followed by the grid shape. Infeasible cells are False there and
+    are left out of the worst case rather than raising.
+
+    Neighbouring cells that land on different branches of Shape.j_calculator (or on either side of feasibility) are
+    bisected refinements times, so the corners of the geometry between grid points are sampled as well. worst_case
+    and critical_condition hold, for each metric, the largest value found and the headwind, glide slope and approach
+    speed it occurs at, NaN where an airfield has no feasible condition. """
+
+    metrics = ['before_runway_length', 'after_runway_length', 'pattern_diameter']
+
+    def __init__(self, field_length, pattern_altitude, climb_rate, turn_radius, headwinds, glide_slopes,
+                 approach_speeds, refinements=4):
+        airfields = np.broadcast_arrays(*[np.asarray(value, dtype=float) for value in [
+            field_length, pattern_altitude, climb_rate, turn_radius]])
+        self.shape = airfields[0].shape
+        self.airfields = [airfield.ravel() for airfield in airfields]
+        grid = [np.asarray(values, dtype=float) for values in [headwinds, glide_slopes, approach_speeds]]
+        index = np.arange(self.airfields[0].size).reshape(-1, 1, 1, 1)
+        conditions = np.broadcast_arrays(index, *np.meshgrid(*grid, indexing='ij'))
+        shapes = self.evaluate(*conditions)
+        self.feasible = shapes.feasible.reshape(self.shape + shapes.feasible.shape[1:])
+        samples = [self.collect_samples(conditions, shapes)]
+        branches = self.identify_branches(shapes)
+        for axis in [1, 2, 3]:
+            lower = tuple(slice(None, -1) if dimension == axis else slice(None) for dimension in range(4))
+            upper = tuple(slice(1, None) if dimension == axis else slice(None) for dimension in range(4))
+            switches = branches[lower] != branches[upper]
+            samples += self.refine([condition[lower][switches] for condition in conditions],
+                                   [condition[upper][switches] for condition in conditions],
+                                   branches[lower][switches], refinements)
+        self.number_of_samples = sum(len(sample[0]) for sample in samples)
+        self.find_worst_cases([np.concatenate(column) for column in zip(*samples)])
+
+    def evaluate(self, index, headwind, glide_slope, approach_speed):
+        [field_length, pattern_altitude, climb_rate, turn_radius] = [airfield[index] for airfield in self.airfields]
+        return PatternShapes(field_length, glide_slope, pattern_altitude, climb_rate, turn_radius, approach_speed,
+                             headwind)
+
+    def identify_branches(self, shapes):
+        return shapes.feasible + 2 * shapes.turn_limited + 4 * shapes.extended_final
+
+    def collect_samples(self, conditions, shapes):
+        """ Flat [index, headwind, glide_slope, approach_speed, *metrics], infeasible samples dropped. """
+        feasible = shapes.feasible
+        return [condition[feasible] for condition in conditions] \
+            + [getattr(shapes, metric)[feasible] for metric in self.metrics]
+
+    def refine(self, lower, upper, lower_branches, refinements):
+        """ Bisects each pair of conditions, keeping the half that still straddles the branch switch. """
+        samples = []
+        for refinement in range(refinements):
+            middle = [lower[0]] + [(low + high) / 2 for low, high in zip(lower[1:], upper[1:])]
+            shapes = self.evaluate(*middle)
+            samples.append(self.collect_samples(middle, shapes))
+            same_branch = self.identify_branches(shapes) == lower_branches
+            lower = [np.where(same_branch, new, old) for new, old in zip(middle, lower)]
+            upper = [np.where(same_branch, old, new) for new, old in zip(middle, upper)]
+        return samples
+
+    def find_worst_cases(self, samples):
+        [index, headwind, glide_slope, approach_speed] = samples[:4]
+        self.worst_case = {}
+        self.critical_condition = {}
+        for metric, values in zip(self.metrics, samples[4:]):
+            order = np.lexsort((-values, index))
+            [airfields, first] = np.unique(index[order], return_index=True)
+            worst = order[first]
+            results = [np.full(self.airfields[0].size, np.nan) for column in range(4)]
+            for result, column in zip(results, [values, headwind, glide_slope, approach_speed]):
+                result[airfields] = column[worst]
+            self.worst_case[metric] = results[0].reshape(self.shape)[()]
+            self.critical_condition[metric] = {name: result.reshape(self.shape)[()] for name, result in zip(
+                ['headwind', 'glide_slope', 'approach_speed'], results[1:])}
+
+
+if __name__ == '__main__':
+    East_Bay = Shape(163, 3, 30, 2.54, 75, 13.4, 0)
+    print("Final leg is {0:1.0f} meters".format(East_Bay.final_length))
+    print("Straight climb distance is {0:1.0f} meters".format(East_Bay.initial_climb_length))
+    print("Pattern width is {0:1.0f} meters".format(East_Bay.pattern_diameter))
+    print("Downwind distance is {0:1.0f} meters".format(East_Bay.downwind_length))
+    print("Available distance needed before runway is {0:1.0f} meters.".format(East_Bay.before_runway_length))
+    print("Available distance needed after runway is {0:1.0f} meters.".format(East_Bay.after_runway_length))
@@ -1,28 +1,38 @@
+import collections
 import math
-import matplotlib.pyplot as plt
+import numpy as np
 
+import instrumentation
+from atmosphere import STANDARD_ATMOSPHERE
 
-class Phase:
-    """ Definitely a class
-    This class details the various phases associated with the mission. """
 
-    def __init__(self, name, final_speed, lift_over_drag, time, vertical_speed, speed_change, final_altitude):
-        """
-        name is a string naming the mission phase
-        final_speed in m/s
-        lift_over_drag no units
-        time in seconds
-        vertical_speed in m/s
-        speed_change in m/s
-        """
-        self.name = name
-        self.final_speed = final_speed
-        self.lift_over_drag = lift_over_drag
-        self.time = time
-        self.vertical_speed = vertical_speed
-        self.speed_change = speed_change
-        self.final_altitude = final_altitude
-        self.maximum_power = None
+def load_pyplot():
+    """ The sizing math never needs matplotlib, so pyplot is imported the first time a chart is drawn. """
+    import matplotlib.pyplot as plt
+    return plt
+
+
+PhaseDefinition = collections.namedtuple('PhaseDefinition', ['name', 'final_speed', 'lift_over_drag', 'time',
+                                                               'vertical_speed', 'speed_change', 'final_altitude'])
+
+
+class Phase(PhaseDefinition):
+    """ Definitely a class
+    This class details the various phases associated with the mission. The definition is an immutable tuple, so
+    phases hash and compare by what they describe and repeated legs collapse in a dictionary. maximum_power is the
+    one attribute filled in later, by PhasePower, and a class attribute until then, so phases made by _replace and
+    _make have it too.
+
+    name is a string naming the mission phase
+    final_speed in m/s
+    lift_over_drag no units
+    time in seconds
+    vertical_speed in m/s
+    speed_change in m/s
+    final_altitude in meters
+    """
+
+    maximum_power = None
 
     def add_maximum_power(self, power):
         self.maximum_power = power
@@ -32,18 +42,16 @@ class Phase:
                "".format(self.name, self.final_speed, self.lift_over_drag, self.time, self.vertical_speed,
                          self.speed_change, self.maximum_power)
 
-    #  This is so Mission.compile_unique_phases actually works
-    def __eq__(self, other):
-        return self.__dict__ == other.__dict__
-
 
 class Mission:
     """ Definitely a class
-    All the phases are combined into a mission. """
+    All the phases are combined into a mission. unique_phases holds the first of every distinct phase and
+    phase_counts how many times each one is flown. """
 
     def __init__(self, takeoff_mass_guess, payload, cruise_altitude, lowest_voltage_max_power_ratio=0.8):
         self.all_phases = []
         self.unique_phases = []
+        self.phase_counts = {}
         self.takeoff_mass_guess = takeoff_mass_guess
         self.payload = payload
         self.cruise_altitude = cruise_altitude
@@ -52,11 +60,17 @@ class Mission:
         self.maximum_power = None
 
     def add_all_phases(self, phases):
-        [self.all_phases.append(phase) for phase in phases]
-        self.compile_unique_phases()
-
-    def compile_unique_phases(self):  # Unsure how to not use a for loop here
-        [self.unique_phases.append(phase) for phase in self.all_phases if phase not in self.unique_phases]
+        phases = list(phases)
+        self.all_phases.extend(phases)
+        self.compile_unique_phases(phases)
+
+    def compile_unique_phases(self, phases):
+        for phase in phases:
+            if phase in self.phase_counts:
+                self.phase_counts[phase] += 1
+            else:
+                self.phase_counts[phase] = 1
+                self.unique_phases.append(phase)
 
     def add_maximum_power(self):
         power = []
@@ -102,6 +116,7 @@ class PhasePower:
     Calculate maximum power required for each phase. This seems like a large function lol, but whatever. We'll
     talk about next time we talk."""
 
+    @instrumentation.instrument('PhasePower')
     def __init__(self, mission):
         [self.calculate_power(phase, mission.takeoff_mass_guess) for phase in mission.unique_phases]
         mission.add_maximum_power()
@@ -141,17 +156,123 @@ class PhasePower:
             return max(final_speed, initial_speed)
 
 
+class MissionTable:
+    """ Definitely a class
+    Struct of arrays version of a mission with one row per distinct phase and count holding how often it is flown.
+    Every PhasePower term is proportional to mass, so the kinetic, potential and aerodynamic power per kilogram are
+    worked out once as arrays and the calculate_* methods return powers for any number of masses instead of storing
+    them on shared Phase objects. Tables of several missions are joined with concatenate, mission_index giving the
+    mission of every row, and the per mission results then have a trailing axis of length number_of_missions. A
+    mission without phases, from an empty table, needs no power and no energy. """
+
+    def __init__(self, final_speed, lift_over_drag, time, vertical_speed, speed_change, final_altitude, count=None,
+                 names=None, mission_index=None, number_of_missions=None):
+        """ Arrays in the units of Phase, one entry per phase. count defaults to 1 and mission_index to 0.
+        number_of_missions defaults to one more than the highest mission_index, or one for a table without
+        phases. """
+        self.final_speed = np.asarray(final_speed, dtype=float)
+        self.lift_over_drag = np.asarray(lift_over_drag, dtype=float)
+        self.time = np.asarray(time, dtype=float)
+        self.vertical_speed = np.asarray(vertical_speed, dtype=float)
+        self.speed_change = np.asarray(speed_change, dtype=float)
+        self.final_altitude = np.asarray(final_altitude, dtype=float)
+        self.count = np.ones(self.time.shape) if count is None else np.asarray(count, dtype=float)
+        self.names = list(names) if names is not None else [''] * len(self.time)
+        self.mission_index = np.zeros(self.time.shape, dtype=int) if mission_index is None \
+            else np.asarray(mission_index, dtype=int)
+        self.mission_starts = np.flatnonzero(np.diff(self.mission_index, prepend=-1))
+        if number_of_missions is None:
+            number_of_missions = int(self.mission_index.max()) + 1 if len(self.mission_index) else 1
+        self.number_of_missions = number_of_missions
+
+        initial_speed = self.final_speed - self.speed_change
+        self.specific_kinetic_power = (self.final_speed ** 2 - initial_speed ** 2) / 2 / self.time
+        self.specific_potential_power = 9.80665 * self.vertical_speed
+        self.specific_aerodynamic_power = 9.80665 * np.maximum(self.final_speed, initial_speed) / self.lift_over_drag
+        # Assuming that energy recovery is not an option
+        self.specific_power = np.maximum(self.specific_kinetic_power + self.specific_potential_power
+                                         + self.specific_aerodynamic_power, 0)
+
+    @classmethod
+    def from_mission(cls, mission):
+        phases = mission.unique_phases
+        return cls(*[[getattr(phase, field) for phase in phases] for field in
+                     ['final_speed', 'lift_over_drag', 'time', 'vertical_speed', 'speed_change', 'final_altitude']],
+                   count=[mission.phase_counts[phase] for phase in phases], names=[phase.name for phase in phases])
+
+    @classmethod
+    def concatenate(cls, tables):
+        columns = ['final_speed', 'lift_over_drag', 'time', 'vertical_speed', 'speed_change', 'final_altitude',
+                   'count']
+        mission_index = []
+        number_of_missions = 0
+        for table in tables:  # Counting the missions, not the rows, keeps a mission for every empty table
+            mission_index.append(table.mission_index + number_of_missions)
+            number_of_missions += table.number_of_missions
+        return cls(*[np.concatenate([getattr(table, column) for table in tables]) for column in columns],
+                   names=[name for table in tables for name in table.names],
+                   mission_index=np.concatenate(mission_index), number_of_missions=number_of_missions)
+
+    def expand_mass(self, mass, mass_per_mission):
+        """ Gives mass a trailing phase axis. With mass_per_mission the last axis of mass holds one mass per mission,
+        otherwise every phase of every mission is flown at the same mass. """
+        mass = np.asarray(mass, dtype=float)
+        return mass[..., self.mission_index] if mass_per_mission else mass[..., np.newaxis]
+
+    def calculate_kinetic_power(self, mass, mass_per_mission=False):
+        return self.expand_mass(mass, mass_per_mission) * self.specific_kinetic_power
+
+    def calculate_potential_power(self, mass, mass_per_mission=False):
+        return self.expand_mass(mass, mass_per_mission) * self.specific_potential_power
+
+    def calculate_aerodynamic_power(self, mass, mass_per_mission=False):
+        return self.expand_mass(mass, mass_per_mission) * self.specific_aerodynamic_power
+
+    def calculate_specific_power(self, lift_over_drag_scale=1):
+        """ Maximum power per kilogram of every phase with lift_over_drag multiplied by lift_over_drag_scale, which
+        may be an array, with the phases on the last axis. """
+        scale = np.asarray(lift_over_drag_scale, dtype=float)[..., np.newaxis]
+        return np.maximum(self.specific_kinetic_power + self.specific_potential_power
+                          + self.specific_aerodynamic_power / scale, 0)
+
+    def calculate_power(self, mass, mass_per_mission=False):
+        """ Maximum power of every phase in watts, with the phases on the last axis. """
+        return self.expand_mass(mass, mass_per_mission) * self.specific_power
+
+    def calculate_maximum_power(self, mass, mass_per_mission=False):
+        """ Peak power of each mission in watts. A single mission has no mission axis. """
+        power = self.reduce_missions(np.maximum, self.calculate_power(mass, mass_per_mission))
+        return power[..., 0] if self.number_of_missions == 1 else power
+
+    def calculate_energy(self, mass, mass_per_mission=False):
+        """ Energy of each mission in joules, the sum of power * time * count. """
+        energy = self.reduce_missions(np.add, self.calculate_power(mass, mass_per_mission) * self.time * self.count)
+        return energy[..., 0] if self.number_of_missions == 1 else energy
+
+    def reduce_missions(self, ufunc, values):
+        """ ufunc over the phases of each mission, with the phases on the last axis of values. reduceat has no
+        empty segments, so missions without phases are filled in with zero, which no power or energy is below. """
+        if len(self.mission_starts) == self.number_of_missions:
+            return ufunc.reduceat(values, self.mission_starts, axis=-1)
+        reduced = np.zeros(values.shape[:-1] + (self.number_of_missions,))
+        if len(self.mission_starts):
+            reduced[..., self.mission_index[self.mission_starts]] = ufunc.reduceat(values, self.mission_starts,
+                                                                                  axis=-1)
+        return reduced
+
+
 class BatteryPackMass:
     """ Not a class, per se, but could be depending on the interpretation of the single responsibility principle
     The aircraft battery is sized to execute the provided mission with appropriate power and capacity.
     Could this be inside of MassIteration? IDK, probably not."""
 
+    @instrumentation.instrument('BatteryPackMass')
     def __init__(self, motor, mission, battery):
         self.number_in_series = self.size_number_in_series(motor.input_voltage, battery.nominal_cell_voltage)
         self.number_in_parallel_power = None
         self.number_in_parallel_endurance = None
         self.number_in_parallel = self.size_number_in_parallel(battery, motor.whole_chain_efficiency,
-                                                               mission.all_phases, mission.maximum_power,
+                                                               mission.phase_counts, mission.maximum_power,
                                                                mission.lowest_voltage_maximum_power_ratio)
         self.number_of_cells = self.number_in_series * self.number_in_parallel
         self.battery_pack_mass = self.number_of_cells * battery.battery_cell_mass
@@ -159,15 +280,16 @@ class BatteryPackMass:
     def size_number_in_series(self, input_voltage, nominal_cell_voltage):
         return math.ceil(input_voltage / nominal_cell_voltage)
 
-    def size_number_in_parallel(self, battery, efficiency, all_phases, max_power, low_voltage_ratio):
+    def size_number_in_parallel(self, battery, efficiency, phase_counts, max_power, low_voltage_ratio):
         parallel_power = self.size_parallel_for_power(max_power, battery.nominal_cell_voltage, efficiency,
                                                       battery.c_max, battery.cell_capacity, low_voltage_ratio)
         parallel_endurance = self.size_parallel_for_endurance(battery.nominal_cell_voltage, battery.cell_capacity,
-                                                              efficiency, all_phases)
+                                                              efficiency, phase_counts)
         return math.ceil(max(parallel_power, parallel_endurance))
 
-    def size_parallel_for_endurance(self, cell_voltage, cell_capacity, efficiency, phases):
-        phase_energy = [specific_phase.maximum_power * specific_phase.time for specific_phase in phases]
+    def size_parallel_for_endurance(self, cell_voltage, cell_capacity, efficiency, phase_counts):
+        phase_energy = [specific_phase.maximum_power * specific_phase.time * count
+                        for specific_phase, count in phase_counts.items()]
         cell_energy_capacity = cell_voltage * cell_capacity * efficiency
         self.number_in_parallel_endurance = math.ceil(sum(phase_energy) / cell_energy_capacity)
         return math.ceil(sum(phase_energy) / cell_energy_capacity)
@@ -194,76 +316,117 @@ class SimilarPlane:
 
 class HistoricalTrend:
     """ Definitely a class
-    Calculate historical trend data in order to calculate required empty mass of aircraft to be designed. """
+    Calculate historical trend data in order to calculate required empty mass of aircraft to be designed.
+
+    Plane data is kept as arrays of regression terms [1, log takeoff mass, log empty mass, log takeoff mass ** 2,
+    log takeoff mass * log empty mass], so a fit is one weighted sum over those rows followed by the closed form
+    least squares solution. The fit over the whole database, or over a takeoff_mass_range, is cached until
+    add_similar_planes or add_plane_data changes the data. Weighted fits and fits over a boolean mask reuse the
+    same terms rather than going back to the planes. """
 
     def __init__(self):
         self.similar_planes = []
+        self.plane_weights = np.empty(0)
+        self.regression_terms = np.empty((0, 5))
+        self.cached_trends = {}
         self.trend_slope = None
         self.trend_y_intercept = None
         self.empty_mass_required = None
 
     def add_similar_planes(self, similar_planes):
         [self.similar_planes.append(plane) for plane in similar_planes]
+        self.add_plane_data([plane.takeoff_mass for plane in similar_planes],
+                            [plane.empty_mass for plane in similar_planes])
+
+    def add_plane_data(self, takeoff_masses, empty_masses, weights=None):
+        """ Array version of add_similar_planes for large fleet databases, masses in kilograms. No SimilarPlane
+        objects are made, so these planes only live in the arrays. weights default to 1 for every plane. """
+        log_takeoff_mass = np.log10(np.asarray(takeoff_masses, dtype=float))
+        log_empty_mass = np.log10(np.asarray(empty_masses, dtype=float))
+        terms = np.column_stack([np.ones_like(log_takeoff_mass), log_takeoff_mass, log_empty_mass,
+                                 log_takeoff_mass ** 2, log_takeoff_mass * log_empty_mass])
+        weights = np.ones_like(log_takeoff_mass) if weights is None else np.asarray(weights, dtype=float)
+        self.regression_terms = np.concatenate([self.regression_terms, terms])
+        self.plane_weights = np.concatenate([self.plane_weights, np.broadcast_to(weights, log_takeoff_mass.shape)])
+        self.cached_trends = {}
+        self.trend_slope = None
+        self.trend_y_intercept = None
 
-    def calculate_empty_mass_required(self, takeoff_mass_guess):
-        errors = self.populate_errors()
-        squared_errors = self.calculate_squared_errors(errors)
-        y_intercept_derivative = self.calculate_y_intercept_derivative(squared_errors)
-        slope_derivative = self.calculate_slope_derivative(squared_errors)
-        self.calculate_slope_and_y_intercept(y_intercept_derivative, slope_derivative)
-        self.empty_mass_required = 10 ** (math.log10(takeoff_mass_guess) * self.trend_slope + self.trend_y_intercept)
+    @instrumentation.instrument('HistoricalTrend.calculate_empty_mass_required')
+    def calculate_empty_mass_required(self, takeoff_mass_guess, weights=None, mask=None, takeoff_mass_range=None):
+        """ takeoff_mass_guess may be a scalar or an array, the fitting options are those of calculate_trend. """
+        [trend_slope, trend_y_intercept] = self.calculate_trend(weights, mask, takeoff_mass_range)
+        self.empty_mass_required = 10 ** (np.log10(takeoff_mass_guess) * trend_slope + trend_y_intercept)
         return self.empty_mass_required
 
-    def populate_errors(self):
-        errors = []
-        [errors.append([plane.log_empty_mass, -1, -1 * plane.log_takeoff_mass]) for plane in self.similar_planes]
-        return errors
-
-    def calculate_squared_errors(self, populated_errors):
-        not_summed = []
-        [not_summed.append([1, error[2] ** 2, 2 * error[1] * error[2], 2 * error[0] * error[1],
-                            2 * error[0] * error[2], error[0] ** 2]) for error in populated_errors]
-        squared_errors = []
-        for i in range(6):
-            summation = 0
-            for j in range(len(not_summed)):
-                summation += not_summed[j][i]
-            squared_errors.append(summation)
-        return squared_errors
-
-    def calculate_y_intercept_derivative(self, squared_errors):
-        return [2 * squared_errors[0], squared_errors[2], squared_errors[3]]
-
-    def calculate_slope_derivative(self, squared_errors):
-        return [squared_errors[2], 2 * squared_errors[1], squared_errors[4]]
-
-    def calculate_slope_and_y_intercept(self, y_intercept_derivative, slope_derivative):
-        a = [[y_intercept_derivative[0], y_intercept_derivative[1]], [slope_derivative[0], slope_derivative[1]]]
-        b = [[-1 * y_intercept_derivative[2]], [-1 * slope_derivative[2]]]
-        a_determinant = 1 / (a[0][0] * a[1][1] - a[0][1] * a[1][0])
-        a_inverse = [[a_determinant * a[1][1], -1 * a_determinant * a[0][1]],
-                     [-1 * a_determinant * a[1][0], a_determinant * a[0][0]]]
-        self.trend_y_intercept = a_inverse[0][0] * b[0][0] + a_inverse[0][1] * b[1][0]
-        self.trend_slope = a_inverse[1][0] * b[0][0] + a_inverse[1][1] * b[1][0]
+    @instrumentation.instrument('HistoricalTrend.calculate_trend')
+    def calculate_trend(self, weights=None, mask=None, takeoff_mass_range=None):
+        """ Least squares fit of log10(empty mass) against log10(takeoff mass), returned as [slope, y_intercept].
+
+        weights replaces the per plane weights, mask is a boolean array selecting planes and takeoff_mass_range is a
+        (lowest, highest) pair of takeoff masses in kilograms. The plain fit is also stored in self.trend_slope and
+        self.trend_y_intercept. """
+        cacheable = weights is None and mask is None
+        if takeoff_mass_range is not None:
+            takeoff_mass_range = tuple(takeoff_mass_range)
+        if cacheable and takeoff_mass_range in self.cached_trends:
+            return self.cached_trends[takeoff_mass_range]
+        weights = self.plane_weights if weights is None else np.broadcast_to(weights, self.plane_weights.shape)
+        selected = np.ones(self.plane_weights.shape, dtype=bool) if mask is None else np.asarray(mask, dtype=bool)
+        if takeoff_mass_range is not None:
+            log_takeoff_mass = self.regression_terms[:, 1]
+            selected = selected & (log_takeoff_mass >= math.log10(takeoff_mass_range[0])) \
+                & (log_takeoff_mass <= math.log10(takeoff_mass_range[1]))
+        [count, sum_x, sum_y, sum_xx, sum_xy] = weights[selected] @ self.regression_terms[selected]
+        determinant = count * sum_xx - sum_x ** 2
+        if determinant <= 0:
+            raise ValueError("the trend needs at least two planes with different takeoff masses")
+        trend_slope = (count * sum_xy - sum_x * sum_y) / determinant
+        trend = [trend_slope, (sum_y - trend_slope * sum_x) / count]
+        if cacheable:
+            self.cached_trends[takeoff_mass_range] = trend
+            if takeoff_mass_range is None:
+                [self.trend_slope, self.trend_y_intercept] = trend
+        return trend
 
 
 class MassIteration:
     """ Probably shouldn't be its own class
     This class refines the takeoff mass guess for the mission to a point where the
-    available and required empty masses are within half a percent of one another."""
-
-    def __init__(self, motor, mission, battery, historical_trend, acceptable_error=0.005):
+    available and required empty masses are within half a percent of one another.
+
+    method='fixed_point' is the original update, which keeps the phase powers found at the initial guess and stops
+    as soon as the error drops below acceptable_error. method='coupled' re-runs PhasePower and BatteryPackMass at
+    every takeoff mass and drives the two sided error to zero with a safeguarded secant method: secant steps are kept
+    while they stay inside the bracket around the root and fall back to bisection otherwise. Cell counts jump with
+    math.ceil, so if the bracket collapses onto one of those steps without meeting acceptable_error the heavier, still
+    feasible, side is kept and converged is False. iterations, residual_history and converged report how it went. """
+
+    @instrumentation.instrument('MassIteration')
+    def __init__(self, motor, mission, battery, historical_trend, acceptable_error=0.005, method='fixed_point',
+                 maximum_iterations=100):
         self.iterated_empty_mass = None
         self.iterated_takeoff_mass = None
         self.acceptable_error = acceptable_error
-        self.iterate_empty_mass_available(motor, mission, battery, historical_trend)
+        self.maximum_iterations = maximum_iterations
+        self.iterations = 0
+        self.residual_history = []
+        self.converged = False
+        if method == 'fixed_point':
+            self.iterate_empty_mass_available(motor, mission, battery, historical_trend)
+        elif method == 'coupled':
+            self.solve_coupled_empty_mass(motor, mission, battery, historical_trend)
+        else:
+            raise ValueError("method must be 'fixed_point' or 'coupled'")
+        instrumentation.record('MassIteration.iterations', self.iterations)
 
     def iterate_empty_mass_available(self, motor, mission, battery, historical_trend):
         empty_mass_required = historical_trend.calculate_empty_mass_required(mission.takeoff_mass_guess)
         empty_mass_available = mission.takeoff_mass_guess - mission.payload \
                                - BatteryPackMass(motor, mission, battery).battery_pack_mass
         error = (empty_mass_available - empty_mass_required) / empty_mass_required
-        while error > self.acceptable_error:
+        self.residual_history.append(error)
+        while error > self.acceptable_error and self.iterations < self.maximum_iterations:
             if empty_mass_required > empty_mass_available:
                 mission.takeoff_mass_guess += empty_mass_required - empty_mass_available
             else:
@@ -272,23 +435,194 @@ class MassIteration:
             empty_mass_available = mission.takeoff_mass_guess - mission.payload \
                                    - BatteryPackMass(motor, mission, battery).battery_pack_mass
             error = (empty_mass_available - empty_mass_required) / empty_mass_required
+            self.iterations += 1
+            self.residual_history.append(error)
+        self.converged = abs(error) <= self.acceptable_error
         self.iterated_empty_mass = empty_mass_available
         self.iterated_takeoff_mass = mission.takeoff_mass_guess
 
+    def solve_coupled_empty_mass(self, motor, mission, battery, historical_trend):
+        takeoff_mass = mission.takeoff_mass_guess
+        [error, empty_mass_required, empty_mass_available] = self.calculate_coupled_error(
+            motor, mission, battery, historical_trend, takeoff_mass)
+        self.residual_history.append(error)
+        light = None  # [takeoff_mass, error] with too little empty mass available
+        heavy = None  # [takeoff_mass, error] with more empty mass available than required
+        previous = None
+        while abs(error) > self.acceptable_error and self.iterations < self.maximum_iterations:
+            if error < 0:
+                light = [takeoff_mass, error]
+            else:
+                heavy = [takeoff_mass, error, empty_mass_available]
+            if light is not None and heavy is not None and heavy[0] - light[0] <= 1e-9 * heavy[0]:
+                break  # the root sits on a cell count step
+            if previous is not None and error != previous[1]:
+                step = -error * (takeoff_mass - previous[0]) / (error - previous[1])  # secant
+            else:
+                step = empty_mass_required - empty_mass_available  # fixed point update for the first step
+            proposal = takeoff_mass + step
+            if light is not None and heavy is not None:
+                if not light[0] < proposal < heavy[0]:
+                    proposal = (light[0] + heavy[0]) / 2
+            elif proposal <= 0:
+                proposal = takeoff_mass / 2
+            previous = [takeoff_mass, error]
+            takeoff_mass = proposal
+            [error, empty_mass_required, empty_mass_available] = self.calculate_coupled_error(
+                motor, mission, battery, historical_trend, takeoff_mass)
+            self.iterations += 1
+            self.residual_history.append(error)
+        self.converged = abs(error) <= self.acceptable_error
+        if not self.converged and error < 0 and heavy is not None:
+            takeoff_mass = heavy[0]
+            [error, empty_mass_required, empty_mass_available] = self.calculate_coupled_error(
+                motor, mission, battery, historical_trend, takeoff_mass)
+        self.iterated_empty_mass = empty_mass_available
+        self.iterated_takeoff_mass = takeoff_mass
+
+    def calculate_coupled_error(self, motor, mission, battery, historical_trend, takeoff_mass):
+        """ Two sided relative error between available and required empty mass, with phase powers and the battery
+        pack sized at takeoff_mass. Leaves the mission's guess and phase powers at takeoff_mass. """
+        mission.takeoff_mass_guess = takeoff_mass
+        PhasePower(mission)
+        empty_mass_required = historical_trend.calculate_empty_mass_required(takeoff_mass)
+        empty_mass_available = takeoff_mass - mission.payload \
+            - BatteryPackMass(motor, mission, battery).battery_pack_mass
+        return [(empty_mass_available - empty_mass_required) / empty_mass_required, empty_mass_required,
+                empty_mass_available]
+
+
+class BatchMassIteration:
+    """ MassIteration for a whole batch of aircraft at once
+    payload and takeoff_mass_guess default to the mission's values and may be arrays, and the attributes of motor and
+    battery may be arrays too, e.g. Battery(np.array([3.7, 3.6]), ...). Everything broadcasts to one batch shape and
+    every result attribute has that shape. Phase powers are those PhasePower gives at each takeoff mass guess, unless
+    couple_phase_power is True, in which case they are rescaled to the current takeoff mass on every pass. The trend
+    is fitted once, and entries whose error is within acceptable_error on either side drop out of the update.
+
+    lift_over_drag_scale multiplies the lift_over_drag of every phase and empty_mass_residual is added to the trend's
+    log10 empty mass, so uncertain aerodynamics and scatter about the trend can be given per entry as well. Entries
+    whose takeoff mass stops being positive and finite drop out with converged False. """
+
+    @instrumentation.instrument('BatchMassIteration')
+    def __init__(self, motor, mission, battery, historical_trend, payload=None, takeoff_mass_guess=None,
+                 acceptable_error=0.005, couple_phase_power=False, maximum_iterations=1000, lift_over_drag_scale=1,
+                 empty_mass_residual=0):
+        self.acceptable_error = acceptable_error
+        self.couple_phase_power = couple_phase_power
+        self.maximum_iterations = maximum_iterations
+        self.iterated_empty_mass = None
+        self.iterated_takeoff_mass = None
+        self.battery_pack_mass = None
+        self.number_in_series = None
+        self.number_in_parallel = None
+        self.number_of_cells = None
+        self.converged = None
+        self.iterations = None
+        self.iterate_empty_mass_available(motor, mission, battery, historical_trend,
+                                          mission.payload if payload is None else payload,
+                                          mission.takeoff_mass_guess if takeoff_mass_guess is None
+                                          else takeoff_mass_guess, lift_over_drag_scale, empty_mass_residual)
+
+    def iterate_empty_mass_available(self, motor, mission, battery, historical_trend, payload, takeoff_mass_guess,
+                                     lift_over_drag_scale=1, empty_mass_residual=0):
+        [trend_slope, trend_y_intercept] = historical_trend.calculate_trend()
+        mission_table = MissionTable.from_mission(mission)
+        arrays = np.broadcast_arrays(*[np.asarray(value, dtype=float) for value in [
+            payload, takeoff_mass_guess, motor.input_voltage, motor.whole_chain_efficiency,
+            battery.nominal_cell_voltage, battery.c_max, battery.cell_capacity, battery.battery_cell_mass,
+            lift_over_drag_scale, empty_mass_residual]])
+        shape = arrays[0].shape
+        [payload, takeoff_mass, input_voltage, efficiency, cell_voltage, c_max, cell_capacity, cell_mass,
+         lift_over_drag_scale, empty_mass_residual] = [array.ravel().copy() for array in arrays]
+        if np.any(lift_over_drag_scale != lift_over_drag_scale[:1]):  # One power table per entry
+            specific_power = mission_table.calculate_specific_power(lift_over_drag_scale)
+            specific_maximum_power = specific_power.max(axis=-1)
+            specific_energy = specific_power @ (mission_table.time * mission_table.count)
+        else:
+            specific_power = mission_table.calculate_specific_power(lift_over_drag_scale[:1])
+            specific_maximum_power = np.broadcast_to(specific_power.max(axis=-1), takeoff_mass.shape)
+            specific_energy = np.broadcast_to(specific_power @ (mission_table.time * mission_table.count),
+                                              takeoff_mass.shape)
+
+        number_in_series = np.ceil(input_voltage / cell_voltage)
+        power_per_parallel_string = c_max * cell_capacity * efficiency * number_in_series * cell_voltage \
+            * mission.lowest_voltage_maximum_power_ratio
+        energy_per_parallel_string = cell_voltage * cell_capacity * efficiency
+        sizing_mass = takeoff_mass.copy()
+        number_in_parallel = self.size_number_in_parallel(sizing_mass, specific_maximum_power, specific_energy,
+                                                          power_per_parallel_string, energy_per_parallel_string)
+        iterations = np.zeros(takeoff_mass.shape, dtype=int)
+        active = np.ones(takeoff_mass.shape, dtype=bool)
+        converged = np.zeros(takeoff_mass.shape, dtype=bool)
+        for iteration in range(self.maximum_iterations + 1):
+            index = np.flatnonzero(active)
+            if self.couple_phase_power:
+                number_in_parallel[index] = self.size_number_in_parallel(
+                    takeoff_mass[index], specific_maximum_power[index], specific_energy[index],
+                    power_per_parallel_string[index], energy_per_parallel_string[index])
+            with np.errstate(invalid='ignore', divide='ignore'):
+                empty_mass_required = 10 ** (np.log10(takeoff_mass[index]) * trend_slope + trend_y_intercept
+                                             + empty_mass_residual[index])
+            empty_mass_available = takeoff_mass[index] - payload[index] \
+                - number_in_series[index] * number_in_parallel[index] * cell_mass[index]
+            error = (empty_mass_available - empty_mass_required) / empty_mass_required
+            within_error = np.abs(error) <= self.acceptable_error
+            converged[index[within_error]] = True
+            still_active = ~within_error & np.isfinite(error) & (takeoff_mass[index] > 0)
+            active[index[~still_active]] = False
+            if not still_active.any() or iteration == self.maximum_iterations:
+                break
+            index = index[still_active]
+            takeoff_mass[index] += (empty_mass_required - empty_mass_available)[still_active]
+            iterations[index] += 1
+
+        number_of_cells = number_in_series * number_in_parallel
+        battery_pack_mass = number_of_cells * cell_mass
+        self.iterated_takeoff_mass = takeoff_mass.reshape(shape)
+        self.iterated_empty_mass = (takeoff_mass - payload - battery_pack_mass).reshape(shape)
+        self.battery_pack_mass = battery_pack_mass.reshape(shape)
+        self.number_in_series = number_in_series.astype(int).reshape(shape)
+        self.number_in_parallel = number_in_parallel.astype(int).reshape(shape)
+        self.number_of_cells = number_of_cells.astype(int).reshape(shape)
+        self.converged = converged.reshape(shape)
+        self.iterations = iterations.reshape(shape)
+        instrumentation.record('BatchMassIteration.iterations', int(iterations.max(initial=0)))
+
+    def size_number_in_parallel(self, mass, specific_maximum_power, specific_energy, power_per_parallel_string,
+                                energy_per_parallel_string):
+        parallel_power = np.ceil(mass * specific_maximum_power / power_per_parallel_string)
+        parallel_endurance = np.ceil(mass * specific_energy / energy_per_parallel_string)
+        return np.maximum(parallel_power, parallel_endurance)
+
 
 class Matching:
     """A class to size the wing and propulsion device based on various aircraft requirements. Each sizing function is
      represented by a nested list where each list's first value is a coefficient and the second value is the power of
-     the dependent variable (W/S). The matching chart is W/P vs W/S. """
+     the dependent variable (W/S). The matching chart is W/P vs W/S.
 
-    def __init__(self, takeoff_mass, max_wing_loading=10000, max_power_loading=0.3):
+     The size_to_* and calculate_*_power_loading methods accept scalars or NumPy arrays for their parameters. Arrays
+     of parameter variants (several CL values or aspect ratios, say) broadcast against each other and every power
+     loading curve gets a trailing wing loading axis, so one call returns a whole family of curves. """
+
+    # Skin friction coefficients of Roskam's parasite area chart and the log10 offsets of their lines
+    skin_friction_coefficients = np.array([0.002, 0.003, 0.004, 0.005, 0.006, 0.007, 0.008, 0.009])
+    skin_friction_log_offsets = np.array([-2.6990, -2.5229, -2.3979, -2.3010, -2.2218, -2.1549, -2.0969, -2.0458])
+
+    def __init__(self, takeoff_mass, max_wing_loading=10000, max_power_loading=0.3, atmosphere=None,
+                 drag_polar_cache_size=1024):
+        """ atmosphere is an atmosphere.Atmosphere, the standard day unless a non-standard one is given. """
         self.wing_loading = None
         self.power_loading = None
         self.max_wing_loading = max_wing_loading
         self.max_power_loading = max_power_loading
         self.mass = takeoff_mass
+        self.atmosphere = atmosphere if atmosphere is not None else STANDARD_ATMOSPHERE
+        self.drag_polar_cache_size = drag_polar_cache_size
+        self.drag_polar_cache = collections.OrderedDict()
 
     def create_matching_chart(self):
+        plt = load_pyplot()
         plt.figure(1)
         plt.title('Matching Chart')
         plt.xlabel('Wing Loading (Pascals)')
@@ -297,117 +631,362 @@ class Matching:
         plt.ylim(0, self.max_power_loading)  # 35 lbf/hp is the equivalent of around 0.2 Newtons per Watt
 
     def plot_matching_chart(self):
+        plt = load_pyplot()
         plt.legend(loc=1)
         plt.show()
 
     def plot_stall_speed(self, name, altitude, max_clean_cl, stall_speed, pattern='-'):
+        plt = load_pyplot()
         plt.vlines(self.size_to_stall(altitude, max_clean_cl, stall_speed),
                    0, self.max_power_loading, label='{}'.format(name), color='red', linestyles='{}'.format(pattern))
 
     def plot_takeoff_distance(self, name, takeoff_field_length, altitude, max_takeoff_cl, pattern='-'):
-        wing_loading = list(range(1, self.max_wing_loading + 1))
-        power_loading = [self.size_to_takeoff(takeoff_field_length, altitude, max_takeoff_cl)[0][0]
-                         * x ** self.size_to_takeoff(takeoff_field_length, altitude, max_takeoff_cl)[0][1]
-                         for x in wing_loading]
-        plt.plot(wing_loading, power_loading, label='{}'.format(name), color='blue', ls='{}'.format(pattern))
+        plt = load_pyplot()
+        wing_loading = self.create_wing_loading_grid()
+        power_loading = self.calculate_takeoff_power_loading(wing_loading, takeoff_field_length, altitude,
+                                                             max_takeoff_cl)
+        plt.plot(wing_loading, power_loading.T, label='{}'.format(name), color='blue', ls='{}'.format(pattern))
 
     def plot_landing_distance(self, name, altitude, landing_field_length, max_landing_cl, pattern='-'):
+        plt = load_pyplot()
         plt.vlines(self.size_to_landing(altitude, landing_field_length, max_landing_cl),
                    0, self.max_power_loading, label='{}'.format(name), color='purple', linestyles='{}'.format(pattern))
 
     def plot_climbing_requirements(self, name, mass, altitude, speed, aspect_ratio, rate_of_climb,
                                    propeller_efficiency=0.85, gear_down=False,
                                    oswald_efficiency_factor=0.85, cl=1.5, pattern='-'):
+        plt = load_pyplot()
         [wing_loading, power_loading] = self.size_to_climb(
             mass, altitude, speed, aspect_ratio, gear_down, oswald_efficiency_factor, cl,
             rate_of_climb, propeller_efficiency)
-        plt.plot(wing_loading, power_loading, label='{}'.format(name), color='green', ls='{}'.format(pattern))
+        plt.plot(wing_loading, power_loading.T, label='{}'.format(name), color='green', ls='{}'.format(pattern))
 
     def plot_cruise_speed_requirements(self, name, speed, altitude, cruise_lift_coefficient, mass, aspect_ratio,
                                        oswald_efficiency_factor=0.85, propeller_efficiency=0.85,
                                        gear_down=True, pattern='-'):
+        plt = load_pyplot()
         [wing_loading, power_loading] = self.size_to_cruise(speed, altitude, cruise_lift_coefficient, mass,
                                                             aspect_ratio, oswald_efficiency_factor,
                                                             propeller_efficiency, gear_down)
-        plt.plot(wing_loading, power_loading, label='{}'.format(name), color='orange', ls='{}'.format(pattern))
+        plt.plot(wing_loading, power_loading.T, label='{}'.format(name), color='orange', ls='{}'.format(pattern))
+
+    def create_wing_loading_grid(self, number_of_points=None):
+        """ Wing loading grid in Pascals shared by every constraint curve. The default is the 1 Pa spacing the plots
+        have always used, number_of_points gives an evenly spaced grid over the same span instead. """
+        if number_of_points is None:
+            return np.arange(1, self.max_wing_loading + 1, dtype=float)
+        return np.linspace(1, self.max_wing_loading, number_of_points)
+
+    def add_grid_axis(self, value):
+        """ Parameter variants keep their own shape and gain a trailing axis that broadcasts against the grid. """
+        return np.asarray(value, dtype=float)[..., np.newaxis]
+
+    def calculate_constraints(self, stall=None, takeoff=None, landing=None, climb=None, cruise=None,
+                              wing_loading=None):
+        """ Evaluate every requested constraint without plotting anything.
+
+        Each constraint is a dictionary of keyword arguments for size_to_stall, calculate_takeoff_power_loading,
+        size_to_landing, calculate_climb_power_loading or calculate_cruise_power_loading, leaving out wing_loading.
+        Returns a dictionary holding the shared wing loading grid and, for each requested constraint, either the
+        limiting wing loading (stall and landing) or the power loading curve over the grid (takeoff, climb, cruise). """
+        if wing_loading is None:
+            wing_loading = self.create_wing_loading_grid()
+        constraints = {'wing_loading': wing_loading}
+        if stall is not None:
+            constraints['stall'] = np.asarray(self.size_to_stall(**stall), dtype=float)
+        if landing is not None:
+            constraints['landing'] = np.asarray(self.size_to_landing(**landing), dtype=float)
+        if takeoff is not None:
+            constraints['takeoff'] = self.calculate_takeoff_power_loading(wing_loading, **takeoff)
+        if climb is not None:
+            constraints['climb'] = self.calculate_climb_power_loading(wing_loading, **climb)
+        if cruise is not None:
+            constraints['cruise'] = self.calculate_cruise_power_loading(wing_loading, **cruise)
+        return constraints
+
+    @instrumentation.instrument('Matching.solve_design_point')
+    def solve_design_point(self, stall=None, takeoff=None, landing=None, climb=None, cruise=None):
+        """ Find the feasible region of the matching chart and its design point without sampling the chart.
+
+        Constraints are dictionaries of scalar keyword arguments as in calculate_constraints, or lists of them when
+        several requirements of one kind must all be met. Stall and landing bound the wing loading, takeoff
+        (k / x) and climb (a / (b + c * x ** 0.5)) bound the power loading from above and fall with wing loading,
+        while cruise (s * x) rises with it. max_power_loading caps them all as one more falling curve, a flat one.
+        The design point is the corner where the lowest cruise line meets the lowest of the falling curves, or the
+        wing loading limit if that comes first. Crossings between takeoff and climb curves are closed form, cruise
+        against climb is a cubic in x ** 0.5 solved by Newton's method. The result is stored in self.wing_loading
+        and self.power_loading and returned as a DesignPoint. """
+        wing_loading_limits = [(name, self.size_to_stall(**spec))
+                               for name, spec in self.name_constraints('stall', stall)]
+        wing_loading_limits += [(name, self.size_to_landing(**spec))
+                                for name, spec in self.name_constraints('landing', landing)]
+        if wing_loading_limits:
+            [limiting_constraint, maximum_wing_loading] = min(wing_loading_limits, key=lambda limit: limit[1])
+        else:
+            [limiting_constraint, maximum_wing_loading] = ['max_wing_loading', self.max_wing_loading]
+        maximum_wing_loading = float(maximum_wing_loading)
+
+        falling = [(name, 'takeoff', [float(self.size_to_takeoff(**spec)[0][0])])
+                   for name, spec in self.name_constraints('takeoff', takeoff)]
+        falling += [(name, 'climb', [float(value) for value in self.size_to_climb_coefficients(**spec)])
+                    for name, spec in self.name_constraints('climb', climb)]
+        falling.append(('max_power_loading', 'cap', [float(self.max_power_loading)]))
+        rising = [(name, float(self.size_to_cruise_slope(**spec)[0][0]))
+                  for name, spec in self.name_constraints('cruise', cruise)]
+
+        if rising:
+            [cruise_name, cruise_slope] = min(rising, key=lambda line: line[1])
+            crossings = [self.intersect_with_cruise(kind, coefficients, cruise_slope)
+                         for name, kind, coefficients in falling]
+            cruise_crossing = min(crossings, default=math.inf)
+        else:
+            cruise_crossing = 0.0
+
+        boundary = []
+        if rising:
+            boundary.append((0.0, min(cruise_crossing, maximum_wing_loading), cruise_name))
+        if cruise_crossing < maximum_wing_loading:
+            boundary += self.trace_falling_envelope(falling, cruise_crossing, maximum_wing_loading)
+
+        design_wing_loading = min(cruise_crossing, maximum_wing_loading) if rising else maximum_wing_loading
+        candidates = [(name, self.evaluate_falling_constraint(kind, coefficients, design_wing_loading))
+                      for name, kind, coefficients in falling]
+        candidates += [(name, slope * design_wing_loading) for name, slope in rising]
+        design_power_loading = min(value for name, value in candidates) if candidates else math.inf
+        active_constraints = [name for name, value in candidates
+                              if math.isclose(value, design_power_loading, rel_tol=1e-9)]
+        if design_wing_loading >= maximum_wing_loading:
+            active_constraints.append(limiting_constraint)
+
+        self.wing_loading = design_wing_loading
+        self.power_loading = design_power_loading
+        return DesignPoint(design_wing_loading, design_power_loading, active_constraints, boundary,
+                           maximum_wing_loading)
+
+    def name_constraints(self, kind, specs):
+        """ Pairs every constraint dictionary with a name, indexed when a list of them was given. """
+        if specs is None:
+            return []
+        if isinstance(specs, dict):
+            return [(kind, specs)]
+        return [('{}[{}]'.format(kind, index), spec) for index, spec in enumerate(specs)]
+
+    def evaluate_falling_constraint(self, kind, coefficients, wing_loading):
+        if kind == 'cap':
+            return coefficients[0]
+        if kind == 'takeoff':
+            return coefficients[0] / wing_loading if wing_loading > 0 else math.inf
+        [numerator, offset, root_factor] = coefficients
+        return numerator / (offset + root_factor * wing_loading ** (1 / 2))
+
+    def intersect_with_cruise(self, kind, coefficients, cruise_slope):
+        """ Wing loading where a takeoff or climb curve or the cap meets the cruise line s * x. """
+        if kind == 'cap':
+            return coefficients[0] / cruise_slope
+        if kind == 'takeoff':
+            return (coefficients[0] / cruise_slope) ** (1 / 2)
+        # a / (b + c * t) = s * t ** 2 with t = x ** 0.5 gives s * c * t ** 3 + s * b * t ** 2 - a = 0, which is
+        # increasing and convex for t > 0, so Newton's method started above the root converges without overshoot.
+        [numerator, offset, root_factor] = coefficients
+        root = max((numerator / (cruise_slope * root_factor)) ** (1 / 3) if root_factor > 0 else 0,
+                   (numerator / (cruise_slope * offset)) ** (1 / 2) if offset > 0 else 0)
+        for _ in range(100):
+            residual = cruise_slope * (root_factor * root ** 3 + offset * root ** 2) - numerator
+            step = residual / (cruise_slope * (3 * root_factor * root ** 2 + 2 * offset * root))
+            root -= step
+            if abs(step) <= 1e-12 * root:
+                break
+        return root ** 2
+
+    def intersect_falling_constraints(self, first, second):
+        """ Wing loadings where two takeoff or climb curves or the cap cross, from the closed forms in
+        t = x ** 0.5. """
+        [[first_kind, first_coefficients], [second_kind, second_coefficients]] = sorted(
+            [first, second], key=lambda constraint: ['cap', 'takeoff', 'climb'].index(constraint[0]))
+        if first_kind == 'cap':
+            cap = first_coefficients[0]
+            if second_kind == 'cap':
+                return []
+            if second_kind == 'takeoff':
+                return [second_coefficients[0] / cap]  # k / x = cap
+            # a / (b + c * t) = cap is linear in t
+            [numerator, offset, root_factor] = second_coefficients
+            root = (numerator / cap - offset) / root_factor if root_factor != 0 else 0
+            return [root ** 2] if root > 0 else []
+        if first_kind == 'takeoff' and second_kind == 'takeoff':
+            return []  # k1 / x and k2 / x never cross
+        if first_kind == 'takeoff':
+            # k / t ** 2 = a / (b + c * t) gives a * t ** 2 - k * c * t - k * b = 0 with one positive root
+            takeoff_coefficient = first_coefficients[0]
+            [numerator, offset, root_factor] = second_coefficients
+            root = (takeoff_coefficient * root_factor + (
+                (takeoff_coefficient * root_factor) ** 2 + 4 * numerator * takeoff_coefficient * offset) ** (1 / 2)) \
+                / (2 * numerator)
+            return [root ** 2]
+        # a1 / (b1 + c1 * t) = a2 / (b2 + c2 * t) is linear in t
+        [numerator_1, offset_1, root_factor_1] = first_coefficients
+        [numerator_2, offset_2, root_factor_2] = second_coefficients
+        denominator = numerator_1 * root_factor_2 - numerator_2 * root_factor_1
+        if denominator == 0:
+            return []
+        root = (numerator_2 * offset_1 - numerator_1 * offset_2) / denominator
+        return [root ** 2] if root > 0 else []
+
+    def trace_falling_envelope(self, falling, start, end):
+        """ Splits [start, end] at the crossings of the takeoff and climb curves and names the lowest curve on each
+        piece, merging neighbouring pieces held by the same constraint. """
+        breakpoints = [start, end]
+        for index, (first_name, first_kind, first_coefficients) in enumerate(falling):
+            for second_name, second_kind, second_coefficients in falling[index + 1:]:
+                breakpoints += [crossing for crossing in self.intersect_falling_constraints(
+                    [first_kind, first_coefficients], [second_kind, second_coefficients]) if start < crossing < end]
+        breakpoints = sorted(set(breakpoints))
+        boundary = []
+        for left, right in zip(breakpoints[:-1], breakpoints[1:]):
+            middle = (left + right) / 2
+            name = min(falling, key=lambda constraint: self.evaluate_falling_constraint(
+                constraint[1], constraint[2], middle))[0]
+            if boundary and boundary[-1][2] == name:
+                boundary[-1] = (boundary[-1][0], right, name)
+            else:
+                boundary.append((left, right, name))
+        return boundary
 
+    @instrumentation.instrument('Matching.size_to_stall')
     def size_to_stall(self, altitude, max_clean_cl, stall_speed):
         density = self.convert_altitude_to_density(altitude)
         return stall_speed ** 2 * density * max_clean_cl / 2
 
     def convert_altitude_to_density(self, altitude):
         """ Altitude in meters, density in kilograms per cubic meter. """
-        return 0.000000002490 * altitude ** 2 - 0.000105332443 * altitude + 1.211228027786
+        return self.atmosphere.calculate_density(altitude)
 
+    @instrumentation.instrument('Matching.size_to_takeoff')
     def size_to_takeoff(self, takeoff_field_length, altitude, max_takeoff_cl):
         """ takeoff_distance in meters. takeoff_distance is from stand still to 50 ft altitude. """
         takeoff_parameter = self.calculate_takeoff_parameter(takeoff_field_length)
-        density_ratio = self.convert_altitude_to_density(altitude) / self.convert_altitude_to_density(0)
+        density_ratio = self.atmosphere.calculate_density_ratio(altitude)
         return [[takeoff_parameter * density_ratio * max_takeoff_cl, -1]]
 
+    def calculate_takeoff_power_loading(self, wing_loading, takeoff_field_length, altitude, max_takeoff_cl):
+        [[coefficient, power]] = self.size_to_takeoff(takeoff_field_length, altitude, max_takeoff_cl)
+        return self.add_grid_axis(coefficient) * np.asarray(wing_loading, dtype=float) ** power
+
     def calculate_takeoff_parameter(self, takeoff_distance):
         a = 0.055822  # Roskam values converted to metric units (FAR 23 propeller aircraft)
         b = 8.680402  # Roskam values converted to metric units (FAR 23 propeller aircraft)
         c = -1 * takeoff_distance
         takeoff_parameter_1 = -b + (b ** 2 - 4 * a * c) ** 0.5 / (2 * a)
         takeoff_parameter_2 = -b - (b ** 2 - 4 * a * c) ** 0.5 / (2 * a)
-        if takeoff_parameter_1 > takeoff_parameter_2:
-            return takeoff_parameter_1
-        else:
-            return takeoff_parameter_2
+        return np.maximum(takeoff_parameter_1, takeoff_parameter_2)
 
+    @instrumentation.instrument('Matching.size_to_landing')
     def size_to_landing(self, altitude, landing_field_length, max_landing_cl):
-        stall_speed = math.sqrt(landing_field_length / 0.591477)
+        stall_speed = np.sqrt(landing_field_length / 0.591477)
         return self.size_to_stall(altitude, max_landing_cl, stall_speed)
 
     def size_to_cruise(self, speed, altitude, cruise_lift_coefficient, mass, aspect_ratio, oswald_efficiency_factor,
                        propeller_efficiency, gear_down):
-        wing_loading = list(range(1, self.max_wing_loading + 1))
+        wing_loading = self.create_wing_loading_grid()
+        power_loading = self.calculate_cruise_power_loading(wing_loading, speed, altitude, cruise_lift_coefficient,
+                                                            mass, aspect_ratio, oswald_efficiency_factor,
+                                                            propeller_efficiency, gear_down)
+        return wing_loading, power_loading
+
+    def calculate_cruise_power_loading(self, wing_loading, speed, altitude, cruise_lift_coefficient, mass,
+                                       aspect_ratio, oswald_efficiency_factor=0.85, propeller_efficiency=0.85,
+                                       gear_down=True):
+        [[slope, power]] = self.size_to_cruise_slope(speed, altitude, cruise_lift_coefficient, mass, aspect_ratio,
+                                                     oswald_efficiency_factor, propeller_efficiency, gear_down)
+        return self.add_grid_axis(slope) * np.asarray(wing_loading, dtype=float) ** power
+
+    @instrumentation.instrument('Matching.size_to_cruise_slope')
+    def size_to_cruise_slope(self, speed, altitude, cruise_lift_coefficient, mass, aspect_ratio,
+                             oswald_efficiency_factor=0.85, propeller_efficiency=0.85, gear_down=True):
+        """ Cruise power loading grows linearly with wing loading, so it is a single [[coefficient, 1]] term. """
         density = self.convert_altitude_to_density(altitude)
         [zero_lift_drag_coefficient, induced_drag_factor] = self.estimate_drag_polar(
             mass, altitude, speed, aspect_ratio, gear_down, oswald_efficiency_factor, cruise_lift_coefficient)
         cruise_drag_coefficient = zero_lift_drag_coefficient + induced_drag_factor * cruise_lift_coefficient ** 2
-        power_loading = [((2 * propeller_efficiency) / (speed ** 3 * density * cruise_drag_coefficient)) * x
-                         for x in wing_loading]
-        return wing_loading, power_loading
+        return [[(2 * propeller_efficiency) / (speed ** 3 * density * cruise_drag_coefficient), 1]]
 
     def size_to_climb(self, mass, altitude, speed, aspect_ratio, gear_down, oswald_efficiency_factor, cl,
                       rate_of_climb, propeller_efficiency):
-        wing_loading = list(range(1, self.max_wing_loading + 1))
+        wing_loading = self.create_wing_loading_grid()
+        power_loading = self.calculate_climb_power_loading(wing_loading, mass, altitude, speed, aspect_ratio,
+                                                           rate_of_climb, propeller_efficiency, gear_down,
+                                                           oswald_efficiency_factor, cl)
+        return wing_loading, power_loading
+
+    def calculate_climb_power_loading(self, wing_loading, mass, altitude, speed, aspect_ratio, rate_of_climb,
+                                      propeller_efficiency=0.85, gear_down=False, oswald_efficiency_factor=0.85,
+                                      cl=1.5):
+        [numerator, offset, root_factor] = self.size_to_climb_coefficients(
+            mass, altitude, speed, aspect_ratio, rate_of_climb, propeller_efficiency, gear_down,
+            oswald_efficiency_factor, cl)
+        return self.add_grid_axis(numerator) / (self.add_grid_axis(offset) + self.add_grid_axis(root_factor)
+                                                * np.asarray(wing_loading, dtype=float) ** (1 / 2))
+
+    @instrumentation.instrument('Matching.size_to_climb_coefficients')
+    def size_to_climb_coefficients(self, mass, altitude, speed, aspect_ratio, rate_of_climb,
+                                   propeller_efficiency=0.85, gear_down=False, oswald_efficiency_factor=0.85, cl=1.5):
+        """ Climb power loading is numerator / (offset + root_factor * (W/S) ** 0.5), returned as
+        [numerator, offset, root_factor]. """
         zero_lift_drag_coefficient = self.estimate_drag_polar(
             mass, altitude, speed, aspect_ratio, gear_down, oswald_efficiency_factor, cl)[0]
         imperial_rate_of_climb = rate_of_climb * 196.85  # m/s to ft/min
         drag_polar_for_best_climb = self.calculate_max_rate_of_climb(
             aspect_ratio, oswald_efficiency_factor, zero_lift_drag_coefficient)
-        density_ratio = self.convert_altitude_to_density(altitude) / self.convert_altitude_to_density(0)
+        density_ratio = self.atmosphere.calculate_density_ratio(altitude)
         # Roskam Aircraft Design Part I Section 3.4.5.1
-        power_loading = [(1 / 167.64) * propeller_efficiency /
-                         ((imperial_rate_of_climb / 33000) + (((x / 47.8803) ** (1 / 2)) /
-                                                              (19 * drag_polar_for_best_climb *
-                                                               density_ratio ** (1 / 2)))) for x in wing_loading]
-        return wing_loading, power_loading
+        return [(1 / 167.64) * propeller_efficiency, imperial_rate_of_climb / 33000,
+                1 / (47.8803 ** (1 / 2) * 19 * drag_polar_for_best_climb * density_ratio ** (1 / 2))]
 
     def calculate_max_rate_of_climb(self, aspect_ratio, oswald_efficiency_factor, zero_lift_drag_coefficient):
         # Roskam Aircraft Design Part I Equation 3.27
         return (1.345 * (aspect_ratio * oswald_efficiency_factor) ** (3 / 4)) / (zero_lift_drag_coefficient ** (1 / 4))
 
+    @instrumentation.instrument('Matching.estimate_drag_polar')
     def estimate_drag_polar(self, mass, altitude, speed, aspect_ratio, gear_down, oswald_efficiency_factor, cl):
-        zero_lift_drag_coefficient = self.calculate_zero_lift_drag_coefficient(mass, altitude, speed, cl, gear_down)
-        induced_drag_factor = self.calculate_induced_drag_factor(aspect_ratio, oswald_efficiency_factor)
-        return [zero_lift_drag_coefficient, induced_drag_factor]
+        """ [zero lift drag coefficient, induced drag factor]. Scalar operating points are remembered in a least
+        recently used cache of drag_polar_cache_size entries, arrays are always computed. """
+        operating_point = (mass, altitude, speed, aspect_ratio, gear_down, oswald_efficiency_factor, cl)
+        if any(isinstance(value, np.ndarray) for value in operating_point):
+            return self.calculate_drag_polar(*operating_point)
+        drag_polar = self.drag_polar_cache.get(operating_point)
+        if drag_polar is None:
+            drag_polar = self.calculate_drag_polar(*operating_point)
+            self.drag_polar_cache[operating_point] = drag_polar
+            if len(self.drag_polar_cache) > self.drag_polar_cache_size:
+                self.drag_polar_cache.popitem(last=False)
+        else:
+            self.drag_polar_cache.move_to_end(operating_point)
+        return list(drag_polar)
+
+    @instrumentation.instrument('Matching.calculate_drag_polar')
+    def calculate_drag_polar(self, mass, altitude, speed, aspect_ratio, gear_down, oswald_efficiency_factor, cl):
+        """ The whole drag build up in one pass, so the atmosphere, Reynolds number, skin friction, parasite area and
+        wing area are each worked out once per operating point. """
+        air = self.atmosphere.lookup(altitude)
+        reynolds_number = air.density * speed * self.convert_takeoff_mass_to_length(mass) / air.dynamic_viscosity
+        equivalent_parasite_area = self.convert_skin_friction_to_parasite_area(
+            self.calculate_skin_friction_coefficient(reynolds_number), self.calculate_imperial_wetted_planform(mass))
+        wing_planform_area = mass * 9.80665 / (cl * air.density * speed ** 2 / 2)
+        zero_lift_drag_coefficient = self.add_landing_gear_drag(equivalent_parasite_area / wing_planform_area,
+                                                                gear_down)
+        return (zero_lift_drag_coefficient, self.calculate_induced_drag_factor(aspect_ratio, oswald_efficiency_factor))
 
     def calculate_zero_lift_drag_coefficient(self, mass, altitude, speed, cl, gear_down):
         equivalent_parasite_area = self.calculate_equivalent_parasite_area(mass, altitude, speed)
         wing_planform_area = self.estimate_wing_planform_area(mass, altitude, speed, cl)
-        zero_lift_drag_coefficient = equivalent_parasite_area / wing_planform_area
-        if gear_down is True:
-            zero_lift_drag_coefficient += 0.02
-        else:
-            pass
-        return round(zero_lift_drag_coefficient, 6)
+        return self.add_landing_gear_drag(equivalent_parasite_area / wing_planform_area, gear_down)
+
+    def add_landing_gear_drag(self, zero_lift_drag_coefficient, gear_down):
+        zero_lift_drag_coefficient = np.where(gear_down, zero_lift_drag_coefficient + 0.02, zero_lift_drag_coefficient)
+        return np.round(zero_lift_drag_coefficient, 6)[()]
 
     def calculate_induced_drag_factor(self, aspect_ratio, oswald_efficiency_factor):
-        return round(1 / (math.pi * aspect_ratio * oswald_efficiency_factor), 6)
+        return np.round(1 / (math.pi * np.asarray(aspect_ratio) * oswald_efficiency_factor), 6)[()]
 
     def estimate_wing_planform_area(self, mass, altitude, speed, cl):
         weight = mass * 9.80665
@@ -418,32 +997,22 @@ class Matching:
 
     def calculate_equivalent_parasite_area(self, mass, altitude, speed):
         cf = self.estimate_skin_friction_coefficient(altitude, mass, speed)
-        imperial_wetted_planform = self.calculate_imperial_wetted_planform(mass)
-        if cf == 0.002:
-            return 0.09290304 * 10 ** (math.log10(imperial_wetted_planform) - 2.6990)
-        elif cf == 0.003:
-            return 0.09290304 * 10 ** (math.log10(imperial_wetted_planform) - 2.5229)
-        elif cf == 0.004:
-            return 0.09290304 * 10 ** (math.log10(imperial_wetted_planform) - 2.3979)
-        elif cf == 0.005:
-            return 0.09290304 * 10 ** (math.log10(imperial_wetted_planform) - 2.3010)
-        elif cf == 0.006:
-            return 0.09290304 * 10 ** (math.log10(imperial_wetted_planform) - 2.2218)
-        elif cf == 0.007:
-            return 0.09290304 * 10 ** (math.log10(imperial_wetted_planform) - 2.1549)
-        elif cf == 0.008:
-            return 0.09290304 * 10 ** (math.log10(imperial_wetted_planform) - 2.0969)
-        elif cf == 0.009:
-            return 0.09290304 * 10 ** (math.log10(imperial_wetted_planform) - 2.0458)
-        else:
-            raise ValueError("cf must be an exact value between 0.002 and 0.009 in increments of 0.001!")
+        return self.convert_skin_friction_to_parasite_area(cf, self.calculate_imperial_wetted_planform(mass))
+
+    def convert_skin_friction_to_parasite_area(self, cf, imperial_wetted_planform):
+        """ Roskam's lines of constant cf, read between the lines by interpolating their log10 offsets. Skin friction
+        outside 0.002 to 0.009 stays on the nearest line. """
+        offset = np.interp(cf, self.skin_friction_coefficients, self.skin_friction_log_offsets)
+        return (0.09290304 * 10 ** (np.log10(imperial_wetted_planform) + offset))[()]
 
     def estimate_skin_friction_coefficient(self, altitude, mass, speed):
+        return self.calculate_skin_friction_coefficient(self.calculate_reynolds_number(altitude, mass, speed))
+
+    def calculate_skin_friction_coefficient(self, reynolds_number):
         # Nicolai Chapter 2 Review of Practical Aerodynamics Fig. 2.6
-        if self.calculate_reynolds_number(altitude, mass, speed) < 500000:
-            return round(1.328 / math.sqrt(self.calculate_reynolds_number(altitude, mass, speed)), 3)
-        else:
-            return round(0.455 / (math.log10(self.calculate_reynolds_number(altitude, mass, speed)) ** 2.58), 3)
+        reynolds_number = np.asarray(reynolds_number, dtype=float)
+        return np.where(reynolds_number < 500000, 1.328 / np.sqrt(reynolds_number),
+                        0.455 / (np.log10(reynolds_number) ** 2.58))[()]
 
     def calculate_imperial_wetted_planform(self, mass, aircraft_type='Homebuilt'):
         if aircraft_type == 'Homebuilt':
@@ -452,20 +1021,34 @@ class Matching:
         else:
             raise NameError  # Eventually incorporate all of Roskam's plane types, but currently only homebuilt aircraft
         imperial_weight = mass / 0.453592
-        return 10 ** (c + d * math.log10(imperial_weight))  # Roskam Eq. 3.22
+        return 10 ** (c + d * np.log10(imperial_weight))  # Roskam Eq. 3.22
 
     def calculate_reynolds_number(self, altitude, mass, speed):
         length = self.convert_takeoff_mass_to_length(mass)
-        density = self.convert_altitude_to_density(altitude)
-        viscosity = self.calculate_dynamic_viscosity(altitude)
-        return density * speed * length / viscosity
+        air = self.atmosphere.lookup(altitude)
+        return air.density * speed * length / air.dynamic_viscosity
 
     def convert_takeoff_mass_to_length(self, takeoff_mass):
-        return 10 ** (0.393171 * math.log10(takeoff_mass) - 0.313193)  # Self built database with strong correlation
+        return 10 ** (0.393171 * np.log10(takeoff_mass) - 0.313193)  # Self built database with strong correlation
 
     def calculate_dynamic_viscosity(self, altitude):
-        potential_viscosity = -0.0000000003325805 * altitude + 0.00001792696
-        if potential_viscosity < 0.00001422:
-            return 0.00001422
-        else:
-            return potential_viscosity
+        return self.atmosphere.calculate_dynamic_viscosity(altitude)
+
+
+class DesignPoint:
+    """ Definitely a class
+    The matching chart result from Matching.solve_design_point. wing_loading is in Pascals and power_loading in
+    Newtons per Watt. boundary lists the top edge of the feasible region from left to right as
+    (start_wing_loading, end_wing_loading, constraint_name) pieces, and the region is closed on the right by the
+    vertical line at maximum_wing_loading. """
+
+    def __init__(self, wing_loading, power_loading, active_constraints, boundary, maximum_wing_loading):
+        self.wing_loading = wing_loading
+        self.power_loading = power_loading
+        self.active_constraints = active_constraints
+        self.boundary = boundary
+        self.maximum_wing_loading = maximum_wing_loading
+
+    def __str__(self):
+        return "Wing Loading: {},  Power Loading: {},  Active Constraints: {}" \
+               "".format(self.wing_loading, self.power_loading, ', '.join(self.active_constraints))
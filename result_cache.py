@@ -0,0 +1,167 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+
+import numpy as np
+
+import preliminary_sizing
+
+try:
+    import fcntl
+except ImportError:  # No advisory locks off POSIX, eviction then simply races
+    fcntl = None
+
+CACHE_FORMAT = 1
+VERSIONED_MODULES = ['atmosphere.py', 'preliminary_sizing.py', 'trade_study.py']
+
+
+def calculate_code_version():
+    """ Hash of the sizing source files, so editing the code misses every entry written by the old code. """
+    digest = hashlib.sha256(str(CACHE_FORMAT).encode())
+    directory = os.path.dirname(os.path.abspath(preliminary_sizing.__file__))
+    for module in VERSIONED_MODULES:
+        with open(os.path.join(directory, module), 'rb') as source:
+            digest.update(source.read())
+    return digest.hexdigest()
+
+
+def describe(value):
+    """ Turns sizing inputs into plain JSON data that only depends on what they hold. Derived state such as phase
+    powers and cached trend fits is left out. Integers are described as the equal floats, so capacity=1 and
+    capacity=1.0 share a key, but the dtype of an array is part of it. """
+    if value is None or isinstance(value, (bool, str)):
+        return value
+    if isinstance(value, int):
+        return describe(float(value))
+    if isinstance(value, float):
+        return ['float', float.hex(value)]
+    if isinstance(value, np.generic):
+        return describe(value.item())
+    if isinstance(value, np.ndarray):
+        array = np.ascontiguousarray(value)
+        return ['ndarray', array.dtype.str, list(array.shape), hashlib.sha256(array.tobytes()).hexdigest()]
+    if isinstance(value, dict):
+        return ['dict', sorted([[json.dumps(describe(key)), describe(item)] for key, item in value.items()])]
+    if isinstance(value, (list, tuple)):
+        return [type(value).__name__, [describe(item) for item in value]]
+    if isinstance(value, preliminary_sizing.Mission):
+        return ['Mission', describe([value.takeoff_mass_guess, value.payload, value.cruise_altitude,
+                                     value.lowest_voltage_maximum_power_ratio,
+                                     [[phase, value.phase_counts[phase]] for phase in value.unique_phases]])]
+    if isinstance(value, preliminary_sizing.HistoricalTrend):
+        return ['HistoricalTrend', describe([value.regression_terms, value.plane_weights])]
+    return [type(value).__name__, describe(vars(value))]
+
+
+class ResultCache:
+    """ Definitely a class
+    Content addressed results on disk. Keys are SHA-256 hashes of the described inputs salted with the code version,
+    values are pickled into one file per key. Writes go to a temporary file that is renamed into place, so readers in
+    other processes see either nothing or a whole entry. Reads touch the file's modification time, and once the
+    directory grows past maximum_bytes the least recently used files are removed, under a lock file, until it is
+    back under 90% of the budget.
+
+    Each process only counts what it writes, so it measures the directory again, under the lock, after every tenth
+    of the budget it has written. The directory can then outgrow the budget by up to a tenth of it per process
+    writing to it at once. """
+
+    def __init__(self, directory, maximum_bytes=2 ** 30, salt=None):
+        self.directory = directory
+        self.maximum_bytes = maximum_bytes
+        self.salt = salt if salt is not None else calculate_code_version()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self.approximate_bytes = self.calculate_size()
+        self.written_bytes = 0  # Since the directory was last measured
+
+    def key(self, *inputs):
+        digest = hashlib.sha256(self.salt.encode())
+        digest.update(json.dumps(describe(list(inputs)), separators=(',', ':')).encode())
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.pickle')
+
+    def get(self, key, default=None):
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as entry:
+                value = pickle.load(entry)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return default
+        try:
+            os.utime(path)
+        except OSError:  # Evicted by another process since it was read, the value is still good
+            pass
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'wb') as entry:
+                pickle.dump(value, entry, protocol=pickle.HIGHEST_PROTOCOL)
+            size = os.path.getsize(temporary_path)
+            self.approximate_bytes += size
+            self.written_bytes += size
+            os.replace(temporary_path, path)
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+        if self.approximate_bytes > self.maximum_bytes or self.written_bytes >= self.maximum_bytes / 10:
+            self.evict()
+
+    def get_or_compute(self, inputs, compute):
+        """ Looks up the tuple of inputs and calls compute() to fill the entry on a miss. """
+        key = self.key(*inputs)
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = compute()
+            self.set(key, value)
+        return value
+
+    def list_entries(self):
+        entries = []
+        for folder in os.scandir(self.directory):
+            if folder.is_dir():
+                for entry in os.scandir(folder.path):
+                    if entry.name.endswith('.pickle'):
+                        try:
+                            status = entry.stat()
+                        except FileNotFoundError:
+                            continue
+                        entries.append([status.st_mtime, status.st_size, entry.path])
+        return entries
+
+    def calculate_size(self):
+        return sum(size for modified, size, path in self.list_entries())
+
+    def evict(self):
+        """ Measures the directory, the writes of other processes included, and removes the least recently used
+        entries if it is over the budget. """
+        with open(os.path.join(self.directory, '.lock'), 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            entries = sorted(self.list_entries())
+            size = sum(entry[1] for entry in entries)
+            target = 0.9 * self.maximum_bytes if size > self.maximum_bytes else size
+            for modified, entry_size, path in entries:
+                if size <= target:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                size -= entry_size
+            self.approximate_bytes = size
+            self.written_bytes = 0
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_UN)
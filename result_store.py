@@ -0,0 +1,246 @@
+import collections
+import json
+import math
+import os
+
+import numpy as np
+
+STORE_FORMAT = 1
+SCHEMA_FILE = 'schema.json'
+
+# The numbers of trade_study.create_result, the matching ones NaN for cases without matching
+RESULT_COLUMNS = collections.OrderedDict([
+    ('takeoff_mass', 'f8'), ('empty_mass', 'f8'), ('battery_pack_mass', 'f8'), ('number_in_series', 'i8'),
+    ('number_in_parallel', 'i8'), ('number_of_cells', 'i8'), ('maximum_power', 'f8'), ('converged', '?'),
+    ('iterations', 'i8'), ('wing_loading', 'f8'), ('power_loading', 'f8')])
+
+
+def create_study_columns(parameters, dtype='f8'):
+    """ RESULT_COLUMNS after a column for each named parameter of a TradeStudy, e.g. the axes of its grid. """
+    return collections.OrderedDict([(name, dtype) for name in parameters] + list(RESULT_COLUMNS.items()))
+
+
+class ResultStore:
+    """ Definitely a class
+    Sweep results on disk as columns, one file of fixed width values per column in directory and a schema.json of
+    the column names and dtypes (numpy strings such as 'f8', 'i4', '?' or 'S16'). mode 'w' makes a new store of
+    columns, replacing one there, 'a' appends to a store and 'r' only reads.
+
+    append and append_rows keep up to buffer_rows rows in memory and write whole rows to the end of every column file
+    at once, so nothing is ever rewritten. The number of rows is that of the shortest column file, which leaves out
+    a row torn by a crash, and 'a' cuts the longer files back to it. store[name] is a read only memory map of a
+    column, so a study of tens of millions of rows is filtered and aggregated by select, aggregate and
+    calculate_percentiles a chunk of chunk_rows at a time without being read into memory. """
+
+    def __init__(self, directory, columns=None, mode='r', buffer_rows=2 ** 16):
+        self.directory = directory
+        self.mode = mode
+        self.buffer_rows = buffer_rows
+        self.buffer = collections.defaultdict(list)
+        self.buffered_rows = 0
+        schema_path = os.path.join(directory, SCHEMA_FILE)
+        if mode == 'w':
+            if columns is None:
+                raise ValueError("a new store needs its columns")
+            os.makedirs(directory, exist_ok=True)
+            self.columns = collections.OrderedDict((name, np.dtype(dtype)) for name, dtype in columns.items())
+            for name in self.columns:
+                open(self.path(name), 'wb').close()
+            with open(schema_path, 'w') as schema:
+                json.dump({'format': STORE_FORMAT,
+                           'columns': [[name, dtype.str] for name, dtype in self.columns.items()]}, schema, indent=2)
+        elif mode in ['a', 'r']:
+            with open(schema_path) as schema:
+                schema = json.load(schema)
+            if schema['format'] != STORE_FORMAT:
+                raise ValueError("{} holds a store of format {}, not {}".format(directory, schema['format'],
+                                                                                 STORE_FORMAT))
+            self.columns = collections.OrderedDict((name, np.dtype(dtype)) for name, dtype in schema['columns'])
+            if columns is not None and [(name, np.dtype(dtype)) for name, dtype in columns.items()] != list(
+                    self.columns.items()):
+                raise ValueError("{} holds columns {}, not {}".format(directory, list(self.columns), list(columns)))
+        else:
+            raise ValueError("mode is 'w', 'a' or 'r', not {!r}".format(mode))
+        self.number_of_rows = min([os.path.getsize(self.path(name)) // dtype.itemsize
+                                   for name, dtype in self.columns.items()], default=0)
+        if mode == 'a':
+            for name, dtype in self.columns.items():
+                with open(self.path(name), 'r+b') as column:
+                    column.truncate(self.number_of_rows * dtype.itemsize)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    def __len__(self):
+        return self.number_of_rows
+
+    def __getitem__(self, name):
+        """ The written rows of a column as a read only memory map. """
+        dtype = self.columns[name]
+        if self.number_of_rows == 0:
+            return np.empty(0, dtype)
+        return np.memmap(self.path(name), dtype, mode='r', shape=(self.number_of_rows,))
+
+    def path(self, name):
+        return os.path.join(self.directory, name + '.bin')
+
+    def append(self, values):
+        """ values maps every column to an array of the new rows, or a scalar shared by them. """
+        if self.mode == 'r':
+            raise ValueError("the store was opened read only")
+        missing = [name for name in self.columns if name not in values]
+        if missing:
+            raise KeyError("no values for columns {}".format(missing))
+        arrays = [np.asarray(values[name], dtype=dtype) for name, dtype in self.columns.items()]
+        length = max([array.size for array in arrays if array.ndim > 0], default=1)
+        for [name, dtype], array in zip(self.columns.items(), arrays):
+            self.buffer[name].append(np.broadcast_to(array, (length,)).astype(dtype))
+        self.buffered_rows += length
+        if self.buffered_rows >= self.buffer_rows:
+            self.flush()
+
+    def append_rows(self, rows):
+        """ rows are dictionaries such as the results of a TradeStudy. A column is looked for in the row and then
+        in its 'parameters', and a float column missing from both is NaN. """
+        values = {}
+        for name, dtype in self.columns.items():
+            fill = np.nan if dtype.kind == 'f' else None
+            values[name] = [row[name] if name in row else row.get('parameters', {}).get(name, fill) for row in rows]
+            if fill is None and any(value is None for value in values[name]):
+                raise KeyError("rows without a value for column {}".format(name))
+        if rows:
+            self.append(values)
+
+    def flush(self):
+        if not self.buffered_rows:
+            return
+        for name in self.columns:
+            with open(self.path(name), 'ab') as column:
+                np.concatenate(self.buffer[name]).tofile(column)
+        self.number_of_rows += self.buffered_rows
+        self.buffer.clear()
+        self.buffered_rows = 0
+
+    def close(self):
+        if self.mode != 'r':
+            self.flush()
+
+    def iterate_chunks(self, names=None, chunk_rows=2 ** 20, rows=None):
+        """ (first row, end row, {column: memory mapped slice}) for every chunk of the rows, a (first, end) pair
+        of row numbers, either None for open, that defaults to every row. """
+        names = list(self.columns) if names is None else list(names)
+        columns = {name: self[name] for name in names}
+        [first, end] = rows if rows is not None else [None, None]
+        first = 0 if first is None else max(0, first)
+        end = self.number_of_rows if end is None else min(end, self.number_of_rows)
+        for start in range(first, end, chunk_rows):
+            stop = min(start + chunk_rows, end)
+            yield start, stop, {name: column[start:stop] for name, column in columns.items()}
+
+    def create_mask(self, start, stop, chunk, ranges):
+        mask = np.ones(stop - start, dtype=bool)
+        for name, [lowest, highest] in ranges.items():
+            if lowest is not None:
+                mask &= chunk[name] >= lowest
+            if highest is not None:
+                mask &= chunk[name] <= highest
+        return mask
+
+    def select(self, chunk_rows=2 ** 20, rows=None, **ranges):
+        """ Indices of the rows whose columns lie in the given (lowest, highest) ranges, either end None for open,
+        select(takeoff_mass=(None, 9), converged=(True, True)) say. rows limits them as in iterate_chunks. """
+        indices = [start + np.flatnonzero(self.create_mask(start, stop, chunk, ranges))
+                   for start, stop, chunk in self.iterate_chunks(list(ranges), chunk_rows, rows)]
+        return np.concatenate(indices) if indices else np.empty(0, dtype=np.int64)
+
+    def aggregate(self, column, by=None, where=None, chunk_rows=2 ** 20, rows=None):
+        """ {'count', 'sum', 'mean', 'minimum', 'maximum'} of a column over the rows in the where ranges, NaN left
+        out, or a dictionary of them for every value of the column named by. rows limits them as in
+        iterate_chunks. """
+        where = where or {}
+        names = list(dict.fromkeys([column] + ([by] if by is not None else []) + list(where)))
+        totals = {}
+        for start, stop, chunk in self.iterate_chunks(names, chunk_rows, rows):
+            mask = self.create_mask(start, stop, chunk, where) & ~np.isnan(chunk[column].astype(float))
+            values = chunk[column][mask].astype(float)
+            if by is None:
+                groups = [(None, values)]
+            else:
+                [keys, inverse] = np.unique(chunk[by][mask], return_inverse=True)
+                order = np.argsort(inverse, kind='stable')
+                groups = zip(keys.tolist(), np.split(values[order], np.cumsum(np.bincount(inverse))[:-1]))
+            for key, group in groups:
+                total = totals.setdefault(key, [0, 0.0, np.inf, -np.inf])
+                if len(group):
+                    total[:] = [total[0] + len(group), total[1] + group.sum(), min(total[2], group.min()),
+                                max(total[3], group.max())]
+        summaries = {key: {'count': count, 'sum': float(total), 'mean': float(total / count) if count else np.nan,
+                           'minimum': float(minimum) if count else np.nan,
+                           'maximum': float(maximum) if count else np.nan}
+                     for key, [count, total, minimum, maximum] in totals.items()}
+        if by is None:
+            return summaries.get(None, {'count': 0, 'sum': 0.0, 'mean': np.nan, 'minimum': np.nan,
+                                        'maximum': np.nan})
+        return summaries
+
+    def calculate_percentiles(self, column, percentiles, where=None, chunk_rows=2 ** 20, bins=1024, rows=None):
+        """ np.percentile of a column over the rows in the where ranges, NaN left out, up to rounding. The order
+        statistics either side of each percentile are found by counting the rows in bins between two bounds, a
+        chunk at a time, and narrowing the bounds to the bin holding the one looked for, until no more than
+        chunk_rows rows are left between them to sort. rows limits the rows as in iterate_chunks. """
+        where = where or {}
+        summary = self.aggregate(column, where=where, chunk_rows=chunk_rows, rows=rows)
+        count = summary['count']
+        order_statistics = {}
+        values = []
+        for percentile in percentiles:
+            if not count:
+                values.append(np.nan)
+                continue
+            position = percentile / 100 * (count - 1)
+            lower = min(int(math.floor(position)), count - 1)
+            for rank in [lower, min(lower + 1, count - 1)]:
+                if rank not in order_statistics:
+                    order_statistics[rank] = self.find_order_statistic(
+                        column, rank, count, summary['minimum'], summary['maximum'], where, chunk_rows, bins, rows)
+            [low, high] = [order_statistics[lower], order_statistics[min(lower + 1, count - 1)]]
+            values.append(low + (high - low) * (position - lower))
+        return values
+
+    def find_order_statistic(self, column, rank, count, lowest, highest, where, chunk_rows, bins, rows=None):
+        """ The value with rank rows below it, counting from zero, among the count rows between lowest and
+        highest. """
+        closed = True  # Whether the rows equal to highest are between the bounds
+        below = 0  # Rows below lowest
+        while lowest < highest and count > chunk_rows:
+            edges = np.linspace(lowest, highest, bins + 1)
+            counts = np.zeros(bins, dtype=np.int64)
+            for values in self.iterate_values(column, where, chunk_rows, lowest, highest, closed, rows):
+                indices = np.searchsorted(edges, values, side='right') - 1
+                counts += np.bincount(np.minimum(indices, bins - 1), minlength=bins)
+            cumulative = np.cumsum(counts)
+            found = int(np.searchsorted(cumulative, rank - below, side='right'))
+            if counts[found] == count:  # The bins are too narrow for the floats to split, so bound the rows
+                extremes = [[values.min(), values.max()] for values in self.iterate_values(
+                    column, where, chunk_rows, lowest, highest, closed, rows) if len(values)]
+                [lowest, highest, closed] = [min(low for low, high in extremes), max(high for low, high in extremes),
+                                             True]
+                continue
+            below += int(cumulative[found - 1]) if found else 0
+            count = int(counts[found])
+            [lowest, highest, closed] = [edges[found], edges[found + 1], closed and found == bins - 1]
+        if lowest == highest:
+            return float(lowest)
+        values = np.sort(np.concatenate(list(self.iterate_values(column, where, chunk_rows, lowest, highest,
+                                                                 closed, rows))))
+        return float(values[rank - below])
+
+    def iterate_values(self, column, where, chunk_rows, lowest, highest, closed, rows=None):
+        """ The values of a column in the where ranges and from lowest to highest, a chunk of rows at a time. """
+        names = list(dict.fromkeys([column] + list(where)))
+        for start, stop, chunk in self.iterate_chunks(names, chunk_rows, rows):
+            values = chunk[column][self.create_mask(start, stop, chunk, where)].astype(float)
+            yield values[(values >= lowest) & ((values <= highest) if closed else (values < highest))]
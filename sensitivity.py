@@ -0,0 +1,163 @@
+import copy
+import math
+
+import numpy as np
+
+from preliminary_sizing import BatteryPackMass, MassIteration, MissionTable, PhasePower
+
+
+class Sensitivity:
+    """ Definitely a class
+    Derivatives of the converged takeoff mass, empty mass and battery pack mass with respect to every sizing input,
+    from one solve and the implicit function theorem. At the solution the available and required empty masses agree,
+    R(m, x) = m - payload - battery_pack_mass(m, x) - empty_mass_required(m, x) = 0, so dm/dx = -(dR/dx) / (dR/dm).
+
+    Cell counts step with math.ceil and are constant between the steps, so by default they are held at their values
+    at the solution, which makes the derivatives exact everywhere except on a step itself. Inputs that only reach the
+    pack through the counts (efficiency, lift to drag ratios, phase times) then have zero derivatives.
+    relax_cell_counts=True instead treats the counts as the continuous numbers they are rounded up from, giving the
+    smooth trend a gradient based optimizer wants, and moves the solution to the root of that relaxed model.
+
+    Inputs are named as the constructor arguments of Battery, Motor and Mission, in their units, plus trend_slope,
+    trend_y_intercept and lift_over_drag:<phase> and time:<phase> for every distinct phase. derivatives holds
+    {output: {input: derivative}} and on_cell_count_step is True where the solution sits on a step. """
+
+    outputs = ['takeoff_mass', 'empty_mass', 'battery_pack_mass']
+
+    def __init__(self, motor, mission, battery, historical_trend, relax_cell_counts=False, acceptable_error=0.005):
+        self.relax_cell_counts = relax_cell_counts
+        self.on_cell_count_step = False
+        mission = copy.deepcopy(mission)
+        iteration = MassIteration(motor, mission, battery, historical_trend, acceptable_error, 'coupled')
+        [self.trend_slope, self.trend_y_intercept] = historical_trend.calculate_trend()
+        self.phase_names = self.name_phases(mission.unique_phases)
+        self.parameters = {'payload': mission.payload,
+                           'specific_energy_density': battery.specific_energy_density / 3600,
+                           'cell_capacity': battery.cell_capacity / 3600,
+                           'nominal_cell_voltage': battery.nominal_cell_voltage,
+                           'c_max': battery.c_max * 3600,
+                           'whole_chain_efficiency': motor.whole_chain_efficiency,
+                           'input_voltage': motor.input_voltage,
+                           'lowest_voltage_max_power_ratio': mission.lowest_voltage_maximum_power_ratio,
+                           'trend_slope': self.trend_slope, 'trend_y_intercept': self.trend_y_intercept}
+        for name, phase in zip(self.phase_names, mission.unique_phases):
+            self.parameters['lift_over_drag:' + name] = phase.lift_over_drag
+            self.parameters['time:' + name] = phase.time
+
+        self.table = MissionTable.from_mission(mission)
+        if relax_cell_counts:
+            self.pack_partials = self.calculate_relaxed_pack_partials()  # pack = m * k, k independent of m
+            self.takeoff_mass = self.solve(iteration.iterated_takeoff_mass, lambda mass: mass * self.pack_partials[0])
+        else:
+            PhasePower(mission)
+            number_of_cells = BatteryPackMass(motor, mission, battery).number_of_cells
+            pack_mass = number_of_cells * battery.battery_cell_mass
+            self.takeoff_mass = self.solve(iteration.iterated_takeoff_mass, lambda mass: pack_mass)
+            mission.takeoff_mass_guess = self.takeoff_mass
+            PhasePower(mission)
+            self.on_cell_count_step = BatteryPackMass(motor, mission, battery).number_of_cells != number_of_cells
+            if self.on_cell_count_step:  # Polishing crossed a step, so the solver's mass is as close as it gets
+                self.takeoff_mass = iteration.iterated_takeoff_mass
+            self.pack_partials = [0, self.calculate_frozen_pack_partials(pack_mass)]
+        self.battery_pack_mass = self.calculate_pack_mass(self.takeoff_mass)
+        self.empty_mass = self.takeoff_mass - mission.payload - self.battery_pack_mass
+        self.derivatives = self.calculate_derivatives()
+
+    def name_phases(self, phases):
+        names = [phase.name for phase in phases]
+        return [name if names.count(name) == 1 else '{}#{}'.format(name, index) for index, name in enumerate(names)]
+
+    def calculate_empty_mass_required(self, mass):
+        return 10 ** (math.log10(mass) * self.trend_slope + self.trend_y_intercept)
+
+    def calculate_pack_mass(self, mass):
+        if self.relax_cell_counts:
+            return mass * self.pack_partials[0]
+        return self.pack_partials[1]['pack_mass']
+
+    def solve(self, mass, calculate_pack_mass):
+        """ Newton's method on R(m) from the solver's mass, which is already within acceptable_error. """
+        for iteration in range(50):
+            empty_mass_required = self.calculate_empty_mass_required(mass)
+            residual = mass - self.parameters['payload'] - calculate_pack_mass(mass) - empty_mass_required
+            slope = 1 - (calculate_pack_mass(mass) if self.relax_cell_counts else 0) / mass \
+                - self.trend_slope * empty_mass_required / mass
+            step = residual / slope
+            mass -= step
+            if abs(step) <= 1e-13 * mass:
+                break
+        return mass
+
+    def calculate_frozen_pack_partials(self, pack_mass):
+        """ With the counts held,
+        pack mass = cells * cell_capacity * nominal_cell_voltage / specific_energy_density. """
+        parameters = self.parameters
+        return {'pack_mass': pack_mass,
+                'specific_energy_density': -pack_mass / parameters['specific_energy_density'],
+                'cell_capacity': pack_mass / parameters['cell_capacity'],
+                'nominal_cell_voltage': pack_mass / parameters['nominal_cell_voltage']}
+
+    def calculate_relaxed_pack_partials(self):
+        """ [k, {input: dk/dinput}] where pack mass = m * k and k is the larger of the power and endurance terms,
+        power: maximum specific power / (c_max * efficiency * voltage ratio * specific energy density) and
+        endurance: input voltage * specific mission energy / (cell voltage * efficiency * specific energy density),
+        with unit conversions folded into the constants. """
+        table = self.table
+        parameters = self.parameters
+        specific_power = table.specific_power
+        flown = specific_power > 0  # Phases clipped at zero power do not move with their inputs
+        peak = int(np.argmax(specific_power))
+        maximum_power = specific_power[peak]
+        energy = float(specific_power @ (table.time * table.count))
+        power_term = maximum_power / (parameters['c_max'] / 3600 * parameters['whole_chain_efficiency']
+                                      * parameters['lowest_voltage_max_power_ratio']
+                                      * parameters['specific_energy_density'] * 3600)
+        endurance_term = parameters['input_voltage'] * energy / (
+            parameters['nominal_cell_voltage'] * parameters['whole_chain_efficiency']
+            * parameters['specific_energy_density'] * 3600)
+        partials = {}
+        d_power = -table.specific_aerodynamic_power / table.lift_over_drag * flown  # d specific power / d L/D
+        d_power_time = -table.specific_kinetic_power / table.time * flown  # d specific power / d time
+        if power_term >= endurance_term:
+            term = power_term
+            for name in ['c_max', 'whole_chain_efficiency', 'lowest_voltage_max_power_ratio',
+                         'specific_energy_density']:
+                partials[name] = -term / parameters[name]
+            for index, name in enumerate(self.phase_names):
+                partials['lift_over_drag:' + name] = term / maximum_power * d_power[index] * (index == peak)
+                partials['time:' + name] = term / maximum_power * d_power_time[index] * (index == peak)
+        else:
+            term = endurance_term
+            partials['input_voltage'] = term / parameters['input_voltage']
+            for name in ['nominal_cell_voltage', 'whole_chain_efficiency', 'specific_energy_density']:
+                partials[name] = -term / parameters[name]
+            for index, name in enumerate(self.phase_names):
+                weight = table.time[index] * table.count[index]
+                partials['lift_over_drag:' + name] = term / energy * weight * d_power[index]
+                partials['time:' + name] = term / energy * table.count[index] * (
+                    specific_power[index] + table.time[index] * d_power_time[index])
+        return [term, partials]
+
+    def calculate_derivatives(self):
+        mass = self.takeoff_mass
+        empty_mass_required = self.calculate_empty_mass_required(mass)
+        d_pack_d_mass = self.pack_partials[0] if self.relax_cell_counts else 0
+        d_residual_d_mass = 1 - d_pack_d_mass - self.trend_slope * empty_mass_required / mass
+        pack_partials = self.pack_partials[1]
+        derivatives = {output: {} for output in self.outputs}
+        for name in self.parameters:
+            d_pack = pack_partials.get(name, 0) * (mass if self.relax_cell_counts else 1)
+            d_required = {'trend_slope': empty_mass_required * math.log(10) * math.log10(mass),
+                          'trend_y_intercept': empty_mass_required * math.log(10)}.get(name, 0)
+            d_payload = 1 if name == 'payload' else 0
+            d_mass = (d_payload + d_pack + d_required) / d_residual_d_mass
+            derivatives['takeoff_mass'][name] = d_mass
+            derivatives['battery_pack_mass'][name] = d_pack + d_pack_d_mass * d_mass
+            derivatives['empty_mass'][name] = d_mass - d_payload - derivatives['battery_pack_mass'][name]
+        return derivatives
+
+    def calculate_elasticities(self, output='takeoff_mass'):
+        """ Percent change of output per percent change of each input, for ranking the inputs. """
+        value = getattr(self, output)
+        return {name: derivative * self.parameters[name] / value
+                for name, derivative in self.derivatives[output].items()}
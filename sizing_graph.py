@@ -0,0 +1,129 @@
+import collections
+import copy
+import hashlib
+import json
+
+from preliminary_sizing import BatteryPackMass, Matching, MassIteration, PhasePower
+from result_cache import describe
+from trade_study import add_takeoff_mass, create_result
+
+
+def calculate_fingerprint(value):
+    """ SHA-256 of what the value holds, as result_cache.describe sees it. """
+    return hashlib.sha256(json.dumps(describe(value), separators=(',', ':')).encode()).hexdigest()
+
+
+class SizingGraph:
+    """ Definitely a class
+    The sizing pipeline as named inputs and stages, each stage a function of the values of the nodes it lists.
+    Every value is fingerprinted, and asking for a stage only reruns it when the fingerprints of its inputs differ
+    from those of its last run, so after set_input only the stages downstream of the change are recomputed. A stage
+    whose new value has the same fingerprint as its old one stops the change there. Inputs are fingerprinted by
+    set_input, so one changed in place has to be set again. evaluations counts the runs of every stage. """
+
+    def __init__(self):
+        self.inputs = set()
+        self.stages = collections.OrderedDict()  # name -> [function, input names]
+        self.values = {}
+        self.fingerprints = {}
+        self.used_fingerprints = {}  # stage name -> fingerprints of its inputs when it last ran
+        self.evaluations = collections.Counter()
+
+    def add_input(self, name, value):
+        self.inputs.add(name)
+        self.set_input(name, value)
+
+    def add_stage(self, name, function, inputs):
+        """ function is called with the values of inputs in order, which must already be in the graph. """
+        missing = [node for node in inputs if node not in self.inputs and node not in self.stages]
+        if missing:
+            raise ValueError("stage {} depends on unknown nodes {}".format(name, missing))
+        self.stages[name] = [function, list(inputs)]
+
+    def set_input(self, name, value):
+        if name not in self.inputs:
+            raise KeyError("{} is not an input of the graph".format(name))
+        self.values[name] = value
+        self.fingerprints[name] = calculate_fingerprint(value)
+
+    def update(self, **values):
+        for name, value in values.items():
+            self.set_input(name, value)
+
+    def evaluate(self, name):
+        """ The value of a node, running only the stages whose inputs changed since they last ran. """
+        if name in self.inputs:
+            return self.values[name]
+        [function, inputs] = self.stages[name]
+        arguments = [self.evaluate(node) for node in inputs]
+        used_fingerprints = [self.fingerprints[node] for node in inputs]
+        if self.used_fingerprints.get(name) != used_fingerprints:
+            self.values[name] = function(*arguments)
+            self.fingerprints[name] = calculate_fingerprint(self.values[name])
+            self.used_fingerprints[name] = used_fingerprints
+            self.evaluations[name] += 1
+        return self.values[name]
+
+    def find_stale_stages(self):
+        """ Stages that may run on the next evaluate: those whose inputs changed and everything downstream of them. """
+        stale = set()
+        for name, [function, inputs] in self.stages.items():
+            if any(node in stale for node in inputs) or self.used_fingerprints.get(name) != [
+                    self.fingerprints.get(node) for node in inputs]:
+                stale.add(name)
+        return [name for name in self.stages if name in stale]
+
+
+def fit_historical_trend(historical_trend):
+    historical_trend = copy.deepcopy(historical_trend)
+    historical_trend.calculate_trend()
+    return historical_trend
+
+
+def calculate_phase_power(mission):
+    mission = copy.deepcopy(mission)
+    PhasePower(mission)
+    return mission
+
+
+def iterate_mass(mission, motor, battery, historical_trend, method, acceptable_error):
+    """ [MassIteration, the mission at the converged takeoff mass with its phase powers]. """
+    mission = copy.deepcopy(mission)
+    iteration = MassIteration(motor, mission, battery, historical_trend, acceptable_error, method)
+    PhasePower(mission)
+    return [iteration, mission]
+
+
+def size_battery_pack(mass_iteration, motor, battery):
+    return BatteryPackMass(motor, mass_iteration[1], battery)
+
+
+def solve_design_point(mass_iteration, matching):
+    if not matching:
+        return None
+    takeoff_mass = mass_iteration[0].iterated_takeoff_mass
+    return Matching(takeoff_mass).solve_design_point(**add_takeoff_mass(matching, takeoff_mass))
+
+
+def summarize(mass_iteration, battery_pack, design_point):
+    """ The dictionary of trade_study.size_design_case, without the name and parameters. """
+    return create_result(mass_iteration[0], mass_iteration[1], battery_pack, design_point)
+
+
+def create_sizing_graph(mission, motor, battery, historical_trend, matching=None, method='coupled',
+                        acceptable_error=0.005):
+    """ The pipeline of trade_study.size_design_case as a SizingGraph. Its inputs are the arguments, its stages are
+    fitted_trend, phase_power, mass_iteration, battery_pack, design_point and result. """
+    graph = SizingGraph()
+    for name, value in [('mission', mission), ('motor', motor), ('battery', battery),
+                        ('historical_trend', historical_trend), ('matching', matching), ('method', method),
+                        ('acceptable_error', acceptable_error)]:
+        graph.add_input(name, value)
+    graph.add_stage('fitted_trend', fit_historical_trend, ['historical_trend'])
+    graph.add_stage('phase_power', calculate_phase_power, ['mission'])
+    graph.add_stage('mass_iteration', iterate_mass, ['phase_power', 'motor', 'battery', 'fitted_trend', 'method',
+                                                     'acceptable_error'])
+    graph.add_stage('battery_pack', size_battery_pack, ['mass_iteration', 'motor', 'battery'])
+    graph.add_stage('design_point', solve_design_point, ['mass_iteration', 'matching'])
+    graph.add_stage('result', summarize, ['mass_iteration', 'battery_pack', 'design_point'])
+    return graph
@@ -0,0 +1,202 @@
+import concurrent.futures
+import copy
+import itertools
+import math
+import os
+
+import instrumentation
+from preliminary_sizing import BatteryPackMass, Matching, MassIteration, PhasePower
+
+worker_historical_trend = None  # The study's shared trend, fitted once in every worker process
+
+
+class DesignCase:
+    """ Definitely a class
+    Everything one run of the sizing pipeline needs. historical_trend may be left as None to use the trend shared by
+    the whole TradeStudy, matching holds keyword arguments for Matching.solve_design_point (climb and cruise get the
+    converged takeoff mass when they leave out mass) and parameters is free form, e.g. the grid values of the case. """
+
+    def __init__(self, mission, motor, battery, historical_trend=None, matching=None, method='coupled',
+                 acceptable_error=0.005, name=None, parameters=None):
+        self.mission = mission
+        self.motor = motor
+        self.battery = battery
+        self.historical_trend = historical_trend
+        self.matching = matching
+        self.method = method
+        self.acceptable_error = acceptable_error
+        self.name = name
+        self.parameters = parameters if parameters is not None else {}
+
+
+def size_design_case(case, historical_trend=None):
+    """ PhasePower -> BatteryPackMass -> MassIteration -> Matching for one case, returned as a dictionary of plain
+    numbers. The mission is copied first, so the case is left as it was given. """
+    historical_trend = case.historical_trend if case.historical_trend is not None else historical_trend
+    if historical_trend is None:
+        raise ValueError("the case has no historical trend and the study does not share one")
+    mission = copy.deepcopy(case.mission)
+    PhasePower(mission)
+    iteration = MassIteration(case.motor, mission, case.battery, historical_trend, case.acceptable_error,
+                              case.method)
+    PhasePower(mission)
+    battery_pack = BatteryPackMass(case.motor, mission, case.battery)
+    design_point = None
+    if case.matching:
+        design_point = Matching(iteration.iterated_takeoff_mass).solve_design_point(
+            **add_takeoff_mass(case.matching, iteration.iterated_takeoff_mass))
+    return dict({'name': case.name, 'parameters': case.parameters},
+                **create_result(iteration, mission, battery_pack, design_point))
+
+
+def create_result(iteration, mission, battery_pack, design_point=None):
+    """ Plain numbers from a converged MassIteration, its mission and battery pack, and a DesignPoint if any. """
+    result = {'takeoff_mass': float(iteration.iterated_takeoff_mass),
+              'empty_mass': float(iteration.iterated_empty_mass),
+              'battery_pack_mass': float(battery_pack.battery_pack_mass),
+              'number_in_series': int(battery_pack.number_in_series),
+              'number_in_parallel': int(battery_pack.number_in_parallel),
+              'number_of_cells': int(battery_pack.number_of_cells),
+              'maximum_power': float(mission.maximum_power),
+              'converged': bool(iteration.converged),
+              'iterations': iteration.iterations}
+    if design_point is not None:
+        result.update({'wing_loading': float(design_point.wing_loading),
+                       'power_loading': float(design_point.power_loading),
+                       'active_constraints': design_point.active_constraints})
+    return result
+
+
+def add_takeoff_mass(matching, takeoff_mass):
+    """ Fills in mass for climb and cruise constraints that leave it out. """
+    matching = dict(matching)
+    for kind in ['climb', 'cruise']:
+        if isinstance(matching.get(kind), dict):
+            matching[kind] = dict({'mass': takeoff_mass}, **matching[kind])
+        elif matching.get(kind) is not None:
+            matching[kind] = [dict({'mass': takeoff_mass}, **spec) for spec in matching[kind]]
+    return matching
+
+
+def share_historical_trend(historical_trend):
+    global worker_historical_trend
+    if historical_trend is not None:
+        historical_trend.calculate_trend()
+    worker_historical_trend = historical_trend
+
+
+def initialize_worker(historical_trend, instrumented=False):
+    """ instrumented carries the parent's instrumentation.enabled, and forked workers drop the parent's numbers. """
+    instrumentation.reset()
+    if instrumented:
+        instrumentation.enable()
+    share_historical_trend(historical_trend)
+
+
+def size_design_cases(cases):
+    return [size_design_case(case, worker_historical_trend) for case in cases]
+
+
+def size_design_cases_in_worker(cases):
+    """ size_design_cases plus the worker's instrumentation numbers for the chunk, or None when it is off. """
+    results = size_design_cases(cases)
+    return [results, instrumentation.collect() if instrumentation.enabled else None]
+
+
+class TradeStudy:
+    """ Definitely a class
+    Runs the sizing pipeline for a list of DesignCase objects over a process pool. Cases are sent in chunks so each
+    task carries enough work to hide the pickling, the shared historical trend is sent once per worker and fitted
+    there, and results come back in the order of the cases whatever order the workers finish in. """
+
+    def __init__(self, cases, historical_trend=None):
+        self.cases = list(cases)
+        self.historical_trend = historical_trend
+        self.results = None
+        self.store = None
+        self.stored_results = 0
+        self.first_stored_row = 0  # The store's row of the first case
+
+    @classmethod
+    def from_grid(cls, create_case, historical_trend=None, **axes):
+        """ One case for every combination of the axes, e.g. from_grid(make, capacity=[2.2, 3.0], payload=[1, 2]).
+        create_case is called with one value per axis as keyword arguments and returns a DesignCase, and the
+        combination is kept in the case's parameters. """
+        names = list(axes)
+        cases = []
+        for values in itertools.product(*[axes[name] for name in names]):
+            parameters = dict(zip(names, values))
+            case = create_case(**parameters)
+            case.parameters = dict(parameters, **case.parameters)
+            cases.append(case)
+        return cls(cases, historical_trend)
+
+    def run(self, workers=None, chunk_size=None, progress=None, cache=None, store=None):
+        """ workers defaults to every core and workers=1 runs in this process. chunk_size defaults to about four
+        chunks per worker. progress, if given, is called as progress(cases_done, total_cases) after every chunk.
+        With a ResultCache only the cases it does not hold yet are sized, and their results are added to it. When
+        instrumentation is enabled, the numbers from the workers are merged into this process's after each chunk.
+        With a result_store.ResultStore the results are appended to it in the order of the cases as they come in,
+        instead of being kept, and the store is returned. The case at index is then row first_stored_row + index
+        of the store. """
+        workers = workers if workers is not None else os.cpu_count() or 1
+        self.results = [None] * len(self.cases)
+        self.store = store
+        self.stored_results = 0
+        self.first_stored_row = len(store) + store.buffered_rows if store is not None else 0
+        keys = [self.calculate_cache_key(cache, case) for case in self.cases] if cache is not None else None
+        pending = []
+        for index, case in enumerate(self.cases):
+            result = cache.get(keys[index]) if cache is not None else None
+            if result is None:
+                pending.append(index)
+            else:
+                self.results[index] = dict(result, name=case.name, parameters=case.parameters)
+        if chunk_size is None:
+            chunk_size = max(1, math.ceil(len(pending) / (4 * workers)))
+        chunks = [pending[start:start + chunk_size] for start in range(0, len(pending), chunk_size)]
+        case_chunks = ([self.cases[index] for index in chunk] for chunk in chunks)
+        if workers == 1:
+            share_historical_trend(self.historical_trend)
+            chunk_results = ([results, None] for results in map(size_design_cases, case_chunks))
+            self.collect_results(chunks, chunk_results, progress, cache, keys)
+        else:
+            with concurrent.futures.ProcessPoolExecutor(
+                    workers, initializer=initialize_worker,
+                    initargs=(self.historical_trend, instrumentation.enabled)) as executor:
+                self.collect_results(chunks, executor.map(size_design_cases_in_worker, case_chunks), progress,
+                                     cache, keys)
+        if store is not None:
+            self.store_results()
+            store.flush()
+            return store
+        return self.results
+
+    def calculate_cache_key(self, cache, case):
+        """ The name and parameters of a case only label it, so they are not part of the key. """
+        return cache.key(case.mission, case.motor, case.battery,
+                         case.historical_trend if case.historical_trend is not None else self.historical_trend,
+                         case.matching, case.method, case.acceptable_error)
+
+    def collect_results(self, chunks, chunk_results, progress, cache, keys):
+        done = len(self.cases) - sum(len(chunk) for chunk in chunks)
+        for chunk, [results, numbers] in zip(chunks, chunk_results):
+            if numbers is not None:
+                instrumentation.merge(numbers)
+            for index, result in zip(chunk, results):
+                self.results[index] = result
+                if cache is not None:
+                    cache.set(keys[index], result)
+            done += len(chunk)
+            if self.store is not None:
+                self.store_results()
+            if progress is not None:
+                progress(done, len(self.cases))
+
+    def store_results(self):
+        """ Appends the results that follow the stored ones without a gap, and lets go of them. """
+        start = self.stored_results
+        while self.stored_results < len(self.cases) and self.results[self.stored_results] is not None:
+            self.stored_results += 1
+        self.store.append_rows(self.results[start:self.stored_results])
+        self.results[start:self.stored_results] = [None] * (self.stored_results - start)